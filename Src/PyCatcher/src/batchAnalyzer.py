@@ -0,0 +1,151 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+from pyCatcherCore import load_scan
+from evaluators import ConservativeEvaluator, GroupEvaluator
+from rules import create_rules, LocationAreaDatabaseRule, SpatialPlausibilityRule
+from localAreaDatabse import LocalAreaDatabase
+from cellTable import CellTable
+from settings import Cell_table, Location_coordinates
+
+#evaluates saved scans without the GUI, one file per worker process, and writes a verdict per station
+_evaluators = {'conservative': ConservativeEvaluator, 'group': GroupEvaluator}
+_station_columns = ('file', 'arfcn', 'provider', 'country', 'lac', 'cell', 'rxlev', 'evaluation')
+#projects, old and new, are saved as .cpf and session journals as .cpj
+_scan_extensions = ('.cpf', '.cpj')
+
+_options = None
+_location_database = None
+_cell_table = None
+
+def _init_worker(options):
+    #the databases are opened once per process, rules keep state between evaluations and are made per file
+    global _options, _location_database, _cell_table
+    _options = options
+    _location_database = None
+    if options.location:
+        _location_database = LocalAreaDatabase()
+        _location_database.open_read_only(options.location)
+    _cell_table = None
+    if os.path.exists(Cell_table):
+        _cell_table = CellTable(Cell_table)
+
+def _close_worker():
+    if _location_database:
+        _location_database.close()
+    if _cell_table:
+        _cell_table.close()
+
+def _create_rules(options):
+    rules = create_rules(_location_database, _cell_table)
+    for rule in rules:
+        if rule.identifier in options.enable:
+            rule.is_active = True
+        if rule.identifier in options.disable:
+            rule.is_active = False
+        if options.location and isinstance(rule, SpatialPlausibilityRule):
+            rule.set_observer(Location_coordinates.get(options.location))
+    return rules
+
+def analyze_file(path):
+    #returns (path, rows, error), rows hold the station columns and the result of every active rule
+    try:
+        station_list = load_scan(path)
+        rules = _create_rules(_options)
+        #the static rules are scored column-wise when numpy is installed, the others station by station
+        station_list.evaluate(rules, _evaluators[_options.evaluator](), columnar=True)
+    except Exception, error:
+        return path, [], '%s: %s'%(error.__class__.__name__, error)
+    rows = []
+    for station in station_list._get_unfiltered_list():
+        row = dict([(column, getattr(station, column, None)) for column in _station_columns[1:]])
+        row['file'] = path
+        row['rules'] = dict(station.rules_report)
+        rows.append(row)
+    return path, rows, None
+
+def _expand(paths):
+    #files named on the command line are always read, directories only contribute their scans
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted([os.path.join(path, name) for name in os.listdir(path)
+                                 if os.path.splitext(name)[1].lower() in _scan_extensions and
+                                 os.path.isfile(os.path.join(path, name))]))
+        else:
+            files.append(path)
+    return files
+
+def _write_csv(output, results, rule_identifiers):
+    writer = csv.writer(output)
+    writer.writerow(list(_station_columns) + rule_identifiers)
+    for path, rows, error in results:
+        for row in rows:
+            writer.writerow([row[column] for column in _station_columns] +
+                            [row['rules'].get(identifier, '') for identifier in rule_identifiers])
+
+def _write_json(output, results, rule_identifiers):
+    json.dump([row for path, rows, error in results for row in rows], output, indent=1, sort_keys=True)
+    output.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluates saved PyCatcher scans without the GUI.')
+    parser.add_argument('paths', nargs='+', help='projects, session journals or directories of them')
+    parser.add_argument('-e', '--evaluator', choices=sorted(_evaluators.keys()), default='conservative')
+    parser.add_argument('-f', '--format', choices=('csv', 'json'), default='csv')
+    parser.add_argument('-o', '--output', help='output file, standard output by default')
+    parser.add_argument('-l', '--location', help='location database to check against, enables its rule')
+    parser.add_argument('--enable', action='append', default=[], metavar='RULE', help='switch a rule on')
+    parser.add_argument('--disable', action='append', default=[], metavar='RULE', help='switch a rule off')
+    parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count())
+    options = parser.parse_args()
+    if options.location:
+        options.enable.append(LocationAreaDatabaseRule.identifier)
+
+    #opening the databases here as well reports a wrong location before any file is read
+    try:
+        _init_worker(options)
+    except (IOError, ValueError, sqlite3.Error), error:
+        parser.error(str(error))
+
+    files = _expand(options.paths)
+    if options.workers > 1 and len(files) > 1:
+        #connections must not be shared with forked workers, each opens its own
+        _close_worker()
+        pool = multiprocessing.Pool(min(options.workers, len(files)), _init_worker, (options,))
+        try:
+            results = pool.map(analyze_file, files, 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(analyze_file, files)
+
+    rule_identifiers = [rule.identifier for rule in create_rules()]
+    if options.output:
+        output = open(options.output, 'wb')
+    else:
+        output = sys.stdout
+    try:
+        if options.format == 'json':
+            _write_json(output, results, rule_identifiers)
+        else:
+            _write_csv(output, results, rule_identifiers)
+    finally:
+        if options.output:
+            output.close()
+
+    failed = [(path, error) for path, rows, error in results if error]
+    for path, error in failed:
+        sys.stderr.write('%s skipped, %s\n'%(path, error))
+    stations = sum([len(rows) for path, rows, error in results])
+    sys.stderr.write('%d stations in %d of %d files evaluated.\n'%(stations, len(files) - len(failed), len(files)))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
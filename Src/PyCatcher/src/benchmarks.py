@@ -0,0 +1,812 @@
+import argparse
+import BaseHTTPServer
+import copy
+import multiprocessing
+import os
+import pickle
+import SocketServer
+import sys
+import tempfile
+import threading
+import urlparse
+import time
+import random
+import shutil
+import sqlite3
+import subprocess
+from struct import pack, unpack
+from pyCatcherModel import BaseStationInformation, BaseStationInformationList
+from driverConnector import SysInfoParser
+from driverCapture import CaptureWriter, CaptureEvents, DriverStreams, ReplayProcessFactory
+from settings import Commands, Core_import_budget, Cell_ID_services, Lookup_concurrency
+from evaluators import ConservativeEvaluator
+from columnarEngine import ColumnarRuleEngine, columnar_engine_available
+from graphLayout import IncrementalLayout
+from localAreaDatabse import LocalAreaDatabase, Migrations
+from schemaMigrations import migrate
+import cellIDDatabase
+from cellIDDatabase import CellIDDatabase, CellIDDBStatus, CIDDatabases
+from lookupScheduler import LookupScheduler
+from offlineCellDatabase import OfflineCellDatabase, import_dump
+from cellTable import CellTable, write_cell_table
+import projectFormat
+from sessionJournal import SessionJournal, replay_journal
+import batchAnalyzer
+from rules import Rule, RuleResult, EvaluationContext, ProviderRule, ARFCNMappingRule, CountryMappingRule, LACMappingRule, UniqueCellIDRule, \
+    LACMedianRule, NeighbourhoodStructureRule, PureNeighbourhoodRule, DiscoveredNeighboursRule, CellIDDatabaseRule, \
+    RxChangeRule, LACChangeRule, PCHRule, SpatialPlausibilityRule
+
+def _make_station(arfcn, rng):
+    station = BaseStationInformation()
+    station.country = 'Germany'
+    station.provider = rng.choice(['T-Mobile', 'O2', 'Vodafone', 'E-Plus'])
+    station.arfcn = arfcn
+    station.rxlev = rng.randint(-110, -40)
+    station.lac = rng.choice([21013, 21014, 21015, 50945, 793, 138, 588])
+    station.cell = rng.randint(1, 65535)
+    station.bsic = '%d,%d'%(rng.randint(0, 7), rng.randint(0, 7))
+    station.neighbours = rng.sample(xrange(1024), 6)
+    return station
+
+def _make_stations(count, seed=4711):
+    rng = random.Random(seed)
+    return [_make_station(arfcn, rng) for arfcn in xrange(count)]
+
+def _timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+class _LinearStationList:
+    #the lookup strategy BaseStationInformationList used before it was indexed
+    def __init__(self):
+        self._base_station_list = []
+
+    def add_station(self, base_station):
+        for item in self._base_station_list:
+            if item.arfcn == base_station.arfcn:
+                item.times_scanned += 1
+                item.rxlev = base_station.rxlev
+                break
+        else:
+            self._base_station_list.append(base_station)
+
+    def get_station(self, arfcn):
+        for item in self._base_station_list:
+            if item.arfcn == arfcn:
+                return item
+
+def benchmark_station_store(count=10000, sightings=2000):
+    stations = _make_stations(count)
+    rng = random.Random(42)
+    resightings = [_make_station(rng.randrange(count), rng) for _ in xrange(sightings)]
+    lookups = [rng.randrange(count) for _ in xrange(sightings)]
+
+    print 'Station store, %d stations, %d re-sightings, %d lookups'%(count, sightings, sightings)
+    for name, store_class in (('linear list', _LinearStationList), ('indexed list', BaseStationInformationList)):
+        store = store_class()
+        fill = _timed(lambda: [store.add_station(station) for station in stations])
+        update = _timed(lambda: [store.add_station(station) for station in resightings])
+        lookup = _timed(lambda: [store.get_station(arfcn) for arfcn in lookups])
+        print '    %-14s fill %8.3fs   re-sight %8.3fs   lookup %8.3fs'%(name, fill, update, lookup)
+
+def _make_rules():
+    rules = [ProviderRule(), CountryMappingRule(), ARFCNMappingRule(), LACMappingRule(), UniqueCellIDRule(),
+             LACMedianRule(), NeighbourhoodStructureRule(), PureNeighbourhoodRule(), DiscoveredNeighboursRule(),
+             CellIDDatabaseRule(), LACChangeRule(), RxChangeRule(), PCHRule()]
+    for rule in rules:
+        rule.is_active = True
+    return rules
+
+def _make_resighting(station, rng):
+    resighting = copy.copy(station)
+    resighting.rxlev = station.rxlev + rng.randint(-3, 3)
+    resighting.neighbours = list(station.neighbours)
+    return resighting
+
+def benchmark_incremental_evaluation(count=5000, sightings=2000, new_cells=0.05):
+    rules = _make_rules()
+    evaluator = ConservativeEvaluator()
+    station_list = BaseStationInformationList()
+    stations = _make_stations(count)
+    for station in stations:
+        station_list.add_station(station)
+    rng = random.Random(42)
+    resightings = []
+    for _ in xrange(sightings):
+        if rng.random() < new_cells:
+            resightings.append(_make_station(count + len(resightings), rng))
+        else:
+            resightings.append(_make_resighting(rng.choice(stations), rng))
+
+    print 'Evaluation, %d stations, %d rules'%(count, len(rules))
+    full = _timed(station_list.evaluate, rules, evaluator)
+    print '    full pass              %8.3fms'%(full * 1000)
+
+    def sight_all():
+        for station in resightings:
+            station_list.add_station(station)
+            station_list.evaluate_pending(rules, evaluator)
+    incremental = _timed(sight_all)
+    print '    incremental per sighting %6.3fms'%(incremental * 1000 / sightings)
+
+class _LegacyPureNeighbourhoodRule(Rule):
+    #the pure neighbourhood rule as it was written before check_context, through the Rule helpers
+    is_active = True
+    identifier = 'Legacy Pure Neighbourhoods'
+
+    def check(self, arfcn, base_station_list):
+        neighbours = self._extract_neighbours(arfcn, base_station_list)
+        provider = self._extract_provider(arfcn, base_station_list)
+        for item in base_station_list:
+            if item.arfcn in neighbours and item.provider != provider:
+                return RuleResult.CRITICAL
+        return RuleResult.OK
+
+def benchmark_legacy_rules(count=500):
+    rule = PureNeighbourhoodRule()
+    rule.is_active = True
+    legacy_rule = _LegacyPureNeighbourhoodRule()
+    station_list = BaseStationInformationList()
+    for station in _make_stations(count):
+        station_list.add_station(station)
+    stations = station_list._get_unfiltered_list()
+
+    print 'Legacy rules, %d stations'%count
+    context_time = _timed(station_list.evaluate, [rule], ConservativeEvaluator())
+    results = [station.rules_report[rule.identifier] for station in stations]
+    legacy_time = _timed(station_list.evaluate, [legacy_rule], ConservativeEvaluator())
+    legacy_results = [station.rules_report[legacy_rule.identifier] for station in stations]
+    mismatches = len([1 for result, legacy_result in zip(results, legacy_results) if result != legacy_result])
+    print '    check_context %8.3fs'%context_time
+    print '    legacy check  %8.3fs'%legacy_time
+    print '    %d of %d results differ from check_context'%(mismatches, count)
+
+def benchmark_columnar_engine(count=20000):
+    rules = _make_rules()[:6]
+    evaluator = ConservativeEvaluator()
+    station_list = BaseStationInformationList()
+    for station in _make_stations(count):
+        station_list.add_station(station)
+    stations = station_list._get_unfiltered_list()
+
+    print 'Static rule set, %d stations, %d rules'%(count, len(rules))
+    context = EvaluationContext(stations)
+    rules_only = _timed(lambda: [rule.check_context(station.arfcn, context) for rule in rules for station in stations])
+    full = _timed(station_list.evaluate, rules, evaluator)
+    print '    scalar     rules %8.3fs   evaluate() %8.3fs'%(rules_only, full)
+    if not columnar_engine_available():
+        print '    columnar   skipped, numpy is not installed'
+        return
+    rules_only = _timed(lambda: ColumnarRuleEngine(stations).evaluate(rules))
+    full = _timed(station_list.evaluate, rules, evaluator, True)
+    print '    columnar   rules %8.3fs   evaluate() %8.3fs'%(rules_only, full)
+
+def _format_sysinfo_block(station):
+    frame = ' ' + ' '.join(['%02x'%byte for byte in xrange(23)])
+    lines = ['[SysInfo]',
+             'Country: %s'%station.country,
+             'Provider: %s'%station.provider,
+             'ARFCN: %d'%station.arfcn,
+             'Cell ID: %d'%station.cell,
+             'LAC: %d'%station.lac,
+             'BSIC: %s'%station.bsic,
+             'rxlev: %d'%station.rxlev,
+             'Neighbours: %s '%' '.join(map(str, station.neighbours))]
+    for label in ('SI1', 'SI3', 'SI4', 'SI2', 'SI2ter', 'SI2bis'):
+        lines.append('%s: %s'%(label, frame))
+    lines += ['[EndInfo]', '']
+    return [line + '\n' for line in lines]
+
+def benchmark_sysinfo_parser(count=20000):
+    log = []
+    for station in _make_stations(count):
+        log += _format_sysinfo_block(station)
+
+    print 'SysInfo parser, %d blocks, %d lines'%(count, len(log))
+    parser = SysInfoParser()
+    parsed = []
+    duration = _timed(lambda: parsed.extend(parser.parse(log)))
+    print '    parsed %d blocks in %.3fs, %d blocks/s'%(len(parsed), duration, len(parsed) / duration)
+
+def benchmark_replay_pipeline(count=2000, blocks_per_second=50.0):
+    capture_path = os.path.join(tempfile.mkdtemp(), 'benchmark.cap')
+    writer = CaptureWriter(capture_path)
+    session = writer.open_session(DriverStreams.SCAN, Commands['scan_command'])
+    rng = random.Random(42)
+    stations = _make_stations(count / 10)
+    for block in xrange(count):
+        for line in _format_sysinfo_block(_make_resighting(rng.choice(stations), rng)):
+            writer.write(session, DriverStreams.SCAN, CaptureEvents.LINE, line, block / blocks_per_second)
+    writer.close()
+
+    rules = _make_rules()
+    evaluator = ConservativeEvaluator()
+    station_list = BaseStationInformationList()
+    parser = SysInfoParser()
+
+    def replay():
+        process = ReplayProcessFactory(capture_path, 0).open(DriverStreams.SCAN, Commands['scan_command'])
+        for line in iter(process.stdout.readline, ''):
+            base_station = parser.feed(line)
+            if base_station:
+                station_list.add_station(base_station)
+                station_list.evaluate_pending(rules, evaluator)
+
+    print 'Replay at max speed, %d recorded blocks (%.0fs of scanning)'%(count, count / blocks_per_second)
+    duration = _timed(replay)
+    print '    parsed and evaluated in %.3fs, %d blocks/s'%(duration, count / duration)
+    os.remove(capture_path)
+
+def benchmark_graph_layout(count=500, updates=200):
+    rng = random.Random(42)
+    stations = _make_stations(count)
+    for station in stations:
+        #neighbour lists point at cells with nearby ARFCNs, like a real neighbourhood
+        station.neighbours = rng.sample([arfcn for arfcn in xrange(station.arfcn - 8, station.arfcn + 9)
+                                         if 0 <= arfcn < count and arfcn != station.arfcn], 6)
+    station_list = BaseStationInformationList()
+    for station in stations:
+        station_list.add_station(station)
+
+    print 'Graph layout, %d nodes, %d neighbour list changes'%(count, updates)
+    layout = IncrementalLayout()
+    nodes, edges = station_list.get_graph_elements()
+    full = _timed(layout.update, nodes.keys(), edges)
+    print '    initial layout %8.3fms'%(full * 1000)
+
+    def change_all():
+        for _ in xrange(updates):
+            station = station_list.get_station(rng.randrange(count))
+            station.neighbours = station.neighbours[1:] + [rng.randrange(count)]
+            nodes, edges = station_list.get_graph_elements()
+            layout.update(nodes.keys(), edges)
+    incremental = _timed(change_all)
+    print '    per update     %8.3fms'%(incremental * 1000 / updates)
+
+def _concatenated_dot_code(stations):
+    #how get_dot_code built the graph before it was cached
+    code = ''
+    for station in stations:
+        if station.evaluation == RuleResult.OK:
+            code += str(station.arfcn) + r' [style = filled, fillcolor = green]; '
+        elif station.evaluation == RuleResult.CRITICAL:
+            code += str(station.arfcn) + r' [style = filled, fillcolor = red]; '
+        else:
+            code += str(station.arfcn) + r' [style = filled, fillcolor = white]; '
+        for neighbour in station.neighbours:
+            code += str(station.arfcn) + r' -> ' + str(neighbour) + r'; '
+    return r'digraph bsnetwork { ' + code + r'}'
+
+def benchmark_graph_model(count=5000, redraws=200):
+    station_list = BaseStationInformationList()
+    for station in _make_stations(count):
+        station_list.add_station(station)
+    stations = station_list._get_unfiltered_list()
+    rng = random.Random(42)
+
+    print 'DOT generation, %d stations, %d redraws'%(count, redraws)
+    concatenated = _timed(lambda: [_concatenated_dot_code(stations) for _ in xrange(redraws)])
+    print '    concatenated         %8.3fms per redraw'%(concatenated * 1000 / redraws)
+    station_list.get_dot_code()
+    unchanged = _timed(lambda: [station_list.get_dot_code() for _ in xrange(redraws)])
+    print '    cached, unchanged    %8.3fms per redraw'%(unchanged * 1000 / redraws)
+
+    def recolour_and_redraw():
+        for _ in xrange(redraws):
+            station = rng.choice(stations)
+            if station.evaluation == RuleResult.CRITICAL:
+                station.evaluation = RuleResult.OK
+            else:
+                station.evaluation = RuleResult.CRITICAL
+            station_list.get_dot_code()
+    changed = _timed(recolour_and_redraw)
+    print '    cached, one change   %8.3fms per redraw'%(changed * 1000 / redraws)
+
+def _per_station_upsert(connection, stations):
+    #how LocalAreaDatabase stored a survey before the bulk upsert, one lookup and one commit per station
+    cursor = connection.cursor()
+    for station in stations:
+        cursor.execute('SELECT * FROM basestations WHERE cellid =%d'%station.cell)
+        result = cursor.fetchall()
+        if result:
+            rxmin, rxmax, sightings = result[0][6:9]
+            cursor.execute('UPDATE basestations SET rxmin=?, rxmax=?, sightings=? WHERE cellid=?',
+                           (min(rxmin, station.rxlev), max(rxmax, station.rxlev), sightings + station.times_scanned,
+                            station.cell))
+        else:
+            cursor.execute('''INSERT INTO basestations(cellid, country, provider, arfcn, bsic, lac, rxmin, rxmax, sightings)
+            VALUES (?,?,?,?,?,?,?,?,?)''', (station.cell, station.country, station.provider, station.arfcn, station.bsic, station.lac,
+                            station.rxlev, station.rxlev, station.times_scanned))
+        connection.commit()
+
+def benchmark_local_area_database(count=100000, per_station_count=2000):
+    directory = tempfile.mkdtemp()
+    stations = _make_stations(count)
+    for station in stations:
+        station.cell = station.arfcn
+    rng = random.Random(42)
+    resightings = [_make_resighting(station, rng) for station in stations]
+
+    print 'Local area database, %d stations'%count
+    database = LocalAreaDatabase(directory)
+    database.load_or_create_database('bulk')
+    insert = _timed(database.insert_or_alter_base_stations, stations)
+    update = _timed(database.insert_or_alter_base_stations, resightings)
+    print '    bulk upsert       insert %8.3fs   update %8.3fs'%(insert, update)
+
+    database.load_or_create_database('per_station')
+    connection = sqlite3.connect(os.path.join(directory, 'per_station.db'))
+    connection.execute('DROP INDEX basestations_cellid')
+    per_station = _timed(_per_station_upsert, connection, stations[:per_station_count])
+    connection.close()
+    print '    per station       insert %8.3fs   (%d stations, at least %.0fs for %d)'%(per_station, per_station_count,
+                                                                               per_station * count / per_station_count, count)
+    shutil.rmtree(directory)
+
+def benchmark_local_area_cache(count=200000, lookups=10000, linear_lookups=50):
+    directory = tempfile.mkdtemp()
+    stations = _make_stations(count)
+    for station in stations:
+        station.cell = station.arfcn
+    rng = random.Random(42)
+    cells = [rng.randrange(count) for _ in xrange(lookups)]
+
+    print 'Local area database cache, %d cells, %d lookups'%(count, lookups)
+    database = LocalAreaDatabase(directory)
+    database.load_or_create_database('cache')
+    database.insert_or_alter_base_stations(stations)
+    reload = _timed(database.refresh_object_cache)
+    entries = database.cache.values()
+    linear = _timed(lambda: [[entry for entry in entries if entry.cellID == cell] for cell in cells[:linear_lookups]])
+    hashed = _timed(lambda: [database.get_station(cell) for cell in cells])
+    print '    reload %8.3fs'%reload
+    print '    linear scan   %10.3fus per lookup'%(linear * 1000000 / linear_lookups)
+    print '    hashed        %10.3fus per lookup'%(hashed * 1000000 / lookups)
+    shutil.rmtree(directory)
+
+def _connect_per_lookup(path, cid):
+    #how fetch_id_from_local resolved a cell before connections were pooled
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.execute('SELECT * FROM basestations WHERE cellid =%d'%cid)
+    found = bool(cursor.fetchall())
+    cursor.close()
+    connection.close()
+    return found
+
+def benchmark_local_cell_lookup(count=20000, scan=500):
+    directory = tempfile.mkdtemp()
+    stations = _make_stations(count)
+    for station in stations:
+        station.cell = station.arfcn
+    database = LocalAreaDatabase(directory)
+    database.load_or_create_database('lookup')
+    database.insert_or_alter_base_stations(stations)
+    rng = random.Random(42)
+    cells = [rng.randrange(2 * count) for _ in xrange(scan)]
+    path = os.path.join(directory, 'lookup.db')
+
+    print 'Local cell ID lookup, %d cells in the database, scan of %d cells'%(count, scan)
+    per_cell = _timed(lambda: [_connect_per_lookup(path, cid) for cid in cells])
+    print '    connection per lookup %8.3fms'%(per_cell * 1000)
+    database_path = cellIDDatabase.Database_path
+    cellIDDatabase.Database_path = directory
+    try:
+        cell_id_database = CellIDDatabase()
+        batch = _timed(cell_id_database.lookup_many, cells, 'lookup')
+        print '    lookup_many           %8.3fms'%(batch * 1000)
+        cell_id_database.close()
+    finally:
+        cellIDDatabase.Database_path = database_path
+    shutil.rmtree(directory)
+
+class _StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #answers like the cell ID services, by cell id: Google knows cid % 3 == 0, OpenCellID knows cid % 3 == 1 and
+    #fails with a server error for even cells of the rest, which then end up at the local database
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers['Content-Length']))
+        cid = unpack('>hqh2sh13sh5sh3sBiiihiiiiii', request)[15]
+        if cid % 3 == 0:
+            body = pack('>hBiiiiih', 0, 0, 0, 52500000, 13400000, 0, 0, 0)
+        else:
+            body = 'not found'
+        self._reply(CIDDatabases.GOOGLE, 200, body)
+
+    def do_GET(self):
+        cid = int(urlparse.parse_qs(urlparse.urlparse(self.path).query)['cellid'][0])
+        if cid % 3 == 1:
+            self._reply(CIDDatabases.OPENCID, 200, '<rsp stat="ok">\n<cell lat="52.5" lon="13.4" range="500"/>\n</rsp>')
+        elif cid % 2 == 0:
+            self._reply(CIDDatabases.OPENCID, 500, 'server error')
+        else:
+            self._reply(CIDDatabases.OPENCID, 200, '<rsp stat="fail">\n<err info="cell not found"/>\n</rsp>')
+
+    def _reply(self, service, code, body):
+        server = self.server
+        server.lock.acquire()
+        server.running[service] = server.running.get(service, 0) + 1
+        server.peak[service] = max(server.peak.get(service, 0), server.running[service])
+        server.lock.release()
+        time.sleep(server.delay)
+        server.lock.acquire()
+        server.running[service] -= 1
+        server.lock.release()
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _expected_lookups(cid, local_cells):
+    #the (service, status) pairs a station has to go through, in fallback order
+    if cid % 3 == 0:
+        return [(CIDDatabases.GOOGLE, CellIDDBStatus.CONFIRMED)]
+    lookups = [(CIDDatabases.GOOGLE, CellIDDBStatus.NOT_IN_DB)]
+    if cid % 3 == 1:
+        return lookups + [(CIDDatabases.OPENCID, CellIDDBStatus.CONFIRMED)]
+    lookups.append((CIDDatabases.OPENCID, CellIDDBStatus.ERROR))
+    if cid in local_cells:
+        return lookups + [(CIDDatabases.LOCAL, CellIDDBStatus.CONFIRMED)]
+    return lookups + [(CIDDatabases.LOCAL, CellIDDBStatus.NOT_IN_DB)]
+
+def _run_lookups(scheduler, stations, providers, local):
+    results = {}
+    finished = threading.Event()
+    def result_callback(station, provider, status, latitude, longitude):
+        results.setdefault(station.cell, []).append((provider, status))
+    scheduler.lookup(stations, providers, local, result_callback, lambda looked_up, resolved: finished.set())
+    finished.wait(300)
+    return results
+
+def benchmark_remote_lookups(count=54, delay=0.05):
+    #LookupScheduler and the cell ID fetchers against a local stub of the services configured in Cell_ID_services
+    rng = random.Random(42)
+    stations = []
+    for cid in xrange(1, count + 1):
+        station = _make_station(cid, rng)
+        station.cell = cid
+        stations.append(station)
+    local_cells = set([station.cell for station in stations if station.cell % 4 == 0])
+    directory = tempfile.mkdtemp()
+    database = LocalAreaDatabase(directory)
+    database.load_or_create_database('lookup')
+    database.insert_or_alter_base_stations([station for station in stations if station.cell in local_cells])
+    database.close()
+
+    server = _StubServer(('127.0.0.1', 0), _StubHandler)
+    server.delay = delay
+    server.lock = threading.Lock()
+    server.running = {}
+    server.peak = {}
+    serve = threading.Thread(target=server.serve_forever)
+    serve.setDaemon(True)
+    serve.start()
+    port = server.server_address[1]
+    services = dict(Cell_ID_services)
+    database_path = cellIDDatabase.Database_path
+    Cell_ID_services.update({'google_host': '127.0.0.1', 'google_port': port,
+                             'open_cell_id_url': 'http://127.0.0.1:%d/cell/get'%port, 'timeout': 5})
+    cellIDDatabase.Database_path = directory
+    try:
+        cell_id_database = CellIDDatabase()
+        providers = [(CIDDatabases.GOOGLE, lambda station:
+                        cell_id_database.fetch_id_from_Google(station.cell, station.lac, station.country)),
+                     (CIDDatabases.OPENCID, lambda station:
+                        cell_id_database.fetch_id_from_OpenCellID(station.cell, station.lac, station.country,
+                                                                  station.provider))]
+        local = (CIDDatabases.LOCAL, lambda stations:
+                    cell_id_database.lookup_many([station.cell for station in stations], 'lookup'))
+        deliver = lambda callback, *args: callback(*args)
+
+        print 'Remote cell ID lookups, %d stations, %dms per request'%(count, delay * 1000)
+        for name, scheduler in (('sequential', LookupScheduler(deliver, 1)),
+                                ('scheduled', LookupScheduler(deliver, Lookup_concurrency['workers'],
+                                                              Lookup_concurrency['limits']))):
+            server.peak = {}
+            results = []
+            elapsed = _timed(lambda: results.append(_run_lookups(scheduler, stations, providers, local)))
+            results = results[0]
+            wrong = len([1 for station in stations
+                         if results.get(station.cell) != _expected_lookups(station.cell, local_cells)])
+            print '    %-10s %8.3fs, %d of %d stations with wrong results or fallback order'%(
+                name, elapsed, wrong, count)
+        for service in (CIDDatabases.GOOGLE, CIDDatabases.OPENCID):
+            print '    %-12s at most %d parallel requests, limit %s'%(
+                service, server.peak.get(service, 0), Lookup_concurrency['limits'].get(service))
+        cell_id_database.close()
+    finally:
+        Cell_ID_services.clear()
+        Cell_ID_services.update(services)
+        cellIDDatabase.Database_path = database_path
+        server.shutdown()
+        server.server_close()
+    shutil.rmtree(directory)
+
+def _write_opencellid_dump(path, count, rng):
+    dump = open(path, 'w')
+    dump.write('radio,mcc,net,area,cell,unit,lon,lat,range,samples,changeable,created,updated,averageSignal\n')
+    for cid in xrange(count):
+        dump.write('%s,262,%d,%d,%d,0,%.6f,%.6f,%d,%d,1,1325376000,1325376000,0\n'%(
+            rng.choice(['GSM', 'GSM', 'UMTS']), rng.choice([1, 2, 3, 7]), rng.randint(1, 65535), cid,
+            rng.uniform(6.0, 15.0), rng.uniform(47.5, 55.0), rng.randint(100, 20000), rng.randint(1, 50)))
+    dump.close()
+
+def benchmark_offline_import(count=500000, lookups=10000):
+    directory = tempfile.mkdtemp()
+    dump_path = os.path.join(directory, 'cell_towers.csv')
+    database_path = os.path.join(directory, 'opencellid.db')
+    rng = random.Random(42)
+    _write_opencellid_dump(dump_path, count, rng)
+
+    print 'OpenCellID import, %d dump rows'%count
+    imported = []
+    duration = _timed(lambda: imported.append(import_dump(dump_path, database_path)))
+    print '    imported %d GSM cells in %.3fs, %d rows/s'%(imported[0], duration, count / duration)
+
+    database = OfflineCellDatabase(database_path)
+    keys = database._connection.execute('SELECT mcc, mnc, lac, cid FROM cells ORDER BY RANDOM() LIMIT ?',
+                                        (lookups,)).fetchall()
+    lookup = _timed(lambda: [database.lookup(*key) for key in keys])
+    print '    lookup        %8.3fus'%(lookup * 1000000 / len(keys))
+    near = []
+    radius = _timed(lambda: near.extend(database.cells_near(51.0, 10.0, 5000)))
+    print '    cells in 5km  %8.3fms (%d cells)'%(radius * 1000, len(near))
+    database.close()
+    shutil.rmtree(directory)
+
+def benchmark_cell_table(count=1000000, lookups=100000):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'cells.bin')
+    rng = random.Random(42)
+    cells = [(262, rng.choice([1, 2, 3, 7]), rng.randint(1, 65535), rng.randint(1, 65535), 51.0, 10.0, 1000)
+             for _ in xrange(count)]
+
+    print 'Cell table, %d cells, %d lookups'%(count, lookups)
+    written = []
+    write = _timed(lambda: written.append(write_cell_table(path, cells)))
+    print '    written in %.3fs, %d bytes'%(write, os.path.getsize(path))
+    table = []
+    opened = _timed(lambda: table.append(CellTable(path)))
+    table = table[0]
+    known = [cell[:4] for cell in rng.sample(cells, lookups / 2)]
+    unknown = [(262, 1, rng.randint(1, 65535), rng.randint(65536, 1000000)) for _ in xrange(lookups / 2)]
+    lookup = _timed(lambda: [table.lookup(*key) for key in known + unknown])
+    print '    open          %8.3fms'%(opened * 1000)
+    print '    lookup        %8.3fus'%(lookup * 1000000 / lookups)
+    table.close()
+    shutil.rmtree(directory)
+
+def benchmark_spatial_plausibility(count=20000, sightings=100000):
+    stations = _make_stations(count)
+    rng = random.Random(42)
+    for station in stations:
+        station.db_status = cellIDDatabase.CellIDDBStatus.CONFIRMED
+        station.latitude = 51.0 + rng.uniform(-0.2, 0.2)
+        station.longitude = 10.0 + rng.uniform(-0.2, 0.2)
+    context = EvaluationContext(stations)
+    rule = SpatialPlausibilityRule()
+    arfcns = [rng.choice(stations).arfcn for _ in xrange(sightings)]
+
+    print 'Spatial plausibility, %d located cells, %d sightings'%(count, sightings)
+    rule.set_observer((51.0, 10.0))
+    prepare = _timed(rule.check_context, stations[0].arfcn, context)
+    sighting = _timed(lambda: [rule.check_context(arfcn, context) for arfcn in arfcns])
+    print '    prepare scan  %8.3fms'%(prepare * 1000)
+    print '    per sighting  %8.3fus'%(sighting * 1000000 / sightings)
+
+def benchmark_schema_migration(count=200000, queries=200):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'legacy.db')
+    rng = random.Random(42)
+    connection = sqlite3.connect(path)
+    #a database as written before schema versions existed, without any index
+    Migrations[0](connection.cursor())
+    connection.executemany('INSERT INTO basestations VALUES (?,?,?,?,?,?,?,?,?)',
+                           [(rng.randint(1, 65535), 'Germany', rng.choice(['T-Mobile', 'Vodafone', 'O2', 'E-Plus']),
+                             rng.randint(1, 124), '7/3', rng.randint(1, 65535), -90, -60, 3) for _ in xrange(count)])
+    connection.commit()
+    keys = connection.execute('SELECT lac, cellid FROM basestations ORDER BY RANDOM() LIMIT ?', (queries,)).fetchall()
+    query = 'SELECT * FROM basestations WHERE lac=? AND cellid=?'
+
+    print 'Schema migration, %d stations, %d queries by (lac, cellid)'%(count, queries)
+    scan = _timed(lambda: [connection.execute(query, key).fetchall() for key in keys])
+    upgrade = _timed(migrate, connection, Migrations)
+    indexed = _timed(lambda: [connection.execute(query, key).fetchall() for key in keys])
+    print '    upgrade       %8.3fs'%upgrade
+    print '    query         %8.3fms before   %8.3fms after'%(scan * 1000 / queries, indexed * 1000 / queries)
+    connection.close()
+    shutil.rmtree(directory)
+
+def benchmark_sighting_history(cells=2000, sightings=200000, per_row_count=2000):
+    directory = tempfile.mkdtemp()
+    stations = _make_stations(cells)
+    for station in stations:
+        station.cell = station.arfcn
+    rng = random.Random(42)
+    observed = [_make_resighting(rng.choice(stations), rng) for _ in xrange(sightings)]
+
+    print 'Sighting history, %d cells, %d sightings'%(cells, sightings)
+    database = LocalAreaDatabase(directory)
+    database.load_or_create_database('history')
+    database.insert_or_alter_base_stations(stations)
+    def append():
+        for station in observed:
+            database.record_sighting(station)
+        database.flush_sightings()
+    record = _timed(append)
+    compact = _timed(database.compact_history)
+    print '    batched append %8.3fus per sighting'%(record * 1000000 / sightings)
+    print '    compaction     %8.3fs'%compact
+
+    connection = sqlite3.connect(os.path.join(directory, 'history.db'))
+    def per_row():
+        for station in observed[:per_row_count]:
+            connection.execute('INSERT INTO sightings(cellid, lac, timestamp, rxlev) VALUES (?,?,?,?)',
+                               (station.cell, station.lac, time.time(), station.rxlev))
+            connection.commit()
+    single = _timed(per_row)
+    connection.close()
+    print '    commit per row %8.3fus per sighting'%(single * 1000000 / per_row_count)
+    shutil.rmtree(directory)
+
+def _make_project(count, rng):
+    station_list = BaseStationInformationList()
+    stations = _make_stations(count)
+    for station in stations:
+        for field in ('system_info_t1', 'system_info_t2', 'system_info_t3', 'system_info_t4'):
+            setattr(station, field, [''] + ['%02x'%rng.randint(0, 255) for _ in xrange(23)])
+        station.rules_report = dict([(rule.identifier, RuleResult.OK) for rule in _make_rules()])
+        station.evaluation_report = {'Decision founded on': 'None'}
+    station_list.replace_stations(stations)
+    return station_list
+
+def benchmark_project_format(count=5000):
+    directory = tempfile.mkdtemp()
+    station_list = _make_project(count, random.Random(42))
+    legacy_path = os.path.join(directory, 'legacy.cpf')
+    path = os.path.join(directory, 'project.cpf')
+
+    def save_legacy():
+        legacy = open(legacy_path, 'w')
+        pickle.dump(station_list, legacy)
+        legacy.close()
+
+    print 'Project format, %d stations'%count
+    for name, save, load, target in (('pickle', save_legacy, projectFormat.load_legacy_project, legacy_path),
+                                     ('binary', lambda: projectFormat.save_project(station_list, path),
+                                      projectFormat.load_project, path)):
+        saved = _timed(save)
+        loaded = _timed(load, target)
+        print '    %-8s save %8.3fs   load %8.3fs   %9d bytes'%(name, saved, loaded, os.path.getsize(target))
+    shutil.rmtree(directory)
+
+def benchmark_session_journal(count=2000, sightings=50000):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'session.cpj')
+    rng = random.Random(42)
+    stations = _make_stations(count)
+    observed = stations + [_make_resighting(rng.choice(stations), rng) for _ in xrange(sightings - count)]
+    station_list = BaseStationInformationList()
+
+    print 'Session journal, %d stations, %d sightings'%(count, sightings)
+    journal = SessionJournal(path, compact_records=sightings + 1)
+    journal.open()
+    def append():
+        for station in observed:
+            journal.append_sighting(station)
+            station_list.add_station(station)
+        journal.sync()
+    appended = _timed(append)
+    size = os.path.getsize(path)
+    replayed = _timed(replay_journal, path)
+    compacted = _timed(journal.compact, station_list)
+    print '    append        %8.3fus per sighting, %d bytes'%(appended * 1000000 / sightings, size)
+    print '    replay        %8.3fs'%replayed
+    print '    compaction    %8.3fs, %d bytes'%(compacted, os.path.getsize(path))
+    snapshot = _timed(projectFormat.save_project, station_list, os.path.join(directory, 'project.cpf'))
+    print '    project save  %8.3fs, the cost of every save without the journal'%snapshot
+    journal.close()
+    shutil.rmtree(directory)
+
+def benchmark_lazy_project(count=5000, reports=100):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'project.cpf')
+    projectFormat.save_project(_make_project(count, random.Random(42)), path)
+
+    print 'Lazy project loading, %d stations, %d reports'%(count, reports)
+    eager = _timed(projectFormat.load_project, path)
+    station_list = []
+    lazy = _timed(lambda: station_list.append(projectFormat.load_project(path, lazy=True)))
+    station_list = station_list[0]
+    arfcns = random.Random(42).sample(xrange(count), reports)
+    report = _timed(lambda: [station_list.create_report(arfcn) for arfcn in arfcns])
+    print '    eager load    %8.3fs'%eager
+    print '    lazy load     %8.3fs'%lazy
+    print '    first report  %8.3fms'%(report * 1000 / reports)
+    shutil.rmtree(directory)
+
+def benchmark_batch_analyzer(files=16, count=1000):
+    directory = tempfile.mkdtemp()
+    paths = []
+    for number in xrange(files):
+        path = os.path.join(directory, 'scan_%d.cpf'%number)
+        projectFormat.save_project(_make_project(count, random.Random(number)), path)
+        paths.append(path)
+    options = argparse.Namespace(location=None, enable=[], disable=[], evaluator='conservative')
+
+    workers = multiprocessing.cpu_count()
+    print 'Batch analyzer, %d files of %d stations, %d workers'%(files, count, workers)
+    batchAnalyzer._init_worker(options)
+    serial = _timed(lambda: map(batchAnalyzer.analyze_file, paths))
+    pool = multiprocessing.Pool(workers, batchAnalyzer._init_worker, (options,))
+    parallel = _timed(lambda: pool.map(batchAnalyzer.analyze_file, paths, 1))
+    pool.close()
+    pool.join()
+    print '    one process   %8.3fs'%serial
+    print '    process pool  %8.3fs'%parallel
+    shutil.rmtree(directory)
+
+_core_import_probe = '''import sys, time
+start = time.time()
+import pyCatcherCore
+print time.time() - start
+print ' '.join([name for name in ('gtk', 'gobject', 'numpy', 'urllib2', 'httplib') if name in sys.modules])
+'''
+
+def benchmark_core_import(runs=10):
+    #every run is a fresh interpreter, the first one also writes the .pyc files
+    source = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for run in xrange(runs + 1):
+        output = subprocess.check_output([sys.executable, '-c', _core_import_probe], cwd=source)
+        lines = output.split('\n')
+        times.append(float(lines[0]))
+        modules = lines[1].split()
+    times = sorted(times[1:])
+    median = times[len(times) // 2]
+    print 'Core import, %d fresh interpreters'%runs
+    print '    median        %8.3fms'%(median * 1000)
+    print '    slowest       %8.3fms'%(times[-1] * 1000)
+    print '    budget        %8.3fms, %s'%(Core_import_budget * 1000, 'met' if median <= Core_import_budget else 'EXCEEDED')
+    if modules:
+        print '    loaded by the core: %s'%', '.join(modules)
+
+Benchmarks = {
+    'station_store': benchmark_station_store,
+    'incremental_evaluation': benchmark_incremental_evaluation,
+    'legacy_rules': benchmark_legacy_rules,
+    'columnar_engine': benchmark_columnar_engine,
+    'sysinfo_parser': benchmark_sysinfo_parser,
+    'replay_pipeline': benchmark_replay_pipeline,
+    'graph_layout': benchmark_graph_layout,
+    'graph_model': benchmark_graph_model,
+    'local_area_database': benchmark_local_area_database,
+    'local_area_cache': benchmark_local_area_cache,
+    'local_cell_lookup': benchmark_local_cell_lookup,
+    'remote_lookups': benchmark_remote_lookups,
+    'offline_import': benchmark_offline_import,
+    'cell_table': benchmark_cell_table,
+    'spatial_plausibility': benchmark_spatial_plausibility,
+    'schema_migration': benchmark_schema_migration,
+    'sighting_history': benchmark_sighting_history,
+    'project_format': benchmark_project_format,
+    'session_journal': benchmark_session_journal,
+    'lazy_project': benchmark_lazy_project,
+    'batch_analyzer': benchmark_batch_analyzer,
+    'core_import': benchmark_core_import,
+}
+
+def main():
+    names = sys.argv[1:] or sorted(Benchmarks.keys())
+    for name in names:
+        Benchmarks[name]()
+
+if __name__ == '__main__':
+    main()
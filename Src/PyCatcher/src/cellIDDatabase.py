@@ -1,8 +1,6 @@
 import re
-import urllib2
-from settings import Open_Cell_ID_Key
+from settings import Open_Cell_ID_Key, Cell_ID_services
 from struct import pack, unpack
-from httplib import HTTP
 import sqlite3
 import os
 from settings import Database_path
@@ -12,6 +10,7 @@ class CIDDatabases:
     GOOGLE = 'Google'
     OPENCID = 'Open Cell ID'
     LOCAL = 'Local'
+    OFFLINE = 'Offline'
 
 class Translator:
     Country = {
@@ -37,22 +36,75 @@ class CellIDDBStatus:
     NOT_IN_DB = 'Not in DB.'
 
 class CellIDDatabase:
+    #sqlite limits the number of bound parameters per statement
+    _lookup_chunk = 500
 
+    def __init__(self, lookup_cache=None, offline_database=None):
+        self._connections = {}
+        self._lookup_cache = lookup_cache
+        self._offline_database = offline_database
 
-    def fetch_id_from_OpenCellID(self,cid, lac, country, provider):
-        key_ocid = Open_Cell_ID_Key
+    def has_offline_database(self):
+        return self._offline_database is not None
+
+    def fetch_id_from_offline(self, cid, lac, country, provider):
+        if not self._offline_database:
+            return CellIDDBStatus.ERROR, 0, 0
+        mcc = Translator.MCC[country]
+        mnc = int(Translator.Provider[provider])
+        result = self._offline_database.lookup(mcc, mnc, lac, cid)
+        if not result:
+            return CellIDDBStatus.NOT_IN_DB, 0, 0
+        latitude, longitude, range = result
+        if range > 10000:
+            return CellIDDBStatus.APPROXIMATED, latitude, longitude
+        return CellIDDBStatus.CONFIRMED, latitude, longitude
 
+    def fetch_id_from_OpenCellID(self,cid, lac, country, provider):
         mcc = Translator.MCC[country]
         mnc = Translator.Provider[provider]
-        
-        url = 'http://www.opencellid.org/cell/get?key=%s&mnc=%s&mcc=%d&lac=%d&cellid=%d'%(key_ocid,mnc,mcc,lac,cid)
-        response = urllib2.urlopen(url).read()
+        key = (mcc, int(mnc), lac, cid, CIDDatabases.OPENCID)
+        cached = self._get_cached(key)
+        if cached:
+            return cached
+        status, latitude, longitude, range = self._request_OpenCellID(cid, lac, mcc, mnc)
+        self._put_cached(key, status, latitude, longitude, range)
+        return status, latitude, longitude
+
+    def fetch_id_from_Google(self, cid, lac, country):
+        #the google request carries no network code, its answers are cached for any mnc
+        key = (Translator.MCC.get(country), -1, lac, cid, CIDDatabases.GOOGLE)
+        cached = self._get_cached(key)
+        if cached:
+            return cached
+        status, latitude, longitude = self._request_Google(cid, lac, country)
+        self._put_cached(key, status, latitude, longitude, None)
+        return status, latitude, longitude
+
+    def _get_cached(self, key):
+        if not self._lookup_cache:
+            return None
+        cached = self._lookup_cache.get(*key)
+        if cached:
+            return cached[:3]
+        return None
+
+    def _put_cached(self, key, status, latitude, longitude, range):
+        if self._lookup_cache:
+            self._lookup_cache.put(*(key + (status, latitude, longitude, range)))
+
+    def _request_OpenCellID(self, cid, lac, mcc, mnc):
+        #the http modules are imported by the lookups, offline use of the databases does not need them
+        import urllib2
+        key_ocid = Open_Cell_ID_Key
+
+        url = '%s?key=%s&mnc=%s&mcc=%d&lac=%d&cellid=%d'%(Cell_ID_services['open_cell_id_url'],key_ocid,mnc,mcc,lac,cid)
+        response = urllib2.urlopen(url, timeout=Cell_ID_services['timeout']).read()
 
         status = (re.search(r'stat="(.+)"',response)).group(1)
 
         if status != 'ok':
-            status = CellIDDBStatus.ERROR
-            return
+            return CellIDDBStatus.ERROR, 0, 0, None
 
         match = re.search(r'lat="(\d+\.\d+)".*lon="(\d+\.\d+).*range="(\d+)"',response)
         latitude,longitude,range = match.group(1),match.group(2),match.group(3)
@@ -68,10 +120,10 @@ class CellIDDatabase:
         if latitude == 0 or longitude == 0:
             status = CellIDDBStatus.NOT_IN_DB
 
-        return status, latitude, longitude
+        return status, latitude, longitude, int(range)
 
 
-    def fetch_id_from_Google(self, cid, lac, country):
+    def _request_Google(self, cid, lac, country):
         latitude = 0
         longitude = 0
         device = "Motorola C123"
@@ -86,48 +138,65 @@ class CellIDDatabase:
             3, 0, cid, lac,
             0, 0, 0, 0)
 
-        http = HTTP('www.google.com', 80)
-        http.putrequest('POST', '/glm/mmap')
-        http.putheader('Content-Type', 'application/binary')
-        http.putheader('Content-Length', str(len(b_string)))
-        http.endheaders()
-        http.send(b_string)
-        code, msg, headers = http.getreply()
+        from httplib import HTTPConnection
+        http = HTTPConnection(Cell_ID_services['google_host'], Cell_ID_services['google_port'],
+                              timeout=Cell_ID_services['timeout'])
+        http.request('POST', '/glm/mmap', b_string, {'Content-Type':'application/binary'})
+        response = http.getresponse()
         try:
-            bytes = http.file.read()
+            bytes = response.read()
             (a, b,errorCode, latitude, longitude, c, d, e) = unpack(">hBiiiiih",bytes)
             latitude /= 1000000.0
             longitude /= 1000000.0
             status = CellIDDBStatus.CONFIRMED
         except:
             status = CellIDDBStatus.NOT_IN_DB
+        http.close()
 
         return status, latitude, longitude
 
     def fetch_id_from_local(self, cid, database):
-        database += '.db'
-        path = os.path.join(Database_path, database)
-        if os.path.exists(path):
-            connection = sqlite3.connect(path)
+        return self.lookup_many([cid], database)[cid]
+
+    def lookup_many(self, cell_ids, database):
+        #resolves a whole scan against a local database, cell id -> (status, latitude, longitude)
+        results = {}
+        connection = self._get_connection(database)
+        if not connection:
+            for cid in cell_ids:
+                results[cid] = CellIDDBStatus.ERROR, 0, 0
+            return results
+        cell_ids = list(set(cell_ids))
+        #location databases have no coordinates, imported cell databases do
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(basestations)')]
+        if 'latitude' in columns and 'longitude' in columns:
+            select = 'SELECT cellid, latitude, longitude FROM basestations WHERE cellid IN (%s)'
         else:
-            return CellIDDBStatus.ERROR,0,0
+            select = 'SELECT cellid, 0, 0 FROM basestations WHERE cellid IN (%s)'
+        for start in xrange(0, len(cell_ids), self._lookup_chunk):
+            chunk = cell_ids[start:start + self._lookup_chunk]
+            sql = select%','.join(['?'] * len(chunk))
+            for cid, latitude, longitude in connection.execute(sql, chunk):
+                if not results.has_key(cid):
+                    results[cid] = CellIDDBStatus.CONFIRMED, latitude or 0, longitude or 0
+        for cid in cell_ids:
+            if not results.has_key(cid):
+                results[cid] = CellIDDBStatus.NOT_IN_DB, 0, 0
+        return results
+
+    def _get_connection(self, database):
+        path = os.path.join(Database_path, database + '.db')
+        connection = self._connections.get(path)
         if connection:
-            cursor = connection.cursor()
-        else:
-            return CellIDDBStatus.ERROR,0,0
-
-        sql = 'SELECT * FROM basestations WHERE cellid =%d'%cid
-        cursor.execute(sql)
-        try:
-            result = (cursor.fetchall())[0]
-        except:
-            result = None
-
-        if result:
-            cursor.close()
-            connection.close()
-            return CellIDDBStatus.CONFIRMED,0,0
-        else:
-            cursor.close()
+            return connection
+        if not os.path.exists(path):
+            return None
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute('PRAGMA query_only = ON')
+        self._connections[path] = connection
+        return connection
+
+    def close(self):
+        for connection in self._connections.values():
             connection.close()
-            return CellIDDBStatus.NOT_IN_DB,0,0
\ No newline at end of file
+        self._connections = {}
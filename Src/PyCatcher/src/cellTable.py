@@ -0,0 +1,147 @@
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from cellIDDatabase import Translator
+
+#file layout: header, then all keys as sorted little endian uint64, then (latitude, longitude, range) per key
+_magic = 'PYCT'
+_version = 1
+_header = struct.Struct('<4sII')
+_key = struct.Struct('<Q')
+_value = struct.Struct('<ffI')
+
+def pack_key(mcc, mnc, lac, cid):
+    #10 bits mcc, 10 bits mnc, 16 bits lac and 28 bits cell id, so keys sort by network first
+    return (mcc & 0x3ff) << 54 | (mnc & 0x3ff) << 44 | (lac & 0xffff) << 28 | (cid & 0xfffffff)
+
+def write_cell_table(path, cells):
+    #cells is an iterable of (mcc, mnc, lac, cid, latitude, longitude, range)
+    table = {}
+    for mcc, mnc, lac, cid, latitude, longitude, cell_range in cells:
+        key = pack_key(mcc, mnc, lac, cid)
+        #a cell known without coordinates does not replace one that has them
+        if latitude or longitude or not table.has_key(key):
+            table[key] = latitude, longitude, cell_range
+    keys = sorted(table.keys())
+    output = open(path, 'wb')
+    try:
+        output.write(_header.pack(_magic, _version, len(keys)))
+        for key in keys:
+            output.write(_key.pack(key))
+        for key in keys:
+            latitude, longitude, cell_range = table[key]
+            output.write(_value.pack(latitude, longitude, cell_range))
+    finally:
+        output.close()
+    return len(keys)
+
+class CellTable:
+    def __init__(self, path):
+        table = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(table.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            table.close()
+        magic, version, self._count = _header.unpack_from(self._map, 0)
+        if magic != _magic or version != _version:
+            raise ValueError('%s is not a cell table'%path)
+        self._keys = _header.size
+        self._values = self._keys + self._count * _key.size
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, cell):
+        return self._find(pack_key(*cell)) is not None
+
+    def lookup(self, mcc, mnc, lac, cid):
+        #returns (latitude, longitude, range) or None
+        position = self._find(pack_key(mcc, mnc, lac, cid))
+        if position is None:
+            return None
+        return _value.unpack_from(self._map, self._values + position * _value.size)
+
+    def close(self):
+        self._map.close()
+
+    def _find(self, key):
+        unpack_key = _key.unpack_from
+        data = self._map
+        offset = self._keys
+        size = _key.size
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if unpack_key(data, offset + middle * size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and unpack_key(data, offset + low * size)[0] == key:
+            return low
+        return None
+
+def _network(country, provider):
+    mcc = Translator.MCC.get(country.strip())
+    mnc = Translator.Provider.get(provider.strip())
+    if mcc is None or mnc is None:
+        return None
+    return mcc, int(mnc)
+
+def read_location_database(path):
+    #location databases carry no coordinates, databases imported from OpenCellID do
+    connection = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        if 'cells' in tables:
+            #imported with offlineCellDatabase.py
+            for row in connection.execute('SELECT mcc, mnc, lac, cid, latitude, longitude, range FROM cells'):
+                yield row
+        elif 'basestations' in tables:
+            for cid, country, provider, lac in connection.execute(
+                    'SELECT cellid, country, provider, lac FROM basestations'):
+                network = _network(country, provider)
+                if network:
+                    yield network + (lac, cid, 0.0, 0.0, 0)
+    finally:
+        connection.close()
+
+def read_location_csv(path):
+    #csv exports of the controller, the column set changed over time so columns are found by name
+    export = open(path, 'r')
+    try:
+        header = [name.strip() for name in export.readline().split(',')]
+        columns = dict([(name, position) for position, name in enumerate(header)])
+        for line in export:
+            row = [value.strip() for value in line.split(',')]
+            try:
+                network = _network(row[columns['Country']], row[columns['Provider']])
+                if network:
+                    yield network + (int(row[columns['LAC']]), int(row[columns['Cell ID']]),
+                                     float(row[columns['Latitude']]), float(row[columns['Longitude']]), 0)
+            except (ValueError, IndexError, KeyError):
+                continue
+    finally:
+        export.close()
+
+def convert(sources, path):
+    def cells():
+        for source in sources:
+            if source.endswith('.csv'):
+                reader = read_location_csv
+            else:
+                reader = read_location_database
+            for cell in reader(source):
+                yield cell
+    return write_cell_table(path, cells())
+
+def main():
+    if len(sys.argv) < 3:
+        print 'usage: %s <cells.bin> <database.db|export.csv> ...'%os.path.basename(sys.argv[0])
+        sys.exit(1)
+    print 'Wrote %d cells.'%convert(sys.argv[2:], sys.argv[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from settings import Provider_list, Provider_Country_list, LAC_mapping, ARFCN_mapping, LAC_threshold
+from rules import RuleResult, ProviderRule, CountryMappingRule, ARFCNMappingRule, LACMappingRule, UniqueCellIDRule, \
+    LACMedianRule
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def columnar_engine_available():
+    return numpy is not None
+
+class ColumnarRuleEngine:
+    _rule_methods = {
+        ProviderRule: '_provider_rule',
+        CountryMappingRule: '_country_mapping_rule',
+        ARFCNMappingRule: '_arfcn_mapping_rule',
+        LACMappingRule: '_lac_mapping_rule',
+        UniqueCellIDRule: '_unique_cell_id_rule',
+        LACMedianRule: '_lac_median_rule',
+    }
+
+    def __init__(self, base_station_list):
+        if numpy is None:
+            raise ImportError('the columnar rule engine needs numpy')
+        self._strings = {}
+        self.arfcns = numpy.array([station.arfcn for station in base_station_list], dtype=numpy.int64)
+        self.lacs = numpy.array([station.lac for station in base_station_list], dtype=numpy.int64)
+        self.cells = numpy.array([station.cell for station in base_station_list], dtype=numpy.int64)
+        self.providers = self._encode([station.provider for station in base_station_list])
+        self.countries = self._encode([station.country for station in base_station_list])
+
+    def supports(self, rule):
+        #subclasses may override check_context, so only the exact rule classes qualify
+        return self._rule_methods.has_key(rule.__class__)
+
+    def evaluate(self, rules):
+        results = {}
+        for rule in rules:
+            if self.supports(rule):
+                ok = getattr(self, self._rule_methods[rule.__class__])()
+                if isinstance(ok, tuple):
+                    ok, ignore = ok
+                else:
+                    ignore = None
+                column = numpy.where(ok, RuleResult.OK, RuleResult.CRITICAL).astype(object)
+                if ignore is not None:
+                    column[ignore] = RuleResult.IGNORE
+                results[rule.identifier] = column.tolist()
+        return results
+
+    def _encode(self, values):
+        codes = numpy.empty(len(values), dtype=numpy.int64)
+        for position, value in enumerate(values):
+            codes[position] = self._code(value)
+        return codes
+
+    def _code(self, value):
+        code = self._strings.get(value)
+        if code is None:
+            code = len(self._strings)
+            self._strings[value] = code
+        return code
+
+    def _provider_mask(self, provider):
+        code = self._strings.get(provider)
+        if code is None:
+            return None
+        mask = self.providers == code
+        if not mask.any():
+            return None
+        return mask
+
+    def _provider_rule(self):
+        known = [self._strings[provider] for provider in Provider_list if self._strings.has_key(provider)]
+        return numpy.in1d(self.providers, known)
+
+    def _country_mapping_rule(self):
+        #Provider_Country_list translated to a lookup table from provider code to expected country code
+        expected = numpy.full(len(self._strings), -1, dtype=numpy.int64)
+        for provider, country in Provider_Country_list.items():
+            if self._strings.has_key(provider):
+                expected[self._strings[provider]] = self._strings.get(country, -2)
+        expected_country = expected[self.providers]
+        return (expected_country >= 0) & (self.countries == expected_country)
+
+    def _arfcn_mapping_rule(self):
+        ok = numpy.zeros(len(self.arfcns), dtype=bool)
+        for provider, ranges in ARFCN_mapping.items():
+            mask = self._provider_mask(provider)
+            if mask is None or not ranges:
+                continue
+            ranges = sorted(ranges)
+            lowers = numpy.array([lower for lower, upper in ranges], dtype=numpy.int64)
+            #running maximum of the upper bounds, so overlapping ranges are handled as well
+            uppers = numpy.maximum.accumulate(numpy.array([upper for lower, upper in ranges], dtype=numpy.int64))
+            arfcns = self.arfcns[mask]
+            positions = numpy.searchsorted(lowers, arfcns, side='right') - 1
+            ok[mask] = (positions >= 0) & (uppers[positions.clip(0)] >= arfcns)
+        return ok
+
+    def _lac_mapping_rule(self):
+        ok = numpy.zeros(len(self.lacs), dtype=bool)
+        for provider, lacs in LAC_mapping.items():
+            mask = self._provider_mask(provider)
+            if mask is None:
+                continue
+            ok[mask] = numpy.in1d(self.lacs[mask], lacs)
+        return ok
+
+    def _unique_cell_id_rule(self):
+        if not len(self.cells):
+            return numpy.zeros(0, dtype=bool)
+        cells, inverse, counts = numpy.unique(self.cells, return_inverse=True, return_counts=True)
+        return counts[inverse] < 2
+
+    def _lac_median_rule(self):
+        count = len(self.lacs)
+        if not count:
+            return numpy.zeros(0, dtype=bool), numpy.zeros(0, dtype=bool)
+        order = numpy.lexsort((self.lacs, self.providers))
+        sorted_providers = self.providers[order]
+        sorted_lacs = self.lacs[order]
+        groups = numpy.arange(len(self._strings))
+        starts = numpy.searchsorted(sorted_providers, groups, side='left')
+        sizes = numpy.searchsorted(sorted_providers, groups, side='right') - starts
+        medians = sorted_lacs[(starts + sizes // 2).clip(0, count - 1)]
+
+        median = medians[self.providers]
+        lower_bound = median - median * LAC_threshold
+        upper_bound = median + median * LAC_threshold
+        ok = (lower_bound <= self.lacs) & (self.lacs <= upper_bound)
+        return ok, sizes[self.providers] < 2
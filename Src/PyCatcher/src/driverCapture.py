@@ -0,0 +1,166 @@
+import os
+import subprocess
+import threading
+import time
+
+class DriverStreams:
+    FIRMWARE = 'firmware'
+    SCAN = 'scan'
+    PCH = 'pch'
+
+class CaptureEvents:
+    OPEN = 'O'
+    LINE = 'L'
+
+class LiveProcessFactory:
+    def open(self, stream, command):
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def record(self, process, line):
+        pass
+
+    def close(self):
+        pass
+
+class CaptureWriter:
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+        self._sessions = 0
+
+    def open_session(self, stream, command):
+        self._lock.acquire()
+        try:
+            self._sessions += 1
+            session = self._sessions
+        finally:
+            self._lock.release()
+        self.write(session, stream, CaptureEvents.OPEN, ' '.join(command), 0)
+        return session
+
+    def write(self, session, stream, event, line, offset):
+        record = '%.6f\t%d\t%s\t%s\t%s\n'%(offset, session, stream, event, line.encode('string_escape'))
+        self._lock.acquire()
+        try:
+            self._file.write(record)
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._file.close()
+
+def read_capture(path):
+    sessions = []
+    by_id = {}
+    capture = open(path, 'r')
+    for record in capture:
+        offset, session, stream, event, line = record.rstrip('\n').split('\t', 4)
+        line = line.decode('string_escape')
+        if event == CaptureEvents.OPEN:
+            #session ids restart when a capture file is appended to, the order of the records is what counts
+            entry = (stream, line, [])
+            sessions.append(entry)
+            by_id[session] = entry
+        elif by_id.has_key(session):
+            by_id[session][2].append((float(offset), line))
+    capture.close()
+    return sessions
+
+class RecordingProcessFactory:
+    def __init__(self, path, factory=None):
+        self._writer = CaptureWriter(path)
+        self._factory = factory or LiveProcessFactory()
+
+    def open(self, stream, command):
+        process = self._factory.open(stream, command)
+        process.capture_stream = stream
+        process.capture_session = self._writer.open_session(stream, command)
+        process.capture_start = time.time()
+        return process
+
+    def record(self, process, line):
+        self._writer.write(process.capture_session, process.capture_stream, CaptureEvents.LINE, line,
+                           time.time() - process.capture_start)
+
+    def close(self):
+        self._factory.close()
+        self._writer.close()
+
+class ReplayProcess:
+    def __init__(self, lines, speed):
+        read_end, self._write_end = os.pipe()
+        self.stdout = os.fdopen(read_end, 'r')
+        self.returncode = None
+        self._lines = lines
+        self._speed = speed
+        self._stopped = threading.Event()
+        self._feeder = threading.Thread(target=self._feed)
+        self._feeder.setDaemon(True)
+        self._feeder.start()
+
+    def _feed(self):
+        start = time.time()
+        try:
+            for offset, line in self._lines:
+                if self._speed > 0:
+                    delay = start + offset / self._speed - time.time()
+                    if delay > 0 and self._stopped.wait(delay):
+                        break
+                if self._stopped.isSet():
+                    break
+                os.write(self._write_end, line)
+        except OSError:
+            #the reading side went away
+            pass
+        os.close(self._write_end)
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self._feeder.join()
+        return self.returncode
+
+    def terminate(self):
+        self._stopped.set()
+
+    def kill(self):
+        self._stopped.set()
+
+class ReplayProcessFactory:
+    def __init__(self, path, speed=1.0):
+        #speed 1.0 replays in real time, larger values accelerate and 0 replays as fast as possible
+        self._speed = speed
+        self._sessions = {}
+        for stream, command, lines in read_capture(path):
+            self._sessions.setdefault(stream, []).append((command, lines))
+
+    def open(self, stream, command):
+        sessions = self._sessions.get(stream, [])
+        command = ' '.join(command)
+        lines = []
+        for position, (recorded_command, recorded_lines) in enumerate(sessions):
+            #pch sessions are recorded per ARFCN, prefer the one started with the same arguments
+            if recorded_command.split()[1:] == command.split()[1:]:
+                lines = sessions.pop(position)[1]
+                break
+        else:
+            if sessions:
+                lines = sessions.pop(0)[1]
+        return ReplayProcess(lines, self._speed)
+
+    def record(self, process, line):
+        pass
+
+    def close(self):
+        pass
+
+def create_process_factory(capture_settings):
+    mode = capture_settings['mode']
+    if mode == 'record':
+        return RecordingProcessFactory(capture_settings['path'])
+    if mode == 'replay':
+        return ReplayProcessFactory(capture_settings['path'], capture_settings['speed'])
+    return LiveProcessFactory()
@@ -1,276 +1,464 @@
 from pyCatcherModel import BaseStationInformation
-import subprocess
-import threading 
-import re
+from driverCapture import DriverStreams, LiveProcessFactory
 from settings import Commands, PCH_retries
+import Queue
+import heapq
+import threading
+import re
 import time
-import gtk
-import datetime
-import thread
-from threading import Timer
 import os
-import signal
+import fcntl
 import select
 
+class EventChannel:
+    #hands callbacks from worker threads to the GUI thread, which watches fileno() and calls dispatch
+    def __init__(self):
+        self._events = Queue.Queue()
+        self._read, self._write = _nonblocking_pipe()
+
+    def fileno(self):
+        return self._read
+
+    def deliver(self, callback, *args):
+        self._events.put((callback, args))
+        try:
+            os.write(self._write, 'x')
+        except OSError:
+            #pipe is full, the pending wakeups are enough
+            pass
+
+    def dispatch(self):
+        try:
+            os.read(self._read, 4096)
+        except OSError:
+            pass
+        while True:
+            try:
+                callback, args = self._events.get_nowait()
+            except Queue.Empty:
+                break
+            callback(*args)
+        return True
+
 class DriverConnector:        
-    def __init__ (self):
-        self._scan_thread_break = False
-        self._firmware_thread_break = False
-        self._firmware_waiting_callback = None
-        self._firmware_loaded_callback = None
-        self._base_station_found_callback = None
-        self._firmware_thread = None
-        self._scan_thread = None
-        self._pch_thread = None
-        self._pch_callback = None
-        
+    def __init__ (self, process_factory=None, error_callback=None):
+        #error_callback gets a message for driver failures, like every callback it is called from dispatch_events
+        self._process_factory = process_factory or LiveProcessFactory()
+        self._error_callback = error_callback
+        self._events = EventChannel()
+        self._loop = None
+        self._firmware_task = None
+        self._scan_task = None
+        self._pch_task = None
+
+    def event_fd(self):
+        #readable whenever results are waiting, the GUI watches it and calls dispatch_events
+        return self._events.fileno()
+
+    def dispatch_events(self):
+        return self._events.dispatch()
+
     def start_scanning (self, base_station_found_callback):
-        self._base_station_found_callback = base_station_found_callback
-        self._scan_thread = ScanThread(self._base_station_found_callback)
-        self._scan_thread.start()
+        self._scan_task = ScanTask(base_station_found_callback)
+        self._get_loop().start_task(self._scan_task)
 
     def start_firmware(self, firmware_waiting_callback, firmware_loaded_callback):
-        self._firmware_waiting_callback = firmware_waiting_callback
-        self._firmware_loaded_callback = firmware_loaded_callback      
-        self._firmware_thread = FirmwareThread(self._firmware_waiting_callback, self._firmware_loaded_callback)
-        self._firmware_thread.start()
+        self._firmware_task = FirmwareTask(firmware_waiting_callback, firmware_loaded_callback)
+        self._get_loop().start_task(self._firmware_task)
 
     def start_pch_scan(self, arfcn, timeout, scan_finished_callback):
-        self._pch_callback = scan_finished_callback
-        self._pch_thread = PCHThread(arfcn, timeout, self._pch_callback)
-        self._pch_thread.start()
+        self._pch_task = PCHTask(arfcn, timeout, scan_finished_callback)
+        self._get_loop().start_task(self._pch_task)
         
     def stop_scanning (self):
-        self._scan_thread.terminate()
+        if self._scan_task:
+            self._loop.stop_task(self._scan_task)
         
     def stop_firmware(self):
-        self._firmware_thread_break = True
+        if self._firmware_task:
+            self._loop.stop_task(self._firmware_task)
         
     def shutdown(self):
-        if self._firmware_thread:
-            self._firmware_thread.join(3)
-        if self._scan_thread:
-            self._scan_thread.join(3)
-        if self._pch_thread:
-            self._pch_thread.join(3)
-        
-class FirmwareThread(threading.Thread):
-    def __init__(self, firmware_waiting_callback, firmware_loaded_callback):
-        gtk.gdk.threads_init()
+        if self._loop:
+            self._loop.shutdown()
+            self._loop.join(3)
+        self._process_factory.close()
+
+    def _get_loop(self):
+        if not self._loop:
+            self._loop = DriverLoop(self._process_factory, self._events.deliver, self._error_callback)
+            self._loop.start()
+        return self._loop
+
+def _nonblocking_pipe():
+    read_end, write_end = os.pipe()
+    for fd in (read_end, write_end):
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    return read_end, write_end
+
+class DriverLoop(threading.Thread):
+    def __init__(self, process_factory, deliver, error_callback=None):
         threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.deliver = deliver
+        self._error_callback = error_callback
+        self._process_factory = process_factory
+        self._commands = Queue.Queue()
+        self._wakeup_read, self._wakeup_write = _nonblocking_pipe()
+        self._poll = select.poll()
+        self._poll.register(self._wakeup_read, select.POLLIN)
+        self._readers = {}
+        self._timers = []
+        self._timer_sequence = 0
+        self._tasks = []
+        self._running = True
+
+    def call(self, function, *args):
+        self._commands.put((function, args))
+        try:
+            os.write(self._wakeup_write, 'x')
+        except OSError:
+            pass
+
+    def start_task(self, task):
+        self.call(self._start_task, task)
+
+    def stop_task(self, task):
+        self.call(self._stop_task, task)
+
+    def shutdown(self):
+        self.call(self._shutdown)
+
+    def task_done(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+
+    def report(self, message):
+        if self._error_callback:
+            self.deliver(self._error_callback, message)
+
+    def fail_task(self, task, message):
+        #the task is stopped and told, so that its owner does not wait for a result
+        self.report(message)
+        self._stop_task(task)
+        task.on_failed()
+
+    def spawn(self, task, stream, command):
+        process = self._process_factory.open(stream, command)
+        fd = process.stdout.fileno()
+        self._readers[fd] = task, process, ''
+        self._poll.register(fd, select.POLLIN | select.POLLHUP)
+        return process
+
+    def kill(self, process):
+        self._unregister(process)
+        process.terminate()
+        if process.poll() is None:
+            self.call_later(2, self._reap, process)
+
+    def call_later(self, delay, function, *args):
+        self._timer_sequence += 1
+        timer = [time.time() + delay, self._timer_sequence, function, args]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer:
+            timer[2] = None
+
+    def run(self):
+        while self._running:
+            for fd, event in self._poll.poll(self._next_timeout()):
+                if fd == self._wakeup_read:
+                    self._run_commands()
+                elif self._readers.has_key(fd):
+                    self._read(fd)
+            self._run_timers()
+        for task in list(self._tasks):
+            self._stop_task(task)
+
+    def _next_timeout(self):
+        while self._timers and self._timers[0][2] is None:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0, int((self._timers[0][0] - time.time()) * 1000) + 1)
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            deadline, sequence, function, args = heapq.heappop(self._timers)
+            if function:
+                self._dispatch(getattr(function, 'im_self', None), function, *args)
+
+    def _dispatch(self, task, function, *args):
+        #an exception in one task ends that task only, the loop keeps serving the others
+        try:
+            function(*args)
+        except Exception, error:
+            if task in self._tasks:
+                self.fail_task(task, 'Driver: %s failed (%s: %s)'%(task.__class__.__name__,
+                                                                 error.__class__.__name__, error))
+            else:
+                self.report('Driver: %s failed (%s: %s)'%(getattr(function, '__name__', function),
+                                                         error.__class__.__name__, error))
+
+    def _run_commands(self):
+        try:
+            os.read(self._wakeup_read, 4096)
+        except OSError:
+            pass
+        while True:
+            try:
+                function, args = self._commands.get_nowait()
+            except Queue.Empty:
+                break
+            self._dispatch(None, function, *args)
+
+    def _read(self, fd):
+        task, process, buffered = self._readers[fd]
+        try:
+            data = os.read(fd, 4096)
+        except OSError:
+            data = ''
+        if not data:
+            self._unregister(process)
+            if buffered:
+                self._dispatch(task, self._line, task, process, buffered)
+            self._dispatch(task, task.on_eof, process)
+            return
+        lines = (buffered + data).split('\n')
+        self._readers[fd] = task, process, lines.pop()
+        for line in lines:
+            self._dispatch(task, self._line, task, process, line + '\n')
+            if self._readers.get(fd, (None, None, None))[1] is not process:
+                #the task replaced or stopped this process
+                break
+
+    def _line(self, task, process, line):
+        self._process_factory.record(process, line)
+        task.on_line(process, line)
+
+    def _unregister(self, process):
+        fd = process.stdout.fileno()
+        if self._readers.has_key(fd):
+            del self._readers[fd]
+            self._poll.unregister(fd)
+            process.stdout.close()
+
+    def _reap(self, process):
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def _start_task(self, task):
+        self._tasks.append(task)
+        try:
+            task.start(self)
+        except Exception, error:
+            self.fail_task(task, 'Driver: cannot start %s (%s)'%(task.__class__.__name__, error))
+
+    def _stop_task(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+            task.stop()
+
+    def _shutdown(self):
+        self._running = False
+
+class DriverTask:
+    def __init__(self):
+        self._loop = None
+        self._process = None
+
+    def start(self, loop):
+        self._loop = loop
+
+    def on_line(self, process, line):
+        pass
+
+    def on_eof(self, process):
+        if process is self._process:
+            self._process = None
+
+    def on_failed(self):
+        pass
+
+    def stop(self):
+        if self._process:
+            self._loop.kill(self._process)
+            self._process = None
+
+class FirmwareTask(DriverTask):
+    def __init__(self, firmware_waiting_callback, firmware_loaded_callback):
+        DriverTask.__init__(self)
         self._firmware_waiting_callback = firmware_waiting_callback
         self._firmware_loaded_callback = firmware_loaded_callback
-        self._thread_break = False
+        self._waiting_timer = None
+
+    def start(self, loop):
+        DriverTask.start(self, loop)
+        self._process = loop.spawn(self, DriverStreams.FIRMWARE, Commands['osmocon_command'])
+        self._waiting_timer = loop.call_later(3, loop.deliver, self._firmware_waiting_callback)
+
+    def on_line(self, process, line):
+        if line.strip() == 'Finishing download phase':
+            self._loop.deliver(self._firmware_loaded_callback)
+
+    def stop(self):
+        self._loop.cancel(self._waiting_timer)
+        DriverTask.stop(self)
+
+class ScanTask(DriverTask):
+    def __init__(self, base_station_found_callback):
+        DriverTask.__init__(self)
+        self._base_station_found_callback = base_station_found_callback
+        self._parser = SysInfoParser()
+
+    def start(self, loop):
+        DriverTask.start(self, loop)
+        self._process = loop.spawn(self, DriverStreams.SCAN, Commands['scan_command'])
+
+    def on_line(self, process, line):
+        base_station = self._parser.feed(line)
+        if base_station:
+            self._loop.deliver(self._base_station_found_callback, base_station)
+
+class PCHTask(DriverTask):
+    #pch_scan gets two seconds to sync before the timeout starts, as the old polling thread did
+    startup_time = 2
 
-    def terminate(self):
-        self._thread_break = True
-       
-    def run(self):
-        loader_process_object = subprocess.Popen(Commands['osmocon_command'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        time.sleep(3)
-        self._firmware_waiting_callback()
-        while not self._thread_break:
-            line = loader_process_object.stdout.readline()
-            #if line:
-            #    print line
-            if line.strip() == 'Finishing download phase':
-                self._firmware_loaded_callback()
-            #time.sleep(0.5)
-        loader_process_object.terminate()
-
-class ScanThread(threading.Thread):
-        def __init__(self, base_station_found_callback):
-            gtk.gdk.threads_init()
-            threading.Thread.__init__(self)
-            self._base_station_found_callback = base_station_found_callback
-            self._thread_break = False
-            
-        def terminate(self):
-            self._thread_break = True
-        
-        def run(self): 
-            scan_process = subprocess.Popen(Commands['scan_command'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            time.sleep(2)
-            printall = False
-            while not self._thread_break:
-                line = scan_process.stdout.readline()
-                if line:
-                    #print line
-                    #sys.stdout.flush()
-                    if re.search('SysInfo', line):
-                        base_station = BaseStationInformation()
-                        #get country
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'Country:\s(\w+)',line)
-                        if match:
-                            base_station.country = match.group(1)
-                        #get provider
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'Provider:\s(.+)',line)
-                        if match:
-                            base_station.provider = match.group(1)
-                        #get arfcn
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'ARFCN:\s(\d+)',line)
-                        if match:
-                            base_station.arfcn = int(match.group(1))
-                        #get cell id
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'Cell ID:\s(\d+)',line)
-                        if match:
-                            base_station.cell = int(match.group(1))
-                        #get lac
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'LAC:\s(\d+)',line)
-                        if match:
-                            base_station.lac = int(match.group(1))
-                        #get bsic
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'BSIC:\s(\d+,\d+)',line)
-                        if match:
-                            base_station.bsic = match.group(1)
-                        #get rxlev
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'rxlev:\s(.\d+)',line)
-                        if match:
-                            base_station.rxlev = int(match.group(1))
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'\s((\d+)\s)*',line)
-                        if match:
-                            base_station.neighbours = map(int,match.group(0).strip().split(' '))
-                        #get si1
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI1:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t1 = match.group(1).split(' ')
-                        #get si3
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI3:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t3 = match.group(1).split(' ')
-                        #get si4
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI4:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t4 = match.group(1).split(' ')
-                        #get si2
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI2:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t2 = match.group(1).split(' ')
-                        #get si2ter
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI2ter:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t2ter = match.group(1).split(' ')
-                        #get si2bis
-                        line = scan_process.stdout.readline()
-                        match = re.search(r'SI2bis:\s(.+)',line)
-                        if match:
-                            base_station.system_info_t2bis = match.group(1).split(' ')
-                        #endinfo
-                        scan_process.stdout.readline()
-                        
-                        self._base_station_found_callback(base_station)
-            scan_process.terminate()
-
-class PCHThread(threading.Thread):
     def __init__(self, arfcn, timeout, finished_callback):
-        gtk.gdk.threads_init()
-        threading.Thread.__init__(self)
+        DriverTask.__init__(self)
         self._arfcn = arfcn
         self._timeout = timeout
-        self._thread_break = False
         self._scan_finished_callback = finished_callback
+        self._command = Commands['pch_command'] + ['-a', str(arfcn)]
+        self._pch_retries = PCH_retries
+        self._deadline = None
         self._tmsi_dict = {}
+        self._pages_found = 0
+        self._ia_hop_found = 0
+        self._ia_non_hop_found = 0
 
-    def terminate(self):
-        self._thread_break = True
+    def start(self, loop):
+        DriverTask.start(self, loop)
+        self._process = loop.spawn(self, DriverStreams.PCH, self._command)
+        self._deadline = loop.call_later(self.startup_time + self._timeout, self._finish, False)
 
-    def run(self):
-        pch_retries = PCH_retries
-        max_scan_time = self._timeout
-        arfcn = self._arfcn
-        pages_found = 0
-        ia_non_hop_found = 0
-        ia_hop_fund = 0
-        retry = False
-        buffer = []
-
-        command = Commands['pch_command'] + ['-a', str(arfcn)]
-        scan_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        time.sleep(2)
-        poll_obj = select.poll()
-        poll_obj.register(scan_process.stdout, select.POLLIN)
-
-        start_time = datetime.datetime.now()
-        scan_time = datetime.datetime.now() - start_time
-
-        while(True and not self._thread_break):
-
-            if(retry):
-                scan_process.terminate()
-                scan_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                poll_obj.register(scan_process.stdout, select.POLLIN)
-                retry = False
-
-            while(pch_retries > 0 and scan_time.seconds < max_scan_time and not self._thread_break):
-                scan_time = datetime.datetime.now() - start_time
-                poll_result = poll_obj.poll(0)
-                pch_failed = False
-                if poll_result:
-                    line = scan_process.stdout.readline()
-                else:
-                    line = None
-
-                if line:
-                    if 'Paging' in line:
-                        pages_found += 1
-                        match = re.search(r'M\((.*)\)',line)
-                        if match:
-                            tmsi = match.group(1)
-                            if not self._tmsi_dict.has_key(tmsi):
-                                self._tmsi_dict[tmsi] = 1
-                            else:
-                                self._tmsi_dict[tmsi] += 1
-                    if 'IMM' in line:
-                        if 'HOP' in line:
-                            ia_hop_fund += 1
-                        else:
-                            ia_non_hop_found += 1
-                    if 'FBSB RESP: result=255' in line:
-                        if(pch_retries > 0):
-                            retry = True
-                        else:
-                            pch_failed = True
-                        break
-
-            if(retry):
-                print 'SCAN: retry (%d)'%pch_retries
-                pch_retries -= 1
+    def on_line(self, process, line):
+        if 'Paging' in line:
+            self._pages_found += 1
+            match = re.search(r'M\((.*)\)',line)
+            if match:
+                tmsi = match.group(1)
+                self._tmsi_dict[tmsi] = self._tmsi_dict.get(tmsi, 0) + 1
+        if 'IMM' in line:
+            if 'HOP' in line:
+                self._ia_hop_found += 1
             else:
-                break
+                self._ia_non_hop_found += 1
+        if 'FBSB RESP: result=255' in line:
+            if self._pch_retries > 0:
+                self._pch_retries -= 1
+                self._loop.report('PCH scan: no sync on ARFCN %d, retrying (%d retries left)'%(self._arfcn,
+                                                                                               self._pch_retries))
+                self._loop.kill(self._process)
+                self._process = None
+                try:
+                    self._process = self._loop.spawn(self, DriverStreams.PCH, self._command)
+                except OSError, error:
+                    self._loop.fail_task(self, 'Driver: cannot restart PCHTask (%s)'%error)
+            else:
+                self._finish(True)
 
-        if scan_process:
-            scan_process.kill()
+    def stop(self):
+        self._loop.cancel(self._deadline)
+        DriverTask.stop(self)
 
+    def on_failed(self):
+        #the controller waits for a result before it scans the next ARFCN
+        self._finish(True)
 
+    def _finish(self, pch_failed):
+        self.stop()
+        self._loop.task_done(self)
         result = {
-            'Pagings': pages_found,
-            'Assignments_hopping': ia_hop_fund,
-            'Assignments_non_hopping': ia_non_hop_found
+            'Pagings': self._pages_found,
+            'Assignments_hopping': self._ia_hop_found,
+            'Assignments_non_hopping': self._ia_non_hop_found
         }
+        self._loop.deliver(self._scan_finished_callback, (self._arfcn, result), pch_failed)
 
-        if not self._thread_break:
-            self._scan_finished_callback((arfcn, result), pch_failed)
+def _parse_int(value):
+    return int(value.split(None, 1)[0])
 
-class BufferFillerThread(threading.Thread):
-    def __init__(self, buffer, process):
-        gtk.gdk.threads_init()
-        threading.Thread.__init__(self)
-        self._buffer = buffer
-        self._process = process
+def _parse_word(value):
+    return value.split(None, 1)[0]
 
-    def run(self):
-        while(True):
-            self._buffer.append(self._process.stdout.readline())
\ No newline at end of file
+def _parse_text(value):
+    return value.strip()
+
+def _parse_neighbours(value):
+    return [int(arfcn) for arfcn in value.split()]
+
+def _parse_frame(value):
+    #catcher prints 'SI1: ' followed by ' %02x' per byte, the leading empty entry is kept as before
+    return value[1:].rstrip('\r\n').split(' ')
+
+class SysInfoParser:
+    BLOCK_START = '[SysInfo]'
+    BLOCK_END = '[EndInfo]'
+
+    _fields = {
+        'Country': ('country', _parse_word),
+        'Provider': ('provider', _parse_text),
+        'ARFCN': ('arfcn', _parse_int),
+        'Cell ID': ('cell', _parse_int),
+        'LAC': ('lac', _parse_int),
+        'BSIC': ('bsic', _parse_word),
+        'rxlev': ('rxlev', _parse_int),
+        'Neighbours': ('neighbours', _parse_neighbours),
+        'SI1': ('system_info_t1', _parse_frame),
+        'SI3': ('system_info_t3', _parse_frame),
+        'SI4': ('system_info_t4', _parse_frame),
+        'SI2': ('system_info_t2', _parse_frame),
+        'SI2ter': ('system_info_t2ter', _parse_frame),
+        'SI2bis': ('system_info_t2bis', _parse_frame),
+    }
+
+    def __init__(self):
+        self._base_station = None
+
+    def feed(self, line):
+        label, separator, value = line.partition(':')
+        if separator:
+            if self._base_station is not None:
+                field = self._fields.get(label)
+                if field:
+                    attribute, parse = field
+                    try:
+                        setattr(self._base_station, attribute, parse(value))
+                    except (ValueError, IndexError):
+                        pass
+            return None
+
+        line = line.strip()
+        if line == self.BLOCK_END:
+            base_station = self._base_station
+            self._base_station = None
+            return base_station
+        if line == self.BLOCK_START:
+            #a block without [EndInfo] is still handed out once the next one starts
+            base_station = self._base_station
+            self._base_station = BaseStationInformation()
+            return base_station
+        return None
+
+    def parse(self, lines):
+        base_stations = []
+        for line in lines:
+            base_station = self.feed(line)
+            if base_station:
+                base_stations.append(base_station)
+        return base_stations
@@ -0,0 +1,40 @@
+import math
+
+#numpy is imported on first use, loading it takes longer than importing the rest of the core
+_numpy = []
+
+Earth_radius = 6371000.0
+
+def haversine(latitude_a, longitude_a, latitude_b, longitude_b):
+    #great circle distance in meters
+    phi_a = math.radians(latitude_a)
+    phi_b = math.radians(latitude_b)
+    delta_phi = phi_b - phi_a
+    delta_lambda = math.radians(longitude_b - longitude_a)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi_a) * math.cos(phi_b) * math.sin(delta_lambda / 2) ** 2
+    return 2 * Earth_radius * math.asin(min(1.0, math.sqrt(a)))
+
+def _load_numpy():
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    #distances in meters from one point to many, vectorised when numpy is installed
+    numpy = _load_numpy()
+    if numpy is None:
+        return [haversine(latitude, longitude, other_latitude, other_longitude)
+                for other_latitude, other_longitude in zip(latitudes, longitudes)]
+    phi = math.radians(latitude)
+    phis = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    delta_lambda = numpy.radians(numpy.asarray(longitudes, dtype=float) - longitude)
+    a = numpy.sin((phis - phi) / 2) ** 2 + math.cos(phi) * numpy.cos(phis) * numpy.sin(delta_lambda / 2) ** 2
+    return (2 * Earth_radius * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))).tolist()
+
+def rxlev_distance(rxlev, eirp, reference_loss, path_loss_exponent):
+    #log-distance path loss model, reference_loss is the loss at 1km, result in meters
+    return 1000.0 * 10 ** ((eirp - rxlev - reference_loss) / (10.0 * path_loss_exponent))
@@ -0,0 +1,213 @@
+import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class IncrementalLayout:
+    #force directed layout (Fruchterman-Reingold) that keeps the positions of the previous update and only
+    #relaxes the nodes whose neighbourhood changed, together with their direct neighbours
+    def __init__(self, distance=90.0, iterations=20, full_iterations=100, seed=4711):
+        self.distance = float(distance)
+        self.iterations = iterations
+        self.full_iterations = full_iterations
+        self.positions = {}
+        self._adjacency = {}
+        self._random = random.Random(seed)
+
+    def update(self, nodes, edges):
+        adjacency = {}
+        for node in nodes:
+            adjacency[node] = set()
+        for source, target in edges:
+            if source == target:
+                continue
+            adjacency.setdefault(source, set()).add(target)
+            adjacency.setdefault(target, set()).add(source)
+
+        changed = set()
+        for node, neighbours in adjacency.items():
+            if self._adjacency.get(node) != neighbours:
+                changed.add(node)
+        for node, neighbours in self._adjacency.items():
+            if not adjacency.has_key(node):
+                del self.positions[node]
+                changed.update([neighbour for neighbour in neighbours if adjacency.has_key(neighbour)])
+        self._adjacency = adjacency
+
+        if not changed:
+            return self.positions
+        if len(changed) == len(adjacency) or not self.positions:
+            active = set(adjacency.keys())
+            iterations = self.full_iterations
+        else:
+            active = set(changed)
+            for node in changed:
+                active.update(adjacency[node])
+            iterations = self.iterations
+        self._place_new(active)
+        self._relax(active, iterations, len(active) == len(adjacency))
+        return self.positions
+
+    def get_bounds(self):
+        if not self.positions:
+            return 0.0, 0.0, 0.0, 0.0
+        xs = [x for x, y in self.positions.itervalues()]
+        ys = [y for x, y in self.positions.itervalues()]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _place_new(self, active):
+        #new nodes start next to the already placed part of their neighbourhood
+        new_nodes = [node for node in active if not self.positions.has_key(node)]
+        side = self.distance * math.sqrt(len(self._adjacency))
+        xmin, ymin, xmax, ymax = self.get_bounds()
+        pending = []
+        for node in sorted(new_nodes):
+            placed = [self.positions[neighbour] for neighbour in self._adjacency[node] if self.positions.has_key(neighbour)]
+            if placed:
+                x = sum([position[0] for position in placed]) / len(placed)
+                y = sum([position[1] for position in placed]) / len(placed)
+                self.positions[node] = (x + self._jitter(), y + self._jitter())
+            else:
+                pending.append(node)
+        for node in pending:
+            if self.positions:
+                #unconnected newcomers go to the rim of the current drawing
+                angle = self._random.uniform(0, 2 * math.pi)
+                radius = max(xmax - xmin, ymax - ymin, self.distance) / 2 + self.distance
+                x = (xmin + xmax) / 2 + radius * math.cos(angle)
+                y = (ymin + ymax) / 2 + radius * math.sin(angle)
+            else:
+                x = self._random.uniform(0, side)
+                y = self._random.uniform(0, side)
+            self.positions[node] = (x, y)
+
+    def _jitter(self):
+        return self._random.uniform(-self.distance / 4, self.distance / 4)
+
+    def _cell(self, position, size):
+        return int(math.floor(position[0] / size)), int(math.floor(position[1] / size))
+
+    def _grid(self, nodes, size):
+        grid = {}
+        for node in nodes:
+            grid.setdefault(self._cell(self.positions[node], size), []).append(node)
+        return grid
+
+    def _relax(self, active, iterations, full):
+        if full:
+            temperature = self.distance * math.sqrt(len(active)) / 4
+        else:
+            temperature = self.distance / 2
+        if numpy is not None:
+            self._relax_numpy(list(active), iterations, temperature)
+        else:
+            self._relax_python(active, iterations, temperature)
+
+    def _relax_numpy(self, active, iterations, temperature):
+        #the moving nodes come first, so the rows of the distance matrix are exactly the active nodes
+        positions = self.positions
+        k = self.distance
+        cutoff = 4 * k * k
+        cooling = temperature / iterations
+        moving = set(active)
+        nodes = active + [node for node in positions if node not in moving]
+        index = dict([(node, position) for position, node in enumerate(nodes)])
+        xs = numpy.array([positions[node][0] for node in nodes], dtype=float)
+        ys = numpy.array([positions[node][1] for node in nodes], dtype=float)
+        count = len(active)
+        sources = []
+        targets = []
+        for node in active:
+            for other in self._adjacency[node]:
+                sources.append(index[node])
+                targets.append(index[other])
+        sources = numpy.array(sources, dtype=int)
+        targets = numpy.array(targets, dtype=int)
+        rows = numpy.arange(count)
+
+        for iteration in xrange(iterations):
+            dx = xs[:count, numpy.newaxis] - xs
+            dy = ys[:count, numpy.newaxis] - ys
+            d2 = dx * dx + dy * dy
+            d2[rows, rows] = numpy.inf
+            coincident = d2 < 0.01
+            if coincident.any():
+                jitter = coincident.sum()
+                dx[coincident] = [self._random.uniform(-1, 1) for _ in xrange(jitter)]
+                dy[coincident] = [self._random.uniform(-1, 1) for _ in xrange(jitter)]
+                d2[coincident] = dx[coincident] ** 2 + dy[coincident] ** 2
+            force = numpy.where(d2 < cutoff, k * k / d2, 0.0)
+            move_x = (dx * force).sum(axis=1)
+            move_y = (dy * force).sum(axis=1)
+            if len(sources):
+                edge_x = xs[sources] - xs[targets]
+                edge_y = ys[sources] - ys[targets]
+                distance = numpy.sqrt(edge_x * edge_x + edge_y * edge_y) / k
+                numpy.add.at(move_x, sources, -edge_x * distance)
+                numpy.add.at(move_y, sources, -edge_y * distance)
+            length = numpy.sqrt(move_x * move_x + move_y * move_y)
+            scale = numpy.minimum(1.0, temperature / numpy.maximum(length, 1e-9))
+            xs[:count] += move_x * scale
+            ys[:count] += move_y * scale
+            temperature -= cooling
+
+        for position, node in enumerate(active):
+            positions[node] = (float(xs[position]), float(ys[position]))
+
+    def _relax_python(self, active, iterations, temperature):
+        positions = self.positions
+        adjacency = self._adjacency
+        k = self.distance
+        k2 = k * k
+        #repulsion is cut off at two ideal distances, so only the surrounding grid cells need to be visited
+        size = 2 * k
+        cutoff = size * size
+        fixed = self._grid([node for node in positions if node not in active], size)
+        cooling = temperature / iterations
+
+        for iteration in xrange(iterations):
+            moving = self._grid(active, size)
+            displacements = []
+            for node in active:
+                x, y = positions[node]
+                dx = dy = 0.0
+                cx, cy = self._cell((x, y), size)
+                for gx in (cx - 1, cx, cx + 1):
+                    for gy in (cy - 1, cy, cy + 1):
+                        for grid in (fixed, moving):
+                            for other in grid.get((gx, gy), ()):
+                                if other == node:
+                                    continue
+                                ox, oy = positions[other]
+                                ddx = x - ox
+                                ddy = y - oy
+                                d2 = ddx * ddx + ddy * ddy
+                                if d2 >= cutoff:
+                                    continue
+                                if d2 < 0.01:
+                                    ddx = self._random.uniform(-1, 1)
+                                    ddy = self._random.uniform(-1, 1)
+                                    d2 = ddx * ddx + ddy * ddy
+                                force = k2 / d2
+                                dx += ddx * force
+                                dy += ddy * force
+                for other in adjacency[node]:
+                    ox, oy = positions[other]
+                    ddx = x - ox
+                    ddy = y - oy
+                    force = math.sqrt(ddx * ddx + ddy * ddy) / k
+                    dx -= ddx * force
+                    dy -= ddy * force
+                displacements.append((node, dx, dy))
+
+            for node, dx, dy in displacements:
+                length = math.sqrt(dx * dx + dy * dy)
+                if length > temperature:
+                    dx *= temperature / length
+                    dy *= temperature / length
+                x, y = positions[node]
+                positions[node] = (x + dx, y + dy)
+            temperature -= cooling
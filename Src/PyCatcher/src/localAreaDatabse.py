@@ -1,118 +1,309 @@
+import math
 import sqlite3
 import os
+import time
+import zlib
 from pyCatcherModel import BaseStationInformation
-from settings import Database_path
+from cellIDDatabase import Translator
+from schemaMigrations import migrate, schema_version, table_columns
+from settings import Database_path, Sighting_history
+
+_station_columns = 'cellid, country, provider, arfcn, bsic, lac, rxmin, rxmax, sightings'
+_upsert_supported = sqlite3.sqlite_version_info >= (3, 24, 0)
+_insert_sql = '''INSERT INTO basestations(%s, mcc, mnc, first_seen, last_seen)
+VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)'''%_station_columns
+_upsert_sql = _insert_sql + '''
+ON CONFLICT(cellid) DO UPDATE SET rxmin=MIN(rxmin, excluded.rxmin), rxmax=MAX(rxmax, excluded.rxmax),
+sightings=sightings + excluded.sightings, last_seen=excluded.last_seen'''
+_cache_sql = '''SELECT %s, cell_statistics.p5, cell_statistics.p95, cell_statistics.samples
+FROM basestations LEFT JOIN cell_statistics ON cell_statistics.cellid = basestations.cellid'''%', '.join(
+    ['basestations.' + column.strip() for column in _station_columns.split(',')])
+_compact_chunk = 500
+
+def _network_code(country, provider):
+    mnc = Translator.Provider.get(provider)
+    if mnc is not None:
+        mnc = int(mnc)
+    return Translator.MCC.get(country), mnc
+
+def _create_base_table(cursor):
+    #the table as every PyCatcher version wrote it, databases of all versions start out from here
+    cursor.execute('''CREATE TABLE IF NOT EXISTS basestations(
+    cellid INTEGER, country TEXT, provider TEXT, arfcn INTEGER, bsic TEXT, lac INTEGER,
+    rxmin INTEGER, rxmax INTEGER, sightings INTEGER
+    )''')
+
+def _create_cellid_index(cursor):
+    #upserts need a unique cellid, databases written before it may contain the same cell more than once
+    cursor.execute('''CREATE TEMP TABLE merged_cells(
+    keep INTEGER PRIMARY KEY, cellid INTEGER, rxmin INTEGER, rxmax INTEGER, sightings INTEGER
+    )''')
+    cursor.execute('''INSERT INTO merged_cells SELECT MIN(rowid), cellid, MIN(rxmin), MAX(rxmax), SUM(sightings)
+    FROM basestations GROUP BY cellid HAVING COUNT(*) > 1''')
+    cursor.execute('''DELETE FROM basestations WHERE cellid IN (SELECT cellid FROM merged_cells)
+    AND rowid NOT IN (SELECT keep FROM merged_cells)''')
+    cursor.execute('''UPDATE basestations SET
+    rxmin=(SELECT rxmin FROM merged_cells WHERE keep=basestations.rowid),
+    rxmax=(SELECT rxmax FROM merged_cells WHERE keep=basestations.rowid),
+    sightings=(SELECT sightings FROM merged_cells WHERE keep=basestations.rowid)
+    WHERE rowid IN (SELECT keep FROM merged_cells)''')
+    cursor.execute('DROP TABLE merged_cells')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS basestations_cellid ON basestations(cellid)')
+
+def _add_network_and_timestamps(cursor):
+    columns = table_columns(cursor, 'basestations')
+    for column, column_type in (('mcc', 'INTEGER'), ('mnc', 'INTEGER'), ('first_seen', 'REAL'), ('last_seen', 'REAL')):
+        if column not in columns:
+            cursor.execute('ALTER TABLE basestations ADD COLUMN %s %s'%(column, column_type))
+    for country, provider in cursor.execute('SELECT DISTINCT country, provider FROM basestations').fetchall():
+        mcc, mnc = _network_code(country, provider)
+        cursor.execute('UPDATE basestations SET mcc=?, mnc=? WHERE country=? AND provider=?',
+                       (mcc, mnc, country, provider))
+    cursor.execute('CREATE INDEX IF NOT EXISTS basestations_lac_cellid ON basestations(lac, cellid)')
+
+def _create_sighting_history(cursor):
+    #one row per observation of a cell, neighbours is a hash of the neighbour list
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sightings(
+    cellid INTEGER, lac INTEGER, timestamp REAL, rxlev INTEGER, neighbours INTEGER, timing_advance INTEGER
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS sightings_cellid ON sightings(cellid, timestamp)')
+
+def _create_cell_statistics(cursor):
+    #rolling percentiles of the sightings of a cell, maintained by LocalAreaDatabase.compact_history
+    cursor.execute('''CREATE TABLE IF NOT EXISTS cell_statistics(
+    cellid INTEGER PRIMARY KEY, p5 REAL, p95 REAL, samples INTEGER, updated REAL
+    )''')
+
+#append only, a database that has had the first n migrations applied is at schema version n
+Migrations = [
+    _create_base_table,
+    _create_cellid_index,
+    _add_network_and_timestamps,
+    _create_sighting_history,
+    _create_cell_statistics,
+]
+
+def neighbours_hash(neighbours):
+    #stable across platforms and runs, unlike hash()
+    return zlib.crc32(' '.join([str(arfcn) for arfcn in sorted(neighbours)])) & 0xffffffff
+
+def percentile(values, percent):
+    #nearest rank on sorted values
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
 class LocalAreaDatabase:
 
-    def __init__(self):
+    def __init__(self, database_path=Database_path):
         self._connection = None
         self._cursor = None
-        self.cache = []
+        self._database_path = database_path
+        self._name = None
+        self.cache = {}
+        self._by_cell = {}
+        self._pending_sightings = []
 
     def load_or_create_database(self, name):
+        if self._connection and name == self._name:
+            return
+        self._name = name
         if self._connection:
+            self.flush_sightings()
             self._connection.close()
             self._connection = None
 
         name += '.db'
-        path = os.path.join(Database_path ,name)
-            
-        database_exists = os.path.exists(path)
+        path = os.path.join(self._database_path ,name)
         self._connection = sqlite3.connect(path)
         self._cursor = self._connection.cursor()
-        if not database_exists:
-            self._create_base_table()
+        #new files and files of older versions alike are brought to the current schema
+        migrate(self._connection, Migrations)
 
         self.refresh_object_cache()
 
-    def _create_base_table(self):
-        sql = '''CREATE TABLE basestations(
-        cellid INTEGER, country TEXT, provider TEXT, arfcn INTEGER, bsic TEXT, lac INTEGER,
-        rxmin INTEGER, rxmax INTEGER, sightings INTEGER
-        )
-        '''
-        self._cursor.execute(sql)
-        self._connection.commit()
+    def open_read_only(self, name):
+        #for batch jobs, the database has to exist at the current schema and is neither created nor written
+        path = os.path.join(self._database_path, name + '.db')
+        if not os.path.isfile(path):
+            raise IOError('there is no location database %s'%path)
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA query_only = ON')
+        version = schema_version(connection)
+        if version != len(Migrations):
+            connection.close()
+            raise ValueError('%s has schema version %d, open it in PyCatcher once to bring it to version %d'%
+                             (path, version, len(Migrations)))
+        self.close()
+        self._name = name
+        self._connection = connection
+        self._cursor = connection.cursor()
+        self.refresh_object_cache()
 
-    def _insert_station(self, base_station):
-        values = (  base_station.cell,
+    def close(self):
+        if self._connection:
+            self.flush_sightings()
+            self._connection.close()
+        self._connection = None
+        self._cursor = None
+        self._name = None
+
+    def get_station(self, cellID):
+        return self._by_cell.get(cellID)
+
+    def get_station_by_key(self, mcc, mnc, lac, cellID):
+        return self.cache.get((mcc, mnc, lac, cellID))
+
+    def refresh_object_cache(self):
+        if not self._connection:
+            return
+        self.cache = {}
+        self._by_cell = {}
+        for line in self._cursor.execute(_cache_sql):
+            self._cache_entry(LACDBEntry(*line))
+
+    def _cache_entry(self, entry):
+        self.cache[entry.get_key()] = entry
+        self._by_cell[entry.cellID] = entry
+
+    def _update_cache(self, rows):
+        #mirrors what the upsert did to the table, so the cache never has to be reloaded
+        for row in rows:
+            entry = self._by_cell.get(row[0])
+            if entry:
+                entry.rxmin = min(entry.rxmin, row[6])
+                entry.rxmax = max(entry.rxmax, row[7])
+                entry.sightings += row[8]
+            else:
+                self._cache_entry(LACDBEntry(*row[:9]))
+
+    def _get_station(self, cellID):
+        if not self._connection:
+            return None
+        sql = 'SELECT %s FROM basestations WHERE cellid=?'%_station_columns
+        self._cursor.execute(sql, (cellID,))
+        return self._cursor.fetchone()
+
+    def insert_or_alter_base_stations(self, base_station_list):
+        if not self._connection:
+            return
+        now = time.time()
+        values = [( base_station.cell,
                     base_station.country,
                     base_station.provider,
                     base_station.arfcn,
                     base_station.bsic,
                     base_station.lac,
-                    base_station.rxlev,
-                    base_station.rxlev,
+                    int(base_station.rxlev),
+                    int(base_station.rxlev),
                     base_station.times_scanned
-                 )
-        sql = 'INSERT INTO basestations VALUES (?,?,?,?,?,?,?,?,?)'
-        self._cursor.execute(sql, values)
+                  ) + _network_code(base_station.country, base_station.provider) + (now, now)
+                  for base_station in base_station_list]
+        #the whole list goes in as one transaction, so a survey costs a single commit
+        try:
+            if _upsert_supported:
+                self._cursor.executemany(_upsert_sql, values)
+            else:
+                for row in values:
+                    self._upsert_row(row)
+        except sqlite3.Error:
+            self._connection.rollback()
+            raise
         self._connection.commit()
+        self._update_cache(values)
 
-    def _alter_station(self, base_station, old_rmin, old_rmax, old_sightings):
-
-        current_rx = int(base_station.rxlev)
+    def insert_or_alter_base_station(self, base_station):
+        self.insert_or_alter_base_stations([base_station])
 
-        if current_rx < old_rmin:
-            rmin = current_rx
-        else:
-            rmin = old_rmin
-        if current_rx > old_rmax:
-            rmax = current_rx
+    def _upsert_row(self, row):
+        #for sqlite versions before 3.24, which lack INSERT ... ON CONFLICT
+        lookupresult = self._get_station(row[0])
+        if lookupresult:
+            rxmin = min(lookupresult[6], row[6])
+            rxmax = max(lookupresult[7], row[7])
+            sightings = lookupresult[8] + row[8]
+            sql = 'UPDATE basestations SET rxmin=?, rxmax=?, sightings=?, last_seen=? WHERE cellid=?'
+            self._cursor.execute(sql, (rxmin, rxmax, sightings, row[12], row[0]))
         else:
-            rmax = old_rmax
-        sightings = old_sightings + base_station.times_scanned
-        values = (rmin,rmax,sightings,base_station.cell)
-        sql = 'UPDATE basestations SET rxmin=?, rxmax=?, sightings=? WHERE cellid=?'
-        self._cursor.execute(sql, values)
-        self._connection.commit()
-
-    def get_station(self, cellID):
-        for item in self.cache:
-            if item.cellID == cellID:
-                return item
-        return None
+            self._cursor.execute(_insert_sql, row)
 
-    def refresh_object_cache(self):
+    def record_sighting(self, base_station, timestamp=None):
+        #sightings are buffered and appended in batches, timing advance is not known for sweep scans
         if not self._connection:
             return
-        self.cache = []
-        sql = 'SELECT * FROM basestations'
-        self._cursor.execute(sql)
-        try:
-            result = self._cursor.fetchall()
-            for line in result:
-                self.cache.append(
-                    LACDBEntry(
-                        line[0], line[1], line[2], line[3], line[4],
-                        line[5], line[6], line[7],line[8]
-                    )
-                )
-        except:
-            print 'shouldnt happen'
-            return
+        if timestamp is None:
+            timestamp = time.time()
+        self._pending_sightings.append((base_station.cell, base_station.lac, timestamp, int(base_station.rxlev),
+                                        neighbours_hash(base_station.neighbours), None))
+        if len(self._pending_sightings) >= Sighting_history['batch_size']:
+            self.flush_sightings()
 
-    def _get_station(self, cellID):
-        if not self._connection:
-            return None
-        sql = 'SELECT * FROM basestations WHERE cellid =%d'%cellID
-        self._cursor.execute(sql)
+    def flush_sightings(self):
+        if not self._connection or not self._pending_sightings:
+            return
         try:
-            result = (self._cursor.fetchall())[0]
-        except:
-            result = None
-        return result
+            self._cursor.executemany('''INSERT INTO sightings(cellid, lac, timestamp, rxlev, neighbours, timing_advance)
+            VALUES (?,?,?,?,?,?)''', self._pending_sightings)
+        except sqlite3.Error:
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+        self._pending_sightings = []
 
-    def insert_or_alter_base_stations(self, base_station_list):
-        for station in base_station_list:
-            self.insert_or_alter_base_station(station)
+    def _stale_cells(self, window_start, retention_start):
+        #cells seen since their last compaction, cells with samples that have left the window since then and
+        #cells that lose samples to the retention period
+        cells = set()
+        cells.update([row[0] for row in self._cursor.execute('''SELECT sightings.cellid FROM sightings
+        LEFT JOIN cell_statistics ON cell_statistics.cellid = sightings.cellid
+        GROUP BY sightings.cellid HAVING MAX(sightings.timestamp) > COALESCE(MAX(cell_statistics.updated), 0)''')])
+        cells.update([row[0] for row in self._cursor.execute('''SELECT DISTINCT sightings.cellid FROM sightings
+        JOIN cell_statistics ON cell_statistics.cellid = sightings.cellid
+        WHERE cell_statistics.samples > 0 AND sightings.timestamp >= cell_statistics.updated - ?
+        AND sightings.timestamp < ?''', (Sighting_history['window'], window_start))])
+        cells.update([row[0] for row in self._cursor.execute('''SELECT cellid FROM cell_statistics
+        WHERE samples > 0 AND updated < ?''', (window_start,))])
+        cells.update([row[0] for row in self._cursor.execute('''SELECT DISTINCT cellid FROM sightings
+        WHERE timestamp < ?''', (retention_start,))])
+        return sorted(cells)
 
-    def insert_or_alter_base_station(self, base_station):
-        lookupresult = self._get_station(base_station.cell)
-        if lookupresult:
-            self._alter_station(base_station,lookupresult[6],lookupresult[7],lookupresult[8])
-        else:
-            self._insert_station(base_station)
+    def compact_history(self):
+        #keeps rolling percentiles over Sighting_history['window'] for every cell whose samples in the window
+        #changed since its last compaction and drops sightings older than the retention period
+        if not self._connection:
+            return 0
+        self.flush_sightings()
+        now = time.time()
+        window_start = now - Sighting_history['window']
+        retention_start = now - Sighting_history['retention']
+        cells = self._stale_cells(window_start, retention_start)
+        statistics = []
+        try:
+            self._cursor.execute('DELETE FROM sightings WHERE timestamp < ?', (retention_start,))
+            for start in xrange(0, len(cells), _compact_chunk):
+                chunk = cells[start:start + _compact_chunk]
+                levels = dict([(cell, []) for cell in chunk])
+                for cell, rxlev in self._cursor.execute('''SELECT cellid, rxlev FROM sightings
+                WHERE cellid IN (%s) AND timestamp >= ? ORDER BY cellid, rxlev'''%','.join(['?'] * len(chunk)),
+                        chunk + [window_start]):
+                    levels[cell].append(rxlev)
+                for cell in chunk:
+                    values = levels[cell]
+                    if values:
+                        statistics.append((cell, percentile(values, 5), percentile(values, 95), len(values), now))
+                    else:
+                        statistics.append((cell, None, None, 0, now))
+            self._cursor.executemany('INSERT OR REPLACE INTO cell_statistics VALUES (?,?,?,?,?)', statistics)
+        except sqlite3.Error:
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+        for cell, p5, p95, samples, updated in statistics:
+            entry = self._by_cell.get(cell)
+            if entry:
+                entry.p5 = p5
+                entry.p95 = p95
+                entry.samples = samples
+        return len(statistics)
 
     def __del__(self):
         if self._cursor:
@@ -120,8 +311,12 @@ class LocalAreaDatabase:
         if self._connection:
             self._connection.close()
 
-class LACDBEntry():
-    def __init__(self, cellID, country, provider, arfcn, bsic, lac, rxmin, rxmax, sightings):
+class LACDBEntry(object):
+    __slots__ = ('cellID', 'country', 'provider', 'arfcn', 'bsic', 'lac', 'rxmin', 'rxmax', 'sightings', 'p5', 'p95',
+                 'samples')
+
+    def __init__(self, cellID, country, provider, arfcn, bsic, lac, rxmin, rxmax, sightings, p5=None, p95=None,
+                 samples=0):
         self.cellID = cellID
         self.country = country
         self.provider = provider
@@ -131,14 +326,9 @@ class LACDBEntry():
         self.rxmin = rxmin
         self.rxmax = rxmax
         self.sightings = sightings
+        self.p5 = p5
+        self.p95 = p95
+        self.samples = samples or 0
 
-
-
-
-
-
-
-
-
-
-
+    def get_key(self):
+        return _network_code(self.country, self.provider) + (self.lac, self.cellID)
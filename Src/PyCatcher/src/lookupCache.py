@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+from cellIDDatabase import CellIDDBStatus
+
+class LookupCache:
+    #remembers remote cell ID lookups across sessions, keyed by (mcc, mnc, lac, cid, provider)
+    _positive = (CellIDDBStatus.CONFIRMED, CellIDDBStatus.APPROXIMATED)
+    #only definite answers are kept, errors are worth retrying on the next lookup
+    _cacheable = (CellIDDBStatus.CONFIRMED, CellIDDBStatus.APPROXIMATED, CellIDDBStatus.NOT_IN_DB)
+
+    def __init__(self, path, positive_ttl, negative_ttl, max_entries):
+        self._positive_ttl = positive_ttl
+        self._negative_ttl = negative_ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS lookups(
+        mcc INTEGER, mnc INTEGER, lac INTEGER, cid INTEGER, provider TEXT,
+        status TEXT, latitude REAL, longitude REAL, range INTEGER, stored REAL, used REAL,
+        PRIMARY KEY (mcc, mnc, lac, cid, provider)
+        )''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS lookups_used ON lookups(used)')
+        self._connection.commit()
+        self._size = self._count()
+
+    def get(self, mcc, mnc, lac, cid, provider):
+        #returns (status, latitude, longitude, range) or None when the cell has to be looked up again
+        key = (mcc, mnc, lac, cid, provider)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            row = self._connection.execute('''SELECT status, latitude, longitude, range, stored FROM lookups
+            WHERE mcc=? AND mnc=? AND lac=? AND cid=? AND provider=?''', key).fetchone()
+            if not row:
+                return None
+            status, latitude, longitude, range, stored = row
+            if status in self._positive:
+                ttl = self._positive_ttl
+            else:
+                ttl = self._negative_ttl
+            if now - stored > ttl:
+                self._connection.execute('DELETE FROM lookups WHERE mcc=? AND mnc=? AND lac=? AND cid=? AND provider=?',
+                                         key)
+            else:
+                self._connection.execute('''UPDATE lookups SET used=?
+                WHERE mcc=? AND mnc=? AND lac=? AND cid=? AND provider=?''', (now,) + key)
+            self._connection.commit()
+            if now - stored > ttl:
+                return None
+            return str(status), latitude, longitude, range
+        finally:
+            self._lock.release()
+
+    def put(self, mcc, mnc, lac, cid, provider, status, latitude, longitude, range=None):
+        if status not in self._cacheable:
+            return
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._connection.execute('INSERT OR REPLACE INTO lookups VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                                     (mcc, mnc, lac, cid, provider, status, latitude, longitude, range, now, now))
+            #replacements are counted as well, the real size is only queried once the estimate is too large
+            self._size += 1
+            if self._size > self._max_entries:
+                self._evict()
+            self._connection.commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._connection.close()
+        finally:
+            self._lock.release()
+
+    def _count(self):
+        return self._connection.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+
+    def _evict(self):
+        #least recently used entries go first
+        self._size = self._count()
+        excess = self._size - self._max_entries
+        if excess > 0:
+            self._connection.execute('''DELETE FROM lookups WHERE rowid IN
+            (SELECT rowid FROM lookups ORDER BY used LIMIT ?)''', (excess,))
+            self._size -= excess
@@ -0,0 +1,98 @@
+import Queue
+import threading
+from cellIDDatabase import CellIDDBStatus
+
+class LookupScheduler:
+    #runs the cell ID lookups of a scan on a pool of workers and hands every result to deliver as it arrives
+    def __init__(self, deliver, workers=8, limits=None):
+        self._deliver = deliver
+        self._workers = workers
+        self._limits = {}
+        for provider, limit in (limits or {}).items():
+            self._limits[provider] = threading.BoundedSemaphore(limit)
+        #every run has a number, results of a run that is no longer current are dropped
+        self._generation = 0
+
+    def lookup(self, stations, providers, local, result_callback, finished_callback):
+        #providers is the fallback order of (name, fetch(station)) pairs, local resolves the remaining stations
+        #in one batch as (name, fetch_many(stations)) and may be None. a new lookup cancels the previous one
+        self._generation += 1
+        run = threading.Thread(target=self._run, args=(self._generation, list(stations), providers, local,
+                                                       result_callback, finished_callback))
+        run.setDaemon(True)
+        run.start()
+        return run
+
+    def cancel(self):
+        #workers stop after their current request, results already posted are not handed out
+        self._generation += 1
+
+    def _post(self, generation, callback, *args):
+        self._deliver(self._dispatch, generation, callback, args)
+
+    def _dispatch(self, generation, callback, args):
+        if generation == self._generation:
+            callback(*args)
+
+    def _run(self, generation, stations, providers, local, result_callback, finished_callback):
+        jobs = Queue.Queue()
+        for station in stations:
+            jobs.put(station)
+        unresolved = []
+        lock = threading.Lock()
+        workers = []
+        for _ in xrange(min(self._workers, len(stations))):
+            worker = threading.Thread(target=self._work, args=(generation, jobs, providers, result_callback,
+                                                               unresolved, lock))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        if generation != self._generation:
+            return
+
+        if local and unresolved:
+            name, fetch_many = local
+            try:
+                results = fetch_many(unresolved)
+            except Exception:
+                results = {}
+            for station in unresolved:
+                status, latitude, longitude = results.get(station.cell, (CellIDDBStatus.ERROR, 0, 0))
+                self._post(generation, result_callback, station, name, status, latitude, longitude)
+        self._post(generation, finished_callback, len(stations), len(stations) - len(unresolved))
+
+    def _work(self, generation, jobs, providers, result_callback, unresolved, lock):
+        while generation == self._generation:
+            try:
+                station = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            for name, fetch in providers:
+                if generation != self._generation:
+                    return
+                status, latitude, longitude = self._fetch(name, fetch, station)
+                self._post(generation, result_callback, station, name, status, latitude, longitude)
+                if status == CellIDDBStatus.CONFIRMED:
+                    break
+            else:
+                lock.acquire()
+                try:
+                    unresolved.append(station)
+                finally:
+                    lock.release()
+
+    def _fetch(self, name, fetch, station):
+        limit = self._limits.get(name)
+        if limit:
+            limit.acquire()
+        try:
+            try:
+                return fetch(station)
+            except Exception:
+                #network and parse failures count as an error of this service, the next one is tried
+                return CellIDDBStatus.ERROR, 0, 0
+        finally:
+            if limit:
+                limit.release()
@@ -1,9 +1,17 @@
+import sys
+
+try:
+    import gtk
+except ImportError:
+    #the GUI is optional, pyCatcherCore and batchAnalyzer.py work without it
+    sys.exit('The PyCatcher GUI needs PyGTK, saved scans can be evaluated with batchAnalyzer.py.')
+
 from pyCatcherController import PyCatcherController
 
 def main ():
     controller = PyCatcherController()
- 
- 
-   
+
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
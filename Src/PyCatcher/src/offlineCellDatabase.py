@@ -0,0 +1,128 @@
+import csv
+import math
+import os
+import sqlite3
+import sys
+import threading
+
+#column names of the OpenCellID cell_towers.csv dump, older dumps use the names on the right
+_dump_columns = {
+    'mcc': ('mcc',),
+    'mnc': ('net', 'mnc'),
+    'lac': ('area', 'lac'),
+    'cid': ('cell', 'cellid'),
+    'latitude': ('lat',),
+    'longitude': ('lon',),
+    'range': ('range',),
+    'samples': ('samples',),
+    'radio': ('radio',),
+}
+
+def _create_tables(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS cells(
+    id INTEGER PRIMARY KEY, mcc INTEGER, mnc INTEGER, lac INTEGER, cid INTEGER,
+    latitude REAL, longitude REAL, range INTEGER, samples INTEGER
+    )''')
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS cells_key ON cells(mcc, mnc, lac, cid)')
+    connection.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS cells_position
+    USING rtree(id, min_latitude, max_latitude, min_longitude, max_longitude)''')
+
+def _column_positions(header):
+    header = [name.strip().lower() for name in header]
+    positions = {}
+    for column, names in _dump_columns.items():
+        for name in names:
+            if name in header:
+                positions[column] = header.index(name)
+                break
+    for column in ('mcc', 'mnc', 'lac', 'cid', 'latitude', 'longitude'):
+        if not positions.has_key(column):
+            raise ValueError('dump has no %s column'%column)
+    return positions
+
+def _read_dump(dump, radios):
+    reader = csv.reader(dump)
+    positions = _column_positions(reader.next())
+    mcc, mnc, lac, cid = positions['mcc'], positions['mnc'], positions['lac'], positions['cid']
+    latitude, longitude = positions['latitude'], positions['longitude']
+    cell_range, samples, radio = positions.get('range'), positions.get('samples'), positions.get('radio')
+    for row in reader:
+        if radios and radio is not None and row[radio] not in radios:
+            continue
+        try:
+            yield (int(row[mcc]), int(row[mnc]), int(row[lac]), int(row[cid]), float(row[latitude]),
+                   float(row[longitude]), cell_range is not None and int(row[cell_range]) or 0,
+                   samples is not None and int(row[samples]) or 0)
+        except (ValueError, IndexError):
+            #dumps contain the odd truncated or malformed line
+            continue
+
+def import_dump(dump_path, database_path, radios=('GSM',), chunk_size=50000):
+    #streams an OpenCellID csv dump into database_path, memory use is bounded by chunk_size rows
+    connection = sqlite3.connect(database_path)
+    connection.execute('PRAGMA synchronous = OFF')
+    _create_tables(connection)
+    insert = 'INSERT OR REPLACE INTO cells(mcc, mnc, lac, cid, latitude, longitude, range, samples) VALUES (?,?,?,?,?,?,?,?)'
+    imported = 0
+    dump = open(dump_path, 'rb')
+    try:
+        chunk = []
+        for row in _read_dump(dump, radios):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                connection.executemany(insert, chunk)
+                connection.commit()
+                imported += len(chunk)
+                chunk = []
+        connection.executemany(insert, chunk)
+        imported += len(chunk)
+        #the spatial index is rebuilt in one statement once the cells are in place
+        connection.execute('DELETE FROM cells_position')
+        connection.execute('''INSERT INTO cells_position
+        SELECT id, latitude, latitude, longitude, longitude FROM cells''')
+        connection.commit()
+    finally:
+        dump.close()
+        connection.close()
+    return imported
+
+class OfflineCellDatabase:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA query_only = ON')
+
+    def lookup(self, mcc, mnc, lac, cid):
+        #returns (latitude, longitude, range) or None
+        self._lock.acquire()
+        try:
+            return self._connection.execute('''SELECT latitude, longitude, range FROM cells
+            WHERE mcc=? AND mnc=? AND lac=? AND cid=?''', (mcc, mnc, lac, cid)).fetchone()
+        finally:
+            self._lock.release()
+
+    def cells_near(self, latitude, longitude, distance):
+        #cells within roughly distance meters, as (mcc, mnc, lac, cid, latitude, longitude, range)
+        delta_latitude = distance / 111320.0
+        delta_longitude = distance / (111320.0 * max(math.cos(math.radians(latitude)), 0.01))
+        self._lock.acquire()
+        try:
+            return self._connection.execute('''SELECT cells.mcc, cells.mnc, cells.lac, cells.cid, cells.latitude,
+            cells.longitude, cells.range FROM cells_position JOIN cells ON cells.id = cells_position.id
+            WHERE min_latitude >= ? AND max_latitude <= ? AND min_longitude >= ? AND max_longitude <= ?''',
+                (latitude - delta_latitude, latitude + delta_latitude,
+                 longitude - delta_longitude, longitude + delta_longitude)).fetchall()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._connection.close()
+
+def main():
+    if len(sys.argv) != 3:
+        print 'usage: %s <cell_towers.csv> <database.db>'%os.path.basename(sys.argv[0])
+        sys.exit(1)
+    print 'Imported %d cells.'%import_dump(sys.argv[1], sys.argv[2])
+
+if __name__ == '__main__':
+    main()
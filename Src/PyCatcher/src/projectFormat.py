@@ -0,0 +1,371 @@
+import binascii
+import mmap
+import os
+import pickle
+import struct
+import sys
+from pyCatcherModel import BaseStationInformation, BaseStationInformationList
+
+#file layout: header, string table, one fixed size record per station, then the variable sized payloads
+#(neighbours, system information, reports) the records point to. strings are stored once in the table and
+#referenced by index, system information messages are stored as raw bytes instead of lists of hex strings
+_magic = 'PYCP'
+_version = 1
+_header = struct.Struct('<4sHHII')
+_length = struct.Struct('<H')
+_count = struct.Struct('<H')
+_pair = struct.Struct('<II')
+_blob = struct.Struct('<I')
+
+_int_fields = ('arfcn', 'rxlev', 'times_scanned', 'lac', 'cell', 'imm_ass_hop', 'imm_ass_non_hop', 'pagings')
+_float_fields = ('latitude', 'longitude')
+_flag_fields = ('found', 'pch_scan_done')
+_string_fields = ('country', 'provider', 'bsic', 'discovery_time', 'evaluation', 'evaluation_by', 'db_status',
+                  'db_provider')
+_system_info_fields = ('system_info_t1', 'system_info_t2', 'system_info_t2bis', 'system_info_t2ter',
+                       'system_info_t3', 'system_info_t4')
+_report_fields = ('rules_report', 'evaluation_report')
+_record = struct.Struct('<' + 'i' * len(_int_fields) + 'd' * len(_float_fields) + 'B' +
+                        'I' * len(_string_fields) + 'II')
+_fields = set(_int_fields + _float_fields + _flag_fields + _string_fields + _system_info_fields + _report_fields +
+              ('neighbours',))
+
+#system information messages: no message, message with the leading empty entry the driver parser keeps, or without
+_si_empty = 0
+_si_leading = 1
+_si_plain = 2
+
+#flags byte: the two boolean fields, then whether latitude and longitude were stored as integers
+_found = 1
+_pch_scan_done = 2
+_integer_latitude = 4
+_integer_longitude = 8
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+
+    def add(self, value):
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self._index[value] = index
+        return index
+
+def is_project_file(path):
+    project = open(path, 'rb')
+    try:
+        return project.read(len(_magic)) == _magic
+    finally:
+        project.close()
+
+def _is_string(value):
+    return type(value) is str and len(value) <= 0xffff
+
+def _encode_system_info(value):
+    if type(value) is not list or [entry for entry in value if type(entry) is not str]:
+        return None
+    if not value:
+        return chr(_si_empty) + _length.pack(0)
+    kind = _si_plain
+    if value[0] == '':
+        kind = _si_leading
+        value = value[1:]
+    #only lowercase two digit hex entries survive the round trip through raw bytes
+    if [entry for entry in value if len(entry) != 2 or entry != entry.lower()]:
+        return None
+    try:
+        raw = binascii.unhexlify(''.join(value))
+    except TypeError:
+        return None
+    if len(raw) > 0xffff:
+        return None
+    return chr(kind) + _length.pack(len(raw)) + raw
+
+def _encode_report(value, strings):
+    if type(value) is not dict or len(value) > 0xffff:
+        return None
+    pairs = []
+    for key, result in value.items():
+        if not _is_string(key) or not _is_string(result):
+            return None
+        pairs.append(_pair.pack(strings.add(key), strings.add(result)))
+    return _count.pack(len(pairs)) + ''.join(pairs)
+
+def _encode_station(station, strings):
+    #values of unexpected type, and attributes this format does not know, end up in the extras of the station
+    if isinstance(station, LazyStation):
+        station.load()
+    state = station.__dict__
+    extras = dict([(key, value) for key, value in state.items() if key not in _fields])
+    integers = []
+    for field in _int_fields:
+        value = state.get(field, 0)
+        if type(value) is not int or not -0x80000000 <= value <= 0x7fffffff:
+            extras[field] = value
+            value = 0
+        integers.append(value)
+    floats = []
+    flags = 0
+    for field, integer_flag in zip(_float_fields, (_integer_latitude, _integer_longitude)):
+        value = state.get(field, 0)
+        if type(value) is int:
+            flags |= integer_flag
+            value = float(value)
+        elif type(value) is not float:
+            extras[field] = value
+            value = 0.0
+        floats.append(value)
+    for field, flag in zip(_flag_fields, (_found, _pch_scan_done)):
+        value = state.get(field, False)
+        if type(value) is not bool:
+            extras[field] = value
+        elif value:
+            flags |= flag
+    indices = []
+    for field in _string_fields:
+        value = state.get(field, '')
+        if not _is_string(value):
+            extras[field] = value
+            value = ''
+        indices.append(strings.add(value))
+
+    payload = []
+    neighbours = state.get('neighbours', [])
+    if type(neighbours) is list and len(neighbours) <= 0xffff and \
+            not [arfcn for arfcn in neighbours if type(arfcn) is not int or not 0 <= arfcn <= 0xffff]:
+        payload.append(_count.pack(len(neighbours)) + struct.pack('<%dH'%len(neighbours), *neighbours))
+    else:
+        extras['neighbours'] = neighbours
+        payload.append(_count.pack(0))
+    for field in _system_info_fields:
+        encoded = _encode_system_info(state.get(field, []))
+        if encoded is None:
+            extras[field] = state[field]
+            encoded = chr(_si_empty) + _length.pack(0)
+        payload.append(encoded)
+    for field in _report_fields:
+        encoded = _encode_report(state.get(field, {}), strings)
+        if encoded is None:
+            extras[field] = state[field]
+            encoded = _count.pack(0)
+        payload.append(encoded)
+
+    #string valued extras go through the string table, anything else is pickled
+    string_extras = [(key, value) for key, value in extras.items() if _is_string(key) and _is_string(value)]
+    for key, value in string_extras:
+        del extras[key]
+    payload.append(_count.pack(len(string_extras)) +
+                   ''.join([_pair.pack(strings.add(key), strings.add(value)) for key, value in string_extras]))
+    if extras:
+        pickled = pickle.dumps(extras, pickle.HIGHEST_PROTOCOL)
+    else:
+        pickled = ''
+    payload.append(_blob.pack(len(pickled)) + pickled)
+    return integers + floats + [flags] + indices, ''.join(payload)
+
+def pack_station(station, strings):
+    #a single station, record followed by its payload, for formats that write stations one by one
+    fields, payload = _encode_station(station, strings)
+    return _record.pack(*(fields + [0, len(payload)])) + payload
+
+def unpack_station(data, offset, strings):
+    record = _record.unpack_from(data, offset)
+    return _decode_station(record, data, offset + _record.size, strings)
+
+def dump_project(station_list):
+    strings = StringTable()
+    records = []
+    payloads = []
+    offset = 0
+    for station in station_list._get_unfiltered_list():
+        fields, payload = _encode_station(station, strings)
+        records.append(_record.pack(*(fields + [offset, len(payload)])))
+        payloads.append(payload)
+        offset += len(payload)
+    return ''.join([_header.pack(_magic, _version, 0, len(records), len(strings.strings)),
+                    ''.join([_length.pack(len(value)) + value for value in strings.strings]),
+                    ''.join(records),
+                    ''.join(payloads)])
+
+def save_project(station_list, path):
+    #written next to the target and renamed over it, so a lazily loaded project stays readable while it is saved
+    temporary = path + '.tmp'
+    project = open(temporary, 'wb')
+    try:
+        project.write(dump_project(station_list))
+    finally:
+        project.close()
+    os.rename(temporary, path)
+
+def _read_strings(data, offset, count):
+    strings = []
+    for _ in xrange(count):
+        length = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        strings.append(data[offset:offset + length])
+        offset += length
+    return strings, offset
+
+def _decode_pairs(data, offset, strings):
+    count = _count.unpack_from(data, offset)[0]
+    offset += _count.size
+    pairs = {}
+    for _ in xrange(count):
+        key, value = _pair.unpack_from(data, offset)
+        pairs[strings[key]] = strings[value]
+        offset += _pair.size
+    return pairs, offset
+
+def _decode_index(record, data, offset, strings):
+    #everything but system information and reports, returns the state and where those start in the payload
+    state = {}
+    position = 0
+    for field in _int_fields:
+        state[field] = record[position]
+        position += 1
+    for field in _float_fields:
+        state[field] = record[position]
+        position += 1
+    flags = record[position]
+    position += 1
+    state['found'] = bool(flags & _found)
+    state['pch_scan_done'] = bool(flags & _pch_scan_done)
+    if flags & _integer_latitude:
+        state['latitude'] = int(state['latitude'])
+    if flags & _integer_longitude:
+        state['longitude'] = int(state['longitude'])
+    for field in _string_fields:
+        state[field] = strings[record[position]]
+        position += 1
+
+    count = _count.unpack_from(data, offset)[0]
+    offset += _count.size
+    state['neighbours'] = list(struct.unpack_from('<%dH'%count, data, offset))
+    offset += 2 * count
+    heavy = offset
+    #skip system information and reports to get to the extras, which may override any field
+    for field in _system_info_fields:
+        offset += 1 + _length.size + _length.unpack_from(data, offset + 1)[0]
+    for field in _report_fields:
+        offset += _count.size + _count.unpack_from(data, offset)[0] * _pair.size
+    string_extras, offset = _decode_pairs(data, offset, strings)
+    state.update(string_extras)
+    length = _blob.unpack_from(data, offset)[0]
+    offset += _blob.size
+    if length:
+        state.update(pickle.loads(data[offset:offset + length]))
+    return state, heavy
+
+def _decode_heavy(data, offset, strings):
+    state = {}
+    for field in _system_info_fields:
+        kind = ord(data[offset])
+        length = _length.unpack_from(data, offset + 1)[0]
+        offset += 1 + _length.size
+        raw = binascii.hexlify(data[offset:offset + length])
+        offset += length
+        value = [raw[position:position + 2] for position in xrange(0, len(raw), 2)]
+        if kind == _si_leading:
+            value.insert(0, '')
+        state[field] = value
+    for field in _report_fields:
+        state[field], offset = _decode_pairs(data, offset, strings)
+    return state
+
+def _decode_station(record, data, offset, strings):
+    state, heavy = _decode_index(record, data, offset, strings)
+    for field, value in _decode_heavy(data, heavy, strings).items():
+        #extras take precedence
+        if not state.has_key(field):
+            state[field] = value
+    station = BaseStationInformation()
+    station.__dict__ = state
+    return station
+
+def _decode_lazy_station(record, data, offset, strings):
+    state, heavy = _decode_index(record, data, offset, strings)
+    station = LazyStation()
+    state['_payload'] = data, heavy, strings
+    station.__dict__ = state
+    return station
+
+class LazyStation(BaseStationInformation):
+    #station of a project loaded with lazy=True, system information and reports are decoded from the mapped
+    #project file the first time one of them is used
+    lazy_fields = frozenset(_system_info_fields + _report_fields)
+
+    def __getattr__(self, name):
+        if name in self.lazy_fields and self.__dict__.has_key('_payload'):
+            self.load()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def load(self):
+        payload = self.__dict__.pop('_payload', None)
+        if payload:
+            data, offset, strings = payload
+            for field, value in _decode_heavy(data, offset, strings).items():
+                #fields assigned since loading, e.g. by a re-evaluation, are newer than the file
+                if not self.__dict__.has_key(field):
+                    self.__dict__[field] = value
+
+    def __getstate__(self):
+        self.load()
+        return self.__dict__
+
+def parse_project(data, path='project', lazy=False):
+    magic, version, reserved, station_count, string_count = _header.unpack_from(data, 0)
+    if magic != _magic:
+        raise ValueError('%s is not a PyCatcher project'%path)
+    if version != _version:
+        raise ValueError('%s has project format version %d, this version of PyCatcher reads %d'%
+                         (path, version, _version))
+    strings, offset = _read_strings(data, _header.size, string_count)
+    payloads = offset + station_count * _record.size
+    if lazy:
+        decode = _decode_lazy_station
+    else:
+        decode = _decode_station
+    stations = []
+    for index in xrange(station_count):
+        record = _record.unpack_from(data, offset + index * _record.size)
+        stations.append(decode(record, data, payloads + record[-2], strings))
+    station_list = BaseStationInformationList()
+    station_list.replace_stations(stations)
+    return station_list
+
+def load_project(path, lazy=False):
+    #lazy projects map the file and keep it mapped as long as a station has not been fully decoded
+    project = open(path, 'rb')
+    try:
+        if lazy:
+            data = mmap.mmap(project.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = project.read()
+    finally:
+        project.close()
+    return parse_project(data, path, lazy)
+
+def load_legacy_project(path):
+    legacy = open(path, 'rb')
+    try:
+        return pickle.load(legacy)
+    finally:
+        legacy.close()
+
+def convert(legacy_path, path):
+    station_list = load_legacy_project(legacy_path)
+    save_project(station_list, path)
+    return len(station_list._get_unfiltered_list())
+
+def main():
+    if len(sys.argv) != 3:
+        print 'usage: %s <legacy.cpf> <project.cpf>'%os.path.basename(sys.argv[0])
+        sys.exit(1)
+    print 'Converted %d stations.'%convert(sys.argv[1], sys.argv[2])
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,27 @@
+import gobject
 import gtk
 import gtk.glade
 import io
-from driverConnector import DriverConnector
+import os
+import time
+from driverConnector import DriverConnector, EventChannel
+from driverCapture import create_process_factory
 from pyCatcherModel import BaseStationInformation, BaseStationInformationList
 from pyCatcherView import PyCatcherGUI
 from filters import ARFCNFilter,ProviderFilter
 from evaluators import EvaluatorSelect, ConservativeEvaluator,GroupEvaluator
-from rules import ProviderRule, ARFCNMappingRule, CountryMappingRule, LACMappingRule, UniqueCellIDRule, \
-    LACMedianRule, NeighbourhoodStructureRule, PureNeighbourhoodRule, DiscoveredNeighboursRule, RuleResult, CellIDDatabaseRule, LocationAreaDatabaseRule, RxChangeRule, LACChangeRule,PCHRule
-import pickle
+from rules import RuleResult, create_rules
+import sqlite3
+import projectFormat
 from localAreaDatabse import LocalAreaDatabase
+from lookupScheduler import LookupScheduler
+from lookupCache import LookupCache
+from offlineCellDatabase import OfflineCellDatabase
+from cellTable import CellTable
+from sessionJournal import SessionJournal
 from cellIDDatabase import CellIDDatabase, CellIDDBStatus, CIDDatabases
-from settings import Database_path, USR_timeout, Pagings_per_10s_threshold, Assignment_limit
+from settings import Database_path, USR_timeout, Pagings_per_10s_threshold, Assignment_limit, Driver_capture, GUI_settings, \
+    Lookup_concurrency, Lookup_cache, Offline_cell_database, Cell_table, Location_coordinates, Session_journal
 
 class PyCatcherController:
     def __init__(self):
@@ -20,7 +30,12 @@ class PyCatcherController:
         store.append(('-','-','-','-', '-','-','-'))
         self.bs_tree_list_data = store
         self._gui = PyCatcherGUI(self)
-        self._driver_connector = DriverConnector()       
+        self._driver_connector = DriverConnector(create_process_factory(Driver_capture), self.log_message)
+        gobject.io_add_watch(self._driver_connector.event_fd(), gobject.IO_IN, self._on_driver_events)
+        self._lookup_events = EventChannel()
+        gobject.io_add_watch(self._lookup_events.fileno(), gobject.IO_IN, self._on_lookup_events)
+        self._lookup_scheduler = LookupScheduler(self._lookup_events.deliver, Lookup_concurrency['workers'],
+                                                 Lookup_concurrency['limits'])
         self._gui.log_line('GUI initialized')
 
         self.arfcn_filter = ARFCNFilter()
@@ -29,52 +44,42 @@ class PyCatcherController:
         self._filters = [self.arfcn_filter, self.provider_filter]
 
         self._local_area_database = LocalAreaDatabase()
-        self._cell_id_database = CellIDDatabase()
+        try:
+            lookup_cache = LookupCache(Lookup_cache['path'], Lookup_cache['positive_ttl'], Lookup_cache['negative_ttl'],
+                                       Lookup_cache['max_entries'])
+        except sqlite3.Error:
+            self._gui.log_line('Lookup cache %s could not be opened, remote lookups are not cached.'%Lookup_cache['path'])
+            lookup_cache = None
+        offline_database = None
+        if os.path.exists(Offline_cell_database):
+            offline_database = OfflineCellDatabase(Offline_cell_database)
+        self._cell_id_database = CellIDDatabase(lookup_cache, offline_database)
 
         self._conservative_evaluator = ConservativeEvaluator()
         self._group_evaluator = GroupEvaluator()
         self._active_evaluator = self._conservative_evaluator
 
+        self._store_rows = {}
+        self._shown_graph = None
+        self._update_pending = False
+        self._last_update = 0
+        self._update_interval = 1.0 / GUI_settings['max_updates_per_second']
+
         self._pch_scan_running = False
         self._user_mode_flag = False
         self._remaining_pch_arfcns = []
         self._accumulated_pch_results = []
         self._pch_timeout = 10
 
-        self.provider_rule = ProviderRule()
-        self.provider_rule.is_active = True
-        self.country_mapping_rule = CountryMappingRule()
-        self.country_mapping_rule.is_active = True
-        self.arfcn_mapping_rule = ARFCNMappingRule()
-        self.arfcn_mapping_rule.is_active = True
-        self.lac_mapping_rule = LACMappingRule()
-        self.lac_mapping_rule.is_active = True
-        self.unique_cell_id_rule = UniqueCellIDRule()
-        self.unique_cell_id_rule.is_active = True
-        self.lac_median_rule = LACMedianRule()
-        self.lac_median_rule.is_active = True
-        self.neighbourhood_structure_rule = NeighbourhoodStructureRule()
-        self.neighbourhood_structure_rule.is_active = True
-        self.pure_neighbourhood_rule = PureNeighbourhoodRule()
-        self.pure_neighbourhood_rule.is_active = True
-        self.full_discovered_neighbourhoods_rule = DiscoveredNeighboursRule()
-        self.full_discovered_neighbourhoods_rule.is_active = True
-        self.cell_id_db_rule = CellIDDatabaseRule()
-        self.cell_id_db_rule.is_active = False
-        self.location_area_database_rule =  LocationAreaDatabaseRule()
-        self.location_area_database_rule.is_active = False
-        self.location_area_database_rule.location_database_object = self._local_area_database
-        self.lac_change_rule = LACChangeRule()
-        self.lac_change_rule.is_active = True
-        self.rx_change_rule = RxChangeRule()
-        self.rx_change_rule.is_active = True
-        self.pch_scan_integration = PCHRule()
-        self.pch_scan_integration.is_active = True
-
-        self._rules = [self.provider_rule, self.country_mapping_rule, self.arfcn_mapping_rule, self.lac_mapping_rule,
-                        self.unique_cell_id_rule, self.lac_median_rule, self.neighbourhood_structure_rule,
-                        self.pure_neighbourhood_rule, self.full_discovered_neighbourhoods_rule, self.cell_id_db_rule,
-                        self.location_area_database_rule, self.lac_change_rule, self.rx_change_rule, self.pch_scan_integration]
+        cell_table = None
+        if os.path.exists(Cell_table):
+            cell_table = CellTable(Cell_table)
+        self._rules = create_rules(self._local_area_database, cell_table)
+        (self.provider_rule, self.country_mapping_rule, self.arfcn_mapping_rule, self.lac_mapping_rule,
+         self.unique_cell_id_rule, self.lac_median_rule, self.neighbourhood_structure_rule,
+         self.pure_neighbourhood_rule, self.full_discovered_neighbourhoods_rule, self.cell_id_db_rule,
+         self.location_area_database_rule, self.lac_change_rule, self.rx_change_rule, self.pch_scan_integration,
+         self.spatial_plausibility_rule) = self._rules
 
         self.use_google = False
         self.use_open_cell_id = False
@@ -85,8 +90,28 @@ class PyCatcherController:
 
         self._location = ''
 
+        self._journal = SessionJournal(Session_journal['path'], Session_journal['sync_records'],
+                                       Session_journal['sync_interval'], Session_journal['compact_records'])
+        try:
+            recovered = self._journal.open()
+        except (IOError, OSError, ValueError), error:
+            self._gui.log_line('Session journal could not be opened (%s), the session is not journaled.'%error)
+            self._journal = None
+            recovered = None
+        if recovered:
+            self._base_station_list = recovered
+            self._gui.log_line('Recovered %d base stations from the session journal.'%len(recovered._get_unfiltered_list()))
+            self.trigger_evaluation()
+        gobject.timeout_add(int(Session_journal['sync_interval'] * 1000), self._on_journal_sync)
+
         gtk.main()
                 
+    def _on_driver_events(self, fd, condition):
+        return self._driver_connector.dispatch_events()
+
+    def _on_lookup_events(self, fd, condition):
+        return self._lookup_events.dispatch()
+
     def log_message(self, message):
         self._gui.log_line(message)            
     
@@ -115,11 +140,30 @@ class PyCatcherController:
     
     def shutdown(self):
         self._driver_connector.shutdown()
+        self._local_area_database.flush_sightings()
+        if self._journal:
+            #a clean shutdown ends the session, only a crash leaves the journal for recovery
+            self._journal.close(remove=True)
+            self._journal = None
+
+    def _on_journal_sync(self):
+        if self._journal:
+            self._journal.sync()
+        return True
+
+    def _compact_journal(self):
+        if self._journal:
+            self._journal.compact(self._base_station_list)
     
     def _found_base_station_callback(self, base_station):
         self._gui.log_line("found " + base_station.provider + ' (' + str(base_station.arfcn) + ')')
+        if self._journal:
+            self._journal.append_sighting(base_station)
         self._base_station_list.add_station(base_station)
-        self.trigger_evaluation()
+        if self._journal and self._journal.needs_compaction():
+            self._compact_journal()
+        self._local_area_database.record_sighting(base_station)
+        self.trigger_evaluation(incremental=True)
 
     def _firmware_waiting_callback(self):
         self._gui.log_line("firmware waiting for device")
@@ -210,12 +254,16 @@ class PyCatcherController:
             self.pch_active = False
             return
 
-        for station in self._base_station_list._get_unfiltered_list():
-            if station.arfcn == arfcn and self.pch_scan_integration.is_active:
-                station.imm_ass_non_hop = values['Assignments_non_hopping']
-                station.imm_ass_hop = values['Assignments_hopping']
-                station. pagings = values['Pagings']
-                station.pch_scan_done = True
+        station = self._base_station_list.get_station(arfcn)
+        if station and self.pch_scan_integration.is_active:
+            station.imm_ass_non_hop = values['Assignments_non_hopping']
+            station.imm_ass_hop = values['Assignments_hopping']
+            station.pagings = values['Pagings']
+            station.pch_scan_done = True
+            if self._journal:
+                self._journal.append_pch(arfcn, station.imm_ass_non_hop, station.imm_ass_hop, station.pagings)
+            self._base_station_list.mark_dirty(station)
+            self.trigger_evaluation(incremental=True)
         self._accumulated_pch_results.append(results)
         self._gui.log_line('Finished PCH scan on ARFCN %d'%arfcn)
         self._pch_scan_running = False
@@ -242,47 +290,47 @@ class PyCatcherController:
 
     def update_with_web_services(self):
         self._gui.log_line('Starting online lookups...')
-        for station in self._base_station_list._get_unfiltered_list():
-            found = False
-            if self.use_google:
-                self._gui.log_line('Looking up %d on Google.'%station.cell)
-                (status, lat, long) = self._cell_id_database.fetch_id_from_Google(station.cell, station.lac, station.country)
-                if status == CellIDDBStatus.CONFIRMED:
-                    self._gui.log_line('...found.')
-                    found = True
-                    station.latitude = lat
-                    station.longitude = long
-                    station.db_provider = CIDDatabases.GOOGLE
-                station.db_status = status
-            if self.use_open_cell_id and not found:
-                self._gui.log_line('Looking up %d on OpenCellID.'%station.cell)
-                (status, lat, long) = self._cell_id_database.fetch_id_from_OpenCellID(station.cell, station.lac, station.country, station.provider)
-                if status == CellIDDBStatus.CONFIRMED:
-                    self._gui.log_line('...found.')
-                    found = True
-                    station.latitude = lat
-                    station.longitude = long
-                    station.db_provider = CIDDatabases.OPENCID
-                elif status == CellIDDBStatus.APPROXIMATED:
-                    self._gui.log_line('...approximated.')
-                    station.latitude = lat
-                    station.longitude = long
-                    station.db_provider = CIDDatabases.OPENCID
-                station.db_status = status
-            if self.use_local_db[0] and not found:
-                self._gui.log_line('Looking up %d on Local.'%station.cell)
-                (status, lat, long) = self._cell_id_database.fetch_id_from_local(station.cell, self.use_local_db[1])
-                if status == CellIDDBStatus.CONFIRMED:
-                    self._gui.log_line('...found.')
-                    station.db_provider = CIDDatabases.LOCAL
-                    station.latitude = 0
-                    station.longitude = 0
-                station.db_status = status
-        self._gui.log_line('Finished online lookups.')
+        providers = []
+        if self._cell_id_database.has_offline_database():
+            providers.append((CIDDatabases.OFFLINE, lambda station:
+                self._cell_id_database.fetch_id_from_offline(station.cell, station.lac, station.country,
+                                                             station.provider)))
+        if self.use_google:
+            providers.append((CIDDatabases.GOOGLE, lambda station:
+                self._cell_id_database.fetch_id_from_Google(station.cell, station.lac, station.country)))
+        if self.use_open_cell_id:
+            providers.append((CIDDatabases.OPENCID, lambda station:
+                self._cell_id_database.fetch_id_from_OpenCellID(station.cell, station.lac, station.country,
+                                                                station.provider)))
+        local = None
+        if self.use_local_db[0]:
+            database = self.use_local_db[1]
+            local = (CIDDatabases.LOCAL, lambda stations:
+                self._cell_id_database.lookup_many([station.cell for station in stations], database))
+        self._lookup_scheduler.lookup(self._base_station_list._get_unfiltered_list(), providers, local,
+                                      self._lookup_result_callback, self._lookup_finished_callback)
+
+    def _lookup_result_callback(self, station, provider, status, lat, long):
+        if status == CellIDDBStatus.CONFIRMED:
+            self._gui.log_line('%d found on %s.'%(station.cell, provider))
+        elif status == CellIDDBStatus.APPROXIMATED:
+            self._gui.log_line('%d approximated on %s.'%(station.cell, provider))
+        if status in (CellIDDBStatus.CONFIRMED, CellIDDBStatus.APPROXIMATED):
+            station.latitude = lat
+            station.longitude = long
+            station.db_provider = provider
+        station.db_status = status
+        self._base_station_list.mark_dirty(station)
+        self._schedule_update()
+
+    def _lookup_finished_callback(self, looked_up, resolved):
+        self._gui.log_line('Finished online lookups, %d of %d cells found online.'%(resolved, looked_up))
+        self.trigger_evaluation()
 
     def update_location_database(self):
         self._local_area_database.load_or_create_database(self._location)
         self._local_area_database.insert_or_alter_base_stations(self._base_station_list._get_unfiltered_list())
+        self._local_area_database.compact_history()
         self._gui.log_line('Done with database upgrade on %s.'%self._location)
 
     def set_new_location(self,new_location):
@@ -290,39 +338,74 @@ class PyCatcherController:
             self._location = new_location
             self._local_area_database.load_or_create_database(self._location)
             self._gui.log_line('Location changed to %s'%self._location)
-        self._local_area_database.refresh_object_cache()
+            self.spatial_plausibility_rule.set_observer(Location_coordinates.get(self._location))
+            self.trigger_evaluation()
 
     def save_project(self, path):
-        filehandler = open(path, 'w')
-        pickle.dump(self._base_station_list, filehandler)
-        filehandler.close()
+        projectFormat.save_project(self._base_station_list, path)
+        self._compact_journal()
         self._gui.log_line('Project saved to ' + path)
 
     def load_project(self, path):
-        filehandler = open(path, 'r')
-        base_station_list = pickle.load(filehandler)
-        #bit of a hack to be able to use old scans
-        for station in base_station_list._get_unfiltered_list():
-            if not hasattr(station, 'pagings'):
-                station.imm_ass_hop = 0
-                station.imm_ass_non_hop = 0
-                station.pagings = 0
-                station.pch_scan_done = False
-        self._base_station_list = base_station_list
-        self.trigger_evaluation()
-        filehandler.close()
+        #lookups still running belong to the stations of the old project
+        self._lookup_scheduler.cancel()
+        current_format = projectFormat.is_project_file(path)
+        if current_format:
+            #system information and reports are only decoded when a report is shown
+            self._base_station_list = projectFormat.load_project(path, lazy=True)
+        else:
+            #projects saved by older versions are pickled station lists
+            self._base_station_list = projectFormat.load_legacy_project(path)
+        #the loaded project is the new base of the session journal, a current project file is taken as it is
+        if self._journal and current_format:
+            project = open(path, 'rb')
+            try:
+                self._journal.compact_snapshot(project.read())
+            finally:
+                project.close()
+        else:
+            self._compact_journal()
+        #the stations are shown with their saved evaluation first, the re-evaluation follows once the view is idle
+        self._schedule_update()
+        gobject.idle_add(self._evaluate_loaded_project)
         self._gui.log_line('Project loaded from  ' + path)
 
-    def trigger_evaluation(self):
+    def _evaluate_loaded_project(self):
+        self.trigger_evaluation()
+        return False
+
+    def trigger_evaluation(self, incremental=False):
         self._gui.log_line('Re-evaluation')
-        self._base_station_list.evaluate(self._rules, self._active_evaluator)
-        self._base_station_list.refill_store(self.bs_tree_list_data, self._filters)
+        if incremental:
+            self._base_station_list.evaluate_pending(self._rules, self._active_evaluator)
+        else:
+            self._base_station_list.evaluate(self._rules, self._active_evaluator)
+        self._schedule_update()
+
+    def _schedule_update(self):
+        #model changes are collected and shown at most max_updates_per_second times
+        if self._update_pending:
+            return
+        self._update_pending = True
+        delay = max(0, self._last_update + self._update_interval - time.time())
+        gobject.timeout_add(int(delay * 1000), self._flush_update)
+
+    def _flush_update(self):
+        self._update_pending = False
+        self._last_update = time.time()
+        self._base_station_list.update_store(self.bs_tree_list_data, self._store_rows, self._filters)
         self.trigger_redraw()
+        return False
 
     def trigger_redraw(self):
-        dotcode = self._base_station_list.get_dot_code(self._filters)
-        if dotcode != 'digraph bsnetwork { }':
-            self._gui.load_dot(dotcode)
+        graph = self._base_station_list.get_graph(self._filters)
+        if self._shown_graph != (graph, graph.version) and not graph.is_empty():
+            self._shown_graph = graph, graph.version
+            if GUI_settings['graph_layout'] == 'incremental':
+                nodes, edges = graph.get_elements()
+                self._gui.load_graph(nodes, edges)
+            else:
+                self._gui.load_dot(graph.get_dot_code())
         result = RuleResult.IGNORE
         at_least_warning = False
         for item in self._base_station_list._get_filtered_list(self._filters):
@@ -0,0 +1,21 @@
+import projectFormat
+import sessionJournal
+from pyCatcherModel import BaseStationInformation, BaseStationInformationList
+from rules import RuleResult, RuleDependency, Rule, create_rules
+from evaluators import EvaluatorSelect, ConservativeEvaluator, GroupEvaluator
+from filters import ARFCNFilter, ProviderFilter
+from cellIDDatabase import CellIDDatabase, CellIDDBStatus, CIDDatabases, Translator
+from localAreaDatabse import LocalAreaDatabase
+from cellTable import CellTable
+from offlineCellDatabase import OfflineCellDatabase
+
+#everything PyCatcher needs to load, evaluate and save scans without the GUI. none of these modules may import
+#gtk, gobject or numpy at module level, benchmarks.py core_import checks that and the import time budget
+
+def load_scan(path, lazy=False):
+    #projects, session journals and the pickled projects of older versions
+    if projectFormat.is_project_file(path):
+        return projectFormat.load_project(path, lazy)
+    if sessionJournal.is_journal_file(path):
+        return sessionJournal.replay_journal(path)
+    return projectFormat.load_legacy_project(path)
@@ -1,11 +1,13 @@
+import copy
 import datetime
-import gtk
 import math
 from cellIDDatabase import CellIDDBStatus
 from cellIDDatabase import CIDDatabases
-from rules import RuleResult
+from rules import RuleResult, RuleDependency, EvaluationContext, adapt_rule
 
 class BaseStationInformation:
+    #attributes a subclass decodes on first use, they are not filled with defaults when a project is loaded
+    lazy_fields = ()
 
     def __init__ (self):
         self.country = 'Nowhere'
@@ -92,61 +94,254 @@ SystemInfo_4:       %s
 
         return report_params + report_rules + report_evaluation + report_raw
     
+class BaseStationIndex:
+    def __init__(self, base_station_list=None):
+        self._by_arfcn = {}
+        self._by_cell = {}
+        self._by_lac = {}
+        self._by_provider = {}
+        self._keys = {}
+        if base_station_list:
+            for station in base_station_list:
+                self.add(station)
+
+    def add(self, station):
+        self._by_arfcn[station.arfcn] = station
+        self._insert(self._by_cell, station.cell, station)
+        self._insert(self._by_lac, station.lac, station)
+        self._insert(self._by_provider, station.provider, station)
+        self._keys[station.arfcn] = station.cell, station.lac, station.provider
+
+    def reindex(self, station):
+        cell, lac, provider = self._keys[station.arfcn]
+        if (cell, lac, provider) == (station.cell, station.lac, station.provider):
+            return
+        self._discard(self._by_cell, cell, station)
+        self._discard(self._by_lac, lac, station)
+        self._discard(self._by_provider, provider, station)
+        self.add(station)
+
+    def get(self, arfcn):
+        return self._by_arfcn.get(arfcn)
+
+    def by_cell(self, cell):
+        return self._by_cell.get(cell, {}).values()
+
+    def by_lac(self, lac):
+        return self._by_lac.get(lac, {}).values()
+
+    def by_provider(self, provider):
+        return self._by_provider.get(provider, {}).values()
+
+    def _insert(self, index, key, station):
+        if index.has_key(key):
+            index[key][station.arfcn] = station
+        else:
+            index[key] = {station.arfcn: station}
+
+    def _discard(self, index, key, station):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.pop(station.arfcn, None)
+        if not bucket:
+            del index[key]
+
+class GraphModel:
+    #the neighbour graph of the shown stations, version only changes when a colour or an edge did
+    _colours = {RuleResult.OK: 'green', RuleResult.WARNING: 'yellow', RuleResult.CRITICAL: 'red'}
+
+    def __init__(self):
+        self.version = 0
+        self._order = []
+        self._nodes = {}
+        self._fragments = {}
+        self._dot_code = None
+        self._elements = None
+
+    def update(self, stations):
+        order = []
+        changed = False
+        for station in stations:
+            arfcn = station.arfcn
+            order.append(arfcn)
+            colour = self._colours.get(station.evaluation, 'white')
+            node = self._nodes.get(arfcn)
+            if node is None or node[0] != colour or node[1] != station.neighbours:
+                self._nodes[arfcn] = colour, list(station.neighbours)
+                self._fragments[arfcn] = None
+                changed = True
+        if order != self._order:
+            for arfcn in set(self._order) - set(order):
+                del self._nodes[arfcn]
+                del self._fragments[arfcn]
+            self._order = order
+            changed = True
+        if changed:
+            self.version += 1
+            self._dot_code = None
+            self._elements = None
+        return changed
+
+    def is_empty(self):
+        return not self._order
+
+    def get_dot_code(self):
+        if self._dot_code is None:
+            fragments = []
+            for arfcn in self._order:
+                fragment = self._fragments[arfcn]
+                if fragment is None:
+                    fragment = self._fragment(arfcn)
+                    self._fragments[arfcn] = fragment
+                fragments.append(fragment)
+            self._dot_code = 'digraph bsnetwork { ' + ''.join(fragments) + '}'
+        return self._dot_code
+
+    def get_elements(self):
+        #nodes map arfcn to the fill colour, neighbours that were never scanned themselves have none
+        if self._elements is None:
+            nodes = {}
+            edges = []
+            for arfcn in self._order:
+                colour, neighbours = self._nodes[arfcn]
+                nodes[arfcn] = colour
+                edges.extend([(arfcn, neighbour) for neighbour in neighbours])
+            for source, target in edges:
+                if not nodes.has_key(target):
+                    nodes[target] = None
+            self._elements = nodes, edges
+        return self._elements
+
+    def _fragment(self, arfcn):
+        colour, neighbours = self._nodes[arfcn]
+        name = str(arfcn)
+        return name + ' [style = filled, fillcolor = ' + colour + ']; ' + \
+               ''.join([name + ' -> ' + str(neighbour) + '; ' for neighbour in neighbours])
+
 class BaseStationInformationList:
     def __init__(self):
         self._base_station_list = []
-        
+        self._index = BaseStationIndex()
+        self._graph = GraphModel()
+        self._reset_evaluation_state()
+
+    def __getstate__(self):
+        #only the plain list is pickled, so projects stay readable by older versions
+        return {'_base_station_list': self._base_station_list}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.replace_stations(self._base_station_list)
+
+    def replace_stations(self, stations):
+        #scans saved by older versions lack some attributes, fill them with the defaults
+        defaults = BaseStationInformation().__dict__
+        for station in stations:
+            for key, value in defaults.items():
+                if not station.__dict__.has_key(key) and key not in station.lazy_fields:
+                    setattr(station, key, copy.copy(value))
+        self._base_station_list = stations
+        self._index = BaseStationIndex(self._base_station_list)
+        self._graph = GraphModel()
+        self._reset_evaluation_state()
+
+    def _reset_evaluation_state(self):
+        self._context = None
+        self._evaluated_with = None
+        self._pending = {}
+        self._pending_sightings = 0
+
     def add_station(self, base_station):
         base_station.found = True
-        for item in self._base_station_list:
-            if item.arfcn == base_station.arfcn:
-                item.discovery_time = datetime.datetime.now().strftime('%T')
-                item.times_scanned += 1
-                item.rxlev = base_station.rxlev
-                item.lac = base_station.lac
-                item.cell = base_station.cell
-                item.bsic = base_station.bsic
-                item.neighbours = base_station.neighbours
-                item.country = base_station.country
-                item.provider = base_station.provider
-                item.system_info_t1 = base_station.system_info_t1
-                item.system_info_t3 = base_station.system_info_t3
-                item.system_info_t4 = base_station.system_info_t4
-                item.system_info_t2 = base_station.system_info_t2
-                item.system_info_t2bis = base_station.system_info_t2bis
-                item.system_info_t2ter = base_station.system_info_t2ter
-                break
+        item = self._index.get(base_station.arfcn)
+        if item:
+            item.discovery_time = datetime.datetime.now().strftime('%T')
+            item.times_scanned += 1
+            item.rxlev = base_station.rxlev
+            item.lac = base_station.lac
+            item.cell = base_station.cell
+            item.bsic = base_station.bsic
+            item.neighbours = base_station.neighbours
+            item.country = base_station.country
+            item.provider = base_station.provider
+            item.system_info_t1 = base_station.system_info_t1
+            item.system_info_t3 = base_station.system_info_t3
+            item.system_info_t4 = base_station.system_info_t4
+            item.system_info_t2 = base_station.system_info_t2
+            item.system_info_t2bis = base_station.system_info_t2bis
+            item.system_info_t2ter = base_station.system_info_t2ter
+            self._index.reindex(item)
         else:
-            self._base_station_list.append(base_station)
+            item = base_station
+            self._base_station_list.append(item)
+            self._index.add(item)
+        if self._context:
+            self._mark_pending(item)
+
+    def mark_dirty(self, station):
+        #stations changed outside add_station, e.g. by a PCH scan or a lookup, are reevaluated by evaluate_pending().
+        #a station of another list, such as a late result for a project that has been replaced, is ignored
+        if self._context and self.get_station(station.arfcn) is station:
+            self._mark_pending(station)
+
+    def _mark_pending(self, station):
+        change = self._context.refresh_station(station)
+        for dependency in (RuleDependency.STATION, RuleDependency.CELL, RuleDependency.PROVIDER, RuleDependency.NEIGHBOURHOOD):
+            affected = self._context.affected_arfcns(station.arfcn, change, dependency)
+            self._pending.setdefault(dependency, set()).update(affected)
+        self._pending_sightings += 1
+
+    def get_station(self, arfcn):
+        return self._index.get(int(arfcn))
+
+    def get_stations_by_cell(self, cell):
+        return self._index.by_cell(cell)
+
+    def get_stations_by_lac(self, lac):
+        return self._index.by_lac(lac)
+
+    def get_stations_by_provider(self, provider):
+        return self._index.by_provider(provider)
+
+    def get_graph(self, filters=None):
+        self._graph.update(self._get_filtered_list(filters))
+        return self._graph
 
     def get_dot_code(self, filters=None):
-        preamble = r'digraph bsnetwork { '
-        postamble = r'}'
-        code = ''
+        return self.get_graph(filters).get_dot_code()
 
-        filtered_list = self._get_filtered_list(filters)
+    def get_graph_elements(self, filters=None):
+        return self.get_graph(filters).get_elements()
 
-        for station in filtered_list:
-            if station.evaluation == RuleResult.OK:
-                code += str(station.arfcn) + r' [style = filled, fillcolor = green]; '
-            elif station.evaluation == RuleResult.WARNING:
-                code += str(station.arfcn) + r' [style = filled, fillcolor = yellow]; '
-            elif station.evaluation == RuleResult.CRITICAL:
-                code += str(station.arfcn) + r' [style = filled, fillcolor = red]; '
-            else:
-                code += str(station.arfcn) + r' [style = filled, fillcolor = white]; '
-            for neighbour in station.neighbours:
-                code += str(station.arfcn) + r' -> ' + str(neighbour) + r'; '
-        #TODO: make printing the source a fixed option
-        #print preamble + code + postamble
-        return preamble + code + postamble
-    
     def refill_store(self, store, filters=None):
         store.clear()
         filtered_list = self._get_filtered_list(filters)
         for item in filtered_list:
             store.append(item.get_list_model())
 
+    def update_store(self, store, rows, filters=None):
+        #rows maps arfcn to (tree iter, row) of what the store currently shows
+        if not rows:
+            store.clear()
+        visible = set()
+        for item in self._get_filtered_list(filters):
+            visible.add(item.arfcn)
+            row = item.get_list_model()
+            if rows.has_key(item.arfcn):
+                tree_iter, old_row = rows[item.arfcn]
+                if row != old_row:
+                    columns = []
+                    for column, value in enumerate(row):
+                        columns += [column, value]
+                    store.set(tree_iter, *columns)
+                    rows[item.arfcn] = tree_iter, row
+            else:
+                rows[item.arfcn] = store.append(row), row
+        for arfcn in rows.keys():
+            if arfcn not in visible:
+                store.remove(rows.pop(arfcn)[0])
+
     def _get_unfiltered_list(self):
         return self._base_station_list
 
@@ -163,16 +358,60 @@ class BaseStationInformationList:
 
 
     def create_report(self, arfcn):
-        for item in self._base_station_list:
-            if item.arfcn == int(arfcn):
-                return item.create_report()
+        item = self.get_station(arfcn)
+        if item:
+            return item.create_report()
 
-    def evaluate(self, rules, evaluator):
-        for station in self._base_station_list:
+    def evaluate(self, rules, evaluator, columnar=False):
+        active_rules = [adapt_rule(rule) for rule in rules if rule.is_active]
+        scalar_rules = active_rules
+        columns = {}
+        if columnar:
+            #imported here so that the model loads without numpy
+            from columnarEngine import ColumnarRuleEngine, columnar_engine_available
+        if columnar and columnar_engine_available():
+            engine = ColumnarRuleEngine(self._base_station_list)
+            columns = engine.evaluate(active_rules)
+            scalar_rules = [rule for rule in active_rules if not engine.supports(rule)]
+        #without scalar rules there is no context to keep, evaluate_pending() then does a full pass
+        context = None
+        if scalar_rules or not columns:
+            context = EvaluationContext(self._base_station_list)
+        for position, station in enumerate(self._base_station_list):
             rule_results = {}
-            for rule in rules:
-                if rule.is_active:
-                    rule_results[rule.identifier] = rule.check(station.arfcn, self._base_station_list)
+            for identifier, column in columns.items():
+                rule_results[identifier] = column[position]
+            for rule in scalar_rules:
+                rule_results[rule.identifier] = rule.check_context(station.arfcn, context)
             station.rules_report = rule_results.copy()
             station.evaluation, station.evaluation_report = evaluator.evaluate(rule_results)
             station.evaluation_by = evaluator.identifier
+        self._reset_evaluation_state()
+        self._context = context
+        self._evaluated_with = [rule.identifier for rule in active_rules], evaluator.identifier
+
+    def evaluate_pending(self, rules, evaluator):
+        active_rules = [adapt_rule(rule) for rule in rules if rule.is_active]
+        if not self._context or self._evaluated_with != ([rule.identifier for rule in active_rules], evaluator.identifier):
+            self.evaluate(rules, evaluator)
+            return
+        if not self._pending_sightings:
+            return
+
+        touched = set()
+        for rule in active_rules:
+            if rule.dependency == RuleDependency.ALL:
+                dirty = self._context.arfcns()
+            else:
+                dirty = self._pending.get(rule.dependency, ())
+            for arfcn in dirty:
+                station = self._context.station(arfcn)
+                station.rules_report[rule.identifier] = rule.check_context(arfcn, self._context)
+                touched.add(arfcn)
+
+        for arfcn in touched:
+            station = self._context.station(arfcn)
+            station.evaluation, station.evaluation_report = evaluator.evaluate(station.rules_report.copy())
+            station.evaluation_by = evaluator.identifier
+        self._pending = {}
+        self._pending_sightings = 0
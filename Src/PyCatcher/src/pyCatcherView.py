@@ -1,7 +1,8 @@
 import locale
 import gtk
 from cellIDDatabase import CIDDatabases
-from xdot import DotWidget
+from xdot import DotWidget, LayoutGraphBuilder
+from graphLayout import IncrementalLayout
 import datetime
 import time
 from rules import RuleResult
@@ -56,6 +57,8 @@ class PyCatcherGUI:
         self._dot_widget.set_filter('neato')
         self._dot_widget.show()
         self._dot_widget.connect('clicked', self._on_graph_node_clicked)
+        self._graph_layout = IncrementalLayout()
+        self._graph_builder = LayoutGraphBuilder()
 
         self._builder.connect_signals(self)
         
@@ -369,6 +372,10 @@ class PyCatcherGUI:
         except IOError, ex:
             self.show_info(ex)
     
+    def load_graph(self, nodes, edges):
+        positions = self._graph_layout.update(nodes.keys(), edges)
+        self._dot_widget.set_graph(self._graph_builder.build(positions, nodes, edges))
+
     def load_dot(self, dotcode, filename="<stdin>"):
         if self._dot_widget.set_dotcode(dotcode, filename):
             #self._dot_widget.zoom_to_fit()
@@ -1,6 +1,9 @@
 from settings import Provider_list, Provider_Country_list, LAC_mapping, ARFCN_mapping, LAC_threshold, DB_RX_threshold, \
-    CH_RX_threshold, Pagings_per_10s_threshold, Assignment_limit, Neighbours_threshold
-from cellIDDatabase import CellIDDBStatus
+    CH_RX_threshold, Pagings_per_10s_threshold, Assignment_limit, Neighbours_threshold, Spatial_threshold, \
+    Sighting_history
+from cellIDDatabase import CellIDDBStatus, Translator
+from geo import haversine_many, rxlev_distance
+import bisect
 import math
 
 class RuleResult:
@@ -9,11 +12,161 @@ class RuleResult:
     CRITICAL = 'Critical'
     IGNORE = 'Ignore'
 
+class RuleDependency:
+    STATION = 'Station'
+    CELL = 'Cell'
+    PROVIDER = 'Provider'
+    NEIGHBOURHOOD = 'Neighbourhood'
+    ALL = 'All'
+
+class EvaluationContext:
+    def __init__(self, base_station_list):
+        self.base_station_list = base_station_list
+        self._stations = {}
+        self._snapshots = {}
+        self._provider_stations = {}
+        self._provider_lacs = {}
+        self._cell_arfcns = {}
+        self._reverse_neighbours = {}
+        for station in base_station_list:
+            self._add(station)
+
+    def station(self, arfcn):
+        return self._stations.get(arfcn)
+
+    def arfcns(self):
+        return self._stations.keys()
+
+    def stations_of_provider(self, provider):
+        return self._provider_stations.get(provider, {}).values()
+
+    def provider_lacs(self, provider):
+        return self._provider_lacs.get(provider, [])
+
+    def cell_arfcns(self, cell):
+        return self._cell_arfcns.get(cell, ())
+
+    def reverse_neighbours(self, arfcn):
+        return self._reverse_neighbours.get(arfcn, ())
+
+    def provider_lac_median(self, provider):
+        lacs = self.provider_lacs(provider)
+        if len(lacs) < 2:
+            return None
+        return lacs[int(len(lacs)/2)]
+
+    def refresh_station(self, station):
+        old_snapshot = self._snapshots.get(station.arfcn)
+        providers = set([station.provider])
+        if old_snapshot:
+            providers.add(old_snapshot[0])
+        old_medians = dict((provider, self.provider_lac_median(provider)) for provider in providers)
+        if old_snapshot:
+            self._remove(station.arfcn, old_snapshot)
+        self._add(station)
+        return old_snapshot, old_medians
+
+    def affected_arfcns(self, arfcn, change, dependency):
+        affected = set([arfcn])
+        if dependency == RuleDependency.STATION:
+            return affected
+        if dependency == RuleDependency.ALL:
+            affected.update(self._stations)
+            return affected
+
+        old_snapshot, old_medians = change
+        provider, lac, cell, neighbours = self._snapshots[arfcn]
+        if old_snapshot:
+            old_provider, old_lac, old_cell, old_neighbours = old_snapshot
+        else:
+            old_provider, old_lac, old_cell, old_neighbours = None, None, None, ()
+
+        if dependency == RuleDependency.CELL:
+            if cell != old_cell:
+                affected.update(self.cell_arfcns(cell))
+                affected.update(self.cell_arfcns(old_cell))
+        elif dependency == RuleDependency.PROVIDER:
+            #provider rules only see the group through its LAC median
+            for group in set([provider, old_provider]):
+                if old_medians.get(group) != self.provider_lac_median(group):
+                    affected.update(self._provider_stations.get(group, {}))
+        elif dependency == RuleDependency.NEIGHBOURHOOD:
+            changed_neighbours = set(neighbours).symmetric_difference(old_neighbours)
+            if not old_snapshot or provider != old_provider:
+                affected.update(self.reverse_neighbours(arfcn))
+                changed_neighbours.update(neighbours)
+                changed_neighbours.update(old_neighbours)
+            for neighbour in changed_neighbours:
+                if self._stations.has_key(neighbour):
+                    affected.add(neighbour)
+                affected.update(self.reverse_neighbours(neighbour))
+        return affected
+
+    def _add(self, station):
+        arfcn = station.arfcn
+        if self._stations.has_key(arfcn):
+            #first entry wins, like the linear scans the rules used to do
+            return
+        neighbours = tuple(station.neighbours)
+        self._stations[arfcn] = station
+        self._snapshots[arfcn] = station.provider, station.lac, station.cell, neighbours
+        self._provider_stations.setdefault(station.provider, {})[arfcn] = station
+        bisect.insort(self._provider_lacs.setdefault(station.provider, []), station.lac)
+        self._cell_arfcns.setdefault(station.cell, set()).add(arfcn)
+        for neighbour in neighbours:
+            self._reverse_neighbours.setdefault(neighbour, set()).add(arfcn)
+
+    def _remove(self, arfcn, snapshot):
+        provider, lac, cell, neighbours = snapshot
+        del self._stations[arfcn]
+        del self._snapshots[arfcn]
+        self._discard(self._provider_stations, provider, arfcn)
+        lacs = self._provider_lacs[provider]
+        del lacs[bisect.bisect_left(lacs, lac)]
+        if not lacs:
+            del self._provider_lacs[provider]
+        self._discard(self._cell_arfcns, cell, arfcn)
+        for neighbour in neighbours:
+            self._discard(self._reverse_neighbours, neighbour, arfcn)
+
+    def _discard(self, index, key, arfcn):
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        if arfcn in bucket:
+            if isinstance(bucket, dict):
+                del bucket[arfcn]
+            else:
+                bucket.discard(arfcn)
+        if not bucket:
+            del index[key]
+
+class LegacyRuleAdapter:
+    def __init__(self, rule):
+        self.rule = rule
+        self.is_active = rule.is_active
+        self.identifier = rule.identifier
+        self.dependency = RuleDependency.ALL
+
+    def check_context(self, arfcn, context):
+        return self.rule.check(arfcn, context.base_station_list)
+
+def adapt_rule(rule):
+    #rules written against the old check(arfcn, base_station_list) signature get wrapped
+    rule_class = rule.__class__
+    if rule_class.check.im_func is not Rule.check.im_func and rule_class.check_context.im_func is Rule.check_context.im_func:
+        return LegacyRuleAdapter(rule)
+    return rule
+
 class Rule:
     is_active = False
     identifier = 'Rule'
+    dependency = RuleDependency.ALL
 
     def check(self, arfcn, base_station_list):
+        return self.check_context(arfcn, EvaluationContext(base_station_list))
+
+    def check_context(self, arfcn, context):
         return RuleResult.CRITICAL
 
     def _extract_neighbours(self, arfcn, base_station_list):
@@ -28,102 +181,81 @@ class Rule:
 
 class ProviderRule (Rule):
     identifier = 'Provider Check'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        result = RuleResult.CRITICAL
-
-        for station in base_station_list:
-            if station.arfcn == arfcn:
-                if station.provider in Provider_list:
-                    result = RuleResult.OK
-                    break
-        return result
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        if station and station.provider in Provider_list:
+            return RuleResult.OK
+        return RuleResult.CRITICAL
 
 class CountryMappingRule (Rule):
     identifier = 'Country Provider Mapping'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        result = RuleResult.OK
-
-        for station in base_station_list:
-            if station.arfcn == arfcn:
-                if station.provider in Provider_Country_list:
-                    if station.country != Provider_Country_list[station.provider]:
-                        result = RuleResult.CRITICAL
-                else:
-                    result = RuleResult.CRITICAL
-        return result
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        if not station:
+            return RuleResult.OK
+        if station.provider in Provider_Country_list:
+            if station.country != Provider_Country_list[station.provider]:
+                return RuleResult.CRITICAL
+            return RuleResult.OK
+        return RuleResult.CRITICAL
 
 class ARFCNMappingRule (Rule):
     identifier = 'ARFCN Mapping'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        result = RuleResult.CRITICAL
-
-        for station in base_station_list:
-            if station.arfcn == arfcn:
-                if station.provider in ARFCN_mapping:
-                    for lower,upper in ARFCN_mapping[station.provider]:
-                        if lower <= station.arfcn <= upper:
-                            result = RuleResult.OK
-                            break
-        return result
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        if station and station.provider in ARFCN_mapping:
+            for lower,upper in ARFCN_mapping[station.provider]:
+                if lower <= station.arfcn <= upper:
+                    return RuleResult.OK
+        return RuleResult.CRITICAL
 
 class LACMappingRule (Rule):
     identifier = 'LAC Mapping'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        result = RuleResult.CRITICAL
-
-        for station in base_station_list:
-            if station.arfcn == arfcn:
-                if station.provider in LAC_mapping:
-                    for lac in LAC_mapping[station.provider]:
-                        if station.lac == lac:
-                            result = RuleResult.OK
-                            break
-        return result
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        if station and station.provider in LAC_mapping:
+            if station.lac in LAC_mapping[station.provider]:
+                return RuleResult.OK
+        return RuleResult.CRITICAL
 
 class UniqueCellIDRule (Rule):
     identifier = 'Unique CellID'
+    dependency = RuleDependency.CELL
 
-    def check(self, arfcn, base_station_list):
-        result = RuleResult.OK
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
         cell_id = 0
-
-        for station in base_station_list:
-            if station.arfcn == arfcn:
-                cell_id = station.cell
-
-        for station in base_station_list:
-            if station.arfcn != arfcn:
-                if station.cell == cell_id:
-                    result = RuleResult.CRITICAL
-        return result
+        if station:
+            cell_id = station.cell
+        for other_arfcn in context.cell_arfcns(cell_id):
+            if other_arfcn != arfcn:
+                return RuleResult.CRITICAL
+        return RuleResult.OK
 
 class LACMedianRule (Rule):
     identifier = 'LAC Median Deviation'
+    dependency = RuleDependency.PROVIDER
 
-    def check(self, arfcn, base_station_list):
-        lac_median_list = []
-        provider = self._extract_provider(arfcn, base_station_list)
-        lac_to_test = 0
-
-        for item in base_station_list:
-            if arfcn == item.arfcn:
-                lac_to_test = item.lac
-            if provider == item.provider:
-                lac_median_list.append(item.lac)
-
-        if len(lac_median_list) < 2:
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        if not station:
+            return RuleResult.IGNORE
+        median = context.provider_lac_median(station.provider)
+        if median is None:
             return RuleResult.IGNORE
 
-        lac_median_list.sort()
-        median = lac_median_list[int(len(lac_median_list)/2)]
         upper_bound = median + median * LAC_threshold
         lower_bound = median - median * LAC_threshold
 
-        if lower_bound <= lac_to_test <= upper_bound:
+        if lower_bound <= station.lac <= upper_bound:
             return RuleResult.OK
         else:
             return RuleResult.CRITICAL
@@ -131,33 +263,27 @@ class LACMedianRule (Rule):
 
 class NeighbourhoodStructureRule (Rule):
     identifier = 'Neighbourhood Structure'
+    dependency = RuleDependency.NEIGHBOURHOOD
 
-    def check(self, arfcn, base_station_list):
-        own_provider = self._extract_provider(arfcn, base_station_list)
-        own_neighbours = self._extract_neighbours(arfcn, base_station_list)
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        own_neighbours = station.neighbours
         if not len(own_neighbours):
             return RuleResult.CRITICAL
         at_least_one_neighbour_found = False
         at_least_one_indirect_neighbour = False
 
-        for item in base_station_list:
-            if item.arfcn in own_neighbours:
+        for neighbour_arfcn in own_neighbours:
+            if context.station(neighbour_arfcn):
                 at_least_one_neighbour_found = True
                 break
-            else:
-                if item.arfcn != arfcn:
-                    for foreign_neighbour_arfcn in item.neighbours:
-                        if foreign_neighbour_arfcn in own_neighbours:
-                            at_least_one_indirect_neighbour = True
+            for foreign_arfcn in context.reverse_neighbours(neighbour_arfcn):
+                if foreign_arfcn != arfcn:
+                    at_least_one_indirect_neighbour = True
 
         incoming_edges = False
-        all_neighbours = []
-        for station in base_station_list:
-            if station.provider == own_provider:
-                for neighbour in station.neighbours:
-                    all_neighbours.append(neighbour)
-        for neighbour_arfcn in all_neighbours:
-            if neighbour_arfcn == arfcn:
+        for foreign_arfcn in context.reverse_neighbours(arfcn):
+            if context.station(foreign_arfcn).provider == station.provider:
                 incoming_edges = True
                 break
 
@@ -171,39 +297,33 @@ class NeighbourhoodStructureRule (Rule):
 
 class PureNeighbourhoodRule (Rule):
     identifier = 'Pure Neighbourhoods'
+    dependency = RuleDependency.NEIGHBOURHOOD
 
-    def check(self, arfcn, base_station_list):
-
-        neighbours = self._extract_neighbours(arfcn, base_station_list)
-        provider = self._extract_provider(arfcn, base_station_list)
-        all_neighbours_pure = True
-        for item in base_station_list:
-            if item.arfcn in neighbours:
-                if not item.provider == provider:
-                    all_neighbours_pure = False
-
-        if all_neighbours_pure:
-            return RuleResult.OK
-        else:
-            return RuleResult.CRITICAL
+    def check_context(self, arfcn, context):
+        station = context.station(arfcn)
+        for neighbour_arfcn in station.neighbours:
+            neighbour = context.station(neighbour_arfcn)
+            if neighbour and neighbour.provider != station.provider:
+                return RuleResult.CRITICAL
+        return RuleResult.OK
 
 
 class DiscoveredNeighboursRule (Rule):
     identifier = 'Discovered Neighbours'
+    dependency = RuleDependency.NEIGHBOURHOOD
 
-    def check(self, arfcn, base_station_list):
+    def check_context(self, arfcn, context):
+        if Neighbours_threshold < 0:
+            return RuleResult.IGNORE
 
-        neighbours = self._extract_neighbours(arfcn, base_station_list)
+        neighbours = context.station(arfcn).neighbours
         found = 0
-        for item in base_station_list:
-            if item.arfcn in neighbours:
+        for neighbour_arfcn in set(neighbours):
+            if context.station(neighbour_arfcn):
                 found += 1
 
-        if Neighbours_threshold < 0:
-            return RuleResult.IGNORE
-
         if 0 <= Neighbours_threshold <=1:
-            if (float(found) / float(neighbours)) >= Neighbours_threshold:
+            if neighbours and (float(found) / float(len(neighbours))) >= Neighbours_threshold:
                 return RuleResult.OK
             else:
                 return RuleResult.CRITICAL
@@ -215,121 +335,215 @@ class DiscoveredNeighboursRule (Rule):
 
 class LocationAreaDatabaseRule(Rule):
     identifier = 'Local Area Database'
+    dependency = RuleDependency.STATION
     def __init__(self):
         self.location_database_object = None
 
-    def check(self, arfcn, base_station_list):
+    def check_context(self, arfcn, context):
         if not self.location_database_object:
             return RuleResult.IGNORE
-        for item in base_station_list:
-            if item.arfcn == arfcn:
-                result = self.location_database_object.get_station(item.cell)
-                if not result:
-                    return RuleResult.IGNORE
+        item = context.station(arfcn)
+        if item:
+            result = self.location_database_object.get_station(item.cell)
+            if not result:
+                return RuleResult.IGNORE
+            if result.samples >= Sighting_history['min_samples']:
+                #percentiles of the sighting history, a single outlier does not widen the accepted range
+                rxmin = result.p5
+                rxmax = result.p95
+            else:
                 rxmin = result.rxmin
                 rxmax = result.rxmax
-                rxmin_thresh = rxmin - math.fabs(rxmin * DB_RX_threshold)
-                rxmax_thresh = rxmax + math.fabs(rxmax * DB_RX_threshold)
+            rxmin_thresh = rxmin - math.fabs(rxmin * DB_RX_threshold)
+            rxmax_thresh = rxmax + math.fabs(rxmax * DB_RX_threshold)
 
-                if rxmin_thresh <= float(item.rxlev) <= rxmax_thresh:
-                    return RuleResult.OK
-                else:
-                    return RuleResult.CRITICAL
+            if rxmin_thresh <= float(item.rxlev) <= rxmax_thresh:
+                return RuleResult.OK
+            else:
+                return RuleResult.CRITICAL
 
 class CellIDDatabaseRule (Rule):
     identifier = 'CellID Database'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        for item in base_station_list:
-            if item.arfcn == arfcn:
-                if item.db_status == CellIDDBStatus.NOT_LOOKED_UP:
-                    return RuleResult.IGNORE
-                if item.db_status == CellIDDBStatus.CONFIRMED:
-                    return RuleResult.OK
-                else:
-                    return RuleResult.CRITICAL
+    def __init__(self):
+        #optional cellTable.CellTable, checks stations that were never looked up against a table of known cells
+        self.cell_table = None
+
+    def check_context(self, arfcn, context):
+        item = context.station(arfcn)
+        if item:
+            if item.db_status == CellIDDBStatus.NOT_LOOKED_UP:
+                if self.cell_table:
+                    return self._check_cell_table(item)
+                return RuleResult.IGNORE
+            if item.db_status == CellIDDBStatus.CONFIRMED:
+                return RuleResult.OK
+            else:
+                return RuleResult.CRITICAL
+
+    def _check_cell_table(self, item):
+        mcc = Translator.MCC.get(item.country)
+        mnc = Translator.Provider.get(item.provider)
+        if mcc is None or mnc is None:
+            return RuleResult.IGNORE
+        if (mcc, int(mnc), item.lac, item.cell) in self.cell_table:
+            return RuleResult.OK
+        return RuleResult.CRITICAL
+
+class SpatialPlausibilityRule (Rule):
+    identifier = 'Spatial Plausibility'
+    dependency = RuleDependency.STATION
+
+    def __init__(self):
+        self._observer = None
+        self._distances = {}
+        self._max_distances = {}
+
+    def set_observer(self, position):
+        #position is (latitude, longitude) or None, cell distances are kept until the location changes
+        if position != self._observer:
+            self._observer = position
+            self._distances = {}
+
+    def check_context(self, arfcn, context):
+        item = context.station(arfcn)
+        if item:
+            if not self._observer or not self._is_located(item):
+                return RuleResult.IGNORE
+            distance = self._distances.get((item.latitude, item.longitude))
+            if distance is None:
+                self._prepare(context)
+                distance = self._distances[(item.latitude, item.longitude)]
+            if distance <= self._max_distance(item.rxlev):
+                return RuleResult.OK
+            else:
+                return RuleResult.CRITICAL
+
+    def _is_located(self, item):
+        return item.db_status == CellIDDBStatus.CONFIRMED and (item.latitude or item.longitude)
+
+    def _prepare(self, context):
+        #distances of all located cells of the scan in one go, later sightings only look them up
+        positions = set()
+        for arfcn in context.arfcns():
+            item = context.station(arfcn)
+            if self._is_located(item) and not self._distances.has_key((item.latitude, item.longitude)):
+                positions.add((item.latitude, item.longitude))
+        positions = list(positions)
+        latitude, longitude = self._observer
+        distances = haversine_many(latitude, longitude, [position[0] for position in positions],
+                                   [position[1] for position in positions])
+        self._distances.update(zip(positions, distances))
+
+    def _max_distance(self, rxlev):
+        rxlev = int(rxlev)
+        distance = self._max_distances.get(rxlev)
+        if distance is None:
+            distance = max(Spatial_threshold['min_distance'], Spatial_threshold['distance_factor'] *
+                           rxlev_distance(rxlev, Spatial_threshold['eirp'], Spatial_threshold['reference_loss'],
+                                          Spatial_threshold['path_loss_exponent']))
+            self._max_distances[rxlev] = distance
+        return distance
 
 class LACChangeRule (Rule):
     identifier = 'LAC Change Rule'
+    dependency = RuleDependency.STATION
 
     def __init__(self):
         self._old_lac = {}
 
-    def check(self, arfcn, base_station_list):
-        for item in base_station_list:
-            if item.arfcn == arfcn:
-                if self._old_lac.has_key(arfcn):
-                    lac, old_scanned, old_result = self._old_lac[arfcn]
-                    if item.times_scanned > 1:
-                        if item.times_scanned > old_scanned:
-                            #print 'evaluating lac change on %d(%d): old lac %d / new lac %d'%(item.times_scanned,arfcn, lac, item.lac)
-                            if item.lac == lac:
-                                self._old_lac[arfcn] = item.lac, item.times_scanned, RuleResult.OK
-                                #print '     return ok'
-                                return RuleResult.OK
-                            else:
-                                self._old_lac[arfcn] = lac, item.times_scanned, RuleResult.CRITICAL
-                                #print '     return critical'
-                                return RuleResult.CRITICAL
+    def check_context(self, arfcn, context):
+        item = context.station(arfcn)
+        if item:
+            if self._old_lac.has_key(arfcn):
+                lac, old_scanned, old_result = self._old_lac[arfcn]
+                if item.times_scanned > 1:
+                    if item.times_scanned > old_scanned:
+                        #print 'evaluating lac change on %d(%d): old lac %d / new lac %d'%(item.times_scanned,arfcn, lac, item.lac)
+                        if item.lac == lac:
+                            self._old_lac[arfcn] = item.lac, item.times_scanned, RuleResult.OK
+                            #print '     return ok'
+                            return RuleResult.OK
                         else:
-                            return old_result
+                            self._old_lac[arfcn] = lac, item.times_scanned, RuleResult.CRITICAL
+                            #print '     return critical'
+                            return RuleResult.CRITICAL
                     else:
                         return old_result
                 else:
-                    self._old_lac[arfcn] = item.lac, item.times_scanned, RuleResult.IGNORE
-                    return RuleResult.IGNORE
+                    return old_result
+            else:
+                self._old_lac[arfcn] = item.lac, item.times_scanned, RuleResult.IGNORE
+                return RuleResult.IGNORE
 
 class RxChangeRule (Rule):
     identifier = 'rx Change Rule'
+    dependency = RuleDependency.STATION
 
     def __init__(self):
         self._old_rx = {}
 
-    def check(self, arfcn, base_station_list):
-        for item in base_station_list:
-            if item.arfcn == arfcn:
-                if self._old_rx.has_key(arfcn):
-                    rx, old_scanned, old_result = self._old_rx[arfcn]
-                    if item.times_scanned > 1:
-                        if item.times_scanned > old_scanned:
-                            #print 'evaluating rx change on %d(%d): old rx %d / new rx %d'%(item.times_scanned,arfcn, rx, item.rxlev)
-                            lower_bound = rx - math.fabs(rx * CH_RX_threshold)
-                            upper_bound = rx + math.fabs(rx * CH_RX_threshold)
-                            #print '     thresholds: %d/%d'%(lower_bound, upper_bound)
-                            if lower_bound <= item.rxlev <= upper_bound:
-                                self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.OK
-                                #print '     return ok'
-                                return RuleResult.OK
-                            else:
-                                self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.CRITICAL
-                                #print '     return critical '
-                                return RuleResult.CRITICAL
+    def check_context(self, arfcn, context):
+        item = context.station(arfcn)
+        if item:
+            if self._old_rx.has_key(arfcn):
+                rx, old_scanned, old_result = self._old_rx[arfcn]
+                if item.times_scanned > 1:
+                    if item.times_scanned > old_scanned:
+                        #print 'evaluating rx change on %d(%d): old rx %d / new rx %d'%(item.times_scanned,arfcn, rx, item.rxlev)
+                        lower_bound = rx - math.fabs(rx * CH_RX_threshold)
+                        upper_bound = rx + math.fabs(rx * CH_RX_threshold)
+                        #print '     thresholds: %d/%d'%(lower_bound, upper_bound)
+                        if lower_bound <= item.rxlev <= upper_bound:
+                            self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.OK
+                            #print '     return ok'
+                            return RuleResult.OK
                         else:
-                            return old_result
+                            self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.CRITICAL
+                            #print '     return critical '
+                            return RuleResult.CRITICAL
                     else:
                         return old_result
                 else:
-                    self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.IGNORE
-                    return RuleResult.IGNORE
+                    return old_result
+            else:
+                self._old_rx[arfcn] = item.rxlev, item.times_scanned, RuleResult.IGNORE
+                return RuleResult.IGNORE
 
 class PCHRule (Rule):
     identifier = 'PCH Scan'
+    dependency = RuleDependency.STATION
 
-    def check(self, arfcn, base_station_list):
-        for item in base_station_list:
-            if arfcn == item.arfcn:
-                if not item.pch_scan_done:
-                    return RuleResult.IGNORE
+    def check_context(self, arfcn, context):
+        item = context.station(arfcn)
+        if item:
+            if not item.pch_scan_done:
+                return RuleResult.IGNORE
+            else:
+                if item.imm_ass_non_hop > 0:
+                    return RuleResult.CRITICAL
+                if item.pagings >= Pagings_per_10s_threshold and item.imm_ass_hop >= Assignment_limit:
+                    return RuleResult.OK
                 else:
-                    if item.imm_ass_non_hop > 0:
-                        return RuleResult.CRITICAL
-                    if item.pagings >= Pagings_per_10s_threshold and item.imm_ass_hop >= Assignment_limit:
-                        return RuleResult.OK
-                    else:
-                        return RuleResult.CRITICAL
+                    return RuleResult.CRITICAL
+
 
 
 
 
 
 
+def create_rules(location_database=None, cell_table=None):
+    #every rule in evaluation order, switched on as PyCatcher starts out. the database rules need a lookup first
+    rules = [ProviderRule(), CountryMappingRule(), ARFCNMappingRule(), LACMappingRule(), UniqueCellIDRule(),
+             LACMedianRule(), NeighbourhoodStructureRule(), PureNeighbourhoodRule(), DiscoveredNeighboursRule(),
+             CellIDDatabaseRule(), LocationAreaDatabaseRule(), LACChangeRule(), RxChangeRule(), PCHRule(),
+             SpatialPlausibilityRule()]
+    for rule in rules:
+        rule.is_active = not isinstance(rule, (CellIDDatabaseRule, LocationAreaDatabaseRule))
+        if isinstance(rule, CellIDDatabaseRule):
+            rule.cell_table = cell_table
+        elif isinstance(rule, LocationAreaDatabaseRule):
+            rule.location_database_object = location_database
+    return rules
@@ -0,0 +1,39 @@
+import sqlite3
+
+#the schema version of a database file is kept in sqlite's user_version header field, a file at version n
+#has had the first n migrations of its list applied
+
+def schema_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(connection, migrations):
+    #migrations is a list of functions taking a cursor, pending ones are applied in a single transaction so
+    #a failing migration leaves the file exactly as it was. returns the number of migrations applied
+    version = schema_version(connection)
+    if version > len(migrations):
+        raise ValueError('database schema version %d is newer than this version of PyCatcher (%d)'%
+                         (version, len(migrations)))
+    if version == len(migrations):
+        return 0
+    #the sqlite module commits implicitly before DDL statements, so the transaction is managed by hand
+    isolation_level = connection.isolation_level
+    connection.commit()
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for migration in migrations[version:]:
+                migration(cursor)
+            cursor.execute('PRAGMA user_version = %d'%len(migrations))
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+    finally:
+        cursor.close()
+        connection.isolation_level = isolation_level
+    return len(migrations) - version
+
+def table_columns(cursor, table):
+    return [row[1] for row in cursor.execute('PRAGMA table_info(%s)'%table).fetchall()]
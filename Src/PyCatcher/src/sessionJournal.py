@@ -0,0 +1,182 @@
+import os
+import struct
+import time
+import zlib
+import projectFormat
+from pyCatcherModel import BaseStationInformationList
+
+#file layout: header, then records of kind, payload length, payload and a crc32 over kind and payload. a snapshot
+#record holds a whole project in projectFormat, strings are defined by string records before the stations that
+#use them and are numbered from the last snapshot on
+_magic = 'PYCJ'
+_version = 1
+_header = struct.Struct('<4sH')
+_record_header = struct.Struct('<cI')
+_checksum = struct.Struct('<I')
+_pch = struct.Struct('<iiii')
+
+class JournalRecords:
+    SNAPSHOT = 'N'
+    STRING = 'T'
+    SIGHTING = 'S'
+    PCH = 'P'
+
+def is_journal_file(path):
+    journal = open(path, 'rb')
+    try:
+        return journal.read(len(_magic)) == _magic
+    finally:
+        journal.close()
+
+def _apply_sighting(station_list, station):
+    discovery_time = station.discovery_time
+    station_list.add_station(station)
+    #add_station stamps resightings with the current time, the journal knows when it happened
+    station_list.get_station(station.arfcn).discovery_time = discovery_time
+
+def _apply_pch(station_list, arfcn, assignments_non_hopping, assignments_hopping, pagings):
+    station = station_list.get_station(arfcn)
+    if station:
+        station.imm_ass_non_hop = assignments_non_hopping
+        station.imm_ass_hop = assignments_hopping
+        station.pagings = pagings
+        station.pch_scan_done = True
+        station_list.mark_dirty(station)
+
+def _replay(path):
+    #returns the station list, the strings in use, the end of the last intact record and the number of records
+    #since the last snapshot. a torn record at the end, left by a crash during a write, ends the replay
+    journal = open(path, 'rb')
+    try:
+        data = journal.read()
+    finally:
+        journal.close()
+    if len(data) < _header.size:
+        raise ValueError('%s is not a session journal'%path)
+    magic, version = _header.unpack_from(data, 0)
+    if magic != _magic:
+        raise ValueError('%s is not a session journal'%path)
+    if version != _version:
+        raise ValueError('%s has journal version %d, this version of PyCatcher reads %d'%(path, version, _version))
+    station_list = BaseStationInformationList()
+    strings = projectFormat.StringTable()
+    records = 0
+    offset = _header.size
+    while offset + _record_header.size <= len(data):
+        kind, length = _record_header.unpack_from(data, offset)
+        start = offset + _record_header.size
+        end = start + length
+        if end + _checksum.size > len(data):
+            break
+        if _checksum.unpack_from(data, end)[0] != zlib.crc32(kind + data[start:end]) & 0xffffffff:
+            break
+        if kind == JournalRecords.SNAPSHOT:
+            station_list = projectFormat.parse_project(data[start:end], path)
+            strings = projectFormat.StringTable()
+            records = 0
+        elif kind == JournalRecords.STRING:
+            strings.add(data[start:end])
+            records += 1
+        elif kind == JournalRecords.SIGHTING:
+            _apply_sighting(station_list, projectFormat.unpack_station(data, start, strings.strings))
+            records += 1
+        elif kind == JournalRecords.PCH:
+            _apply_pch(station_list, *_pch.unpack_from(data, start))
+            records += 1
+        offset = end + _checksum.size
+    return station_list, strings, offset, records
+
+def replay_journal(path):
+    return _replay(path)[0]
+
+class SessionJournal:
+    #write-ahead journal of a scan session. every record is handed to the operating system when it is appended,
+    #so a crash of PyCatcher loses nothing, fsync is batched over sync_records records or sync_interval seconds
+    def __init__(self, path, sync_records=50, sync_interval=2.0, compact_records=20000):
+        self._path = path
+        self._sync_records = sync_records
+        self._sync_interval = sync_interval
+        self._compact_records = compact_records
+        self._file = None
+        self._strings = projectFormat.StringTable()
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self.records = 0
+
+    def open(self):
+        #returns the replayed station list when the journal holds a previous session, otherwise None
+        station_list = None
+        if os.path.exists(self._path) and os.path.getsize(self._path) >= _header.size:
+            station_list, self._strings, end, self.records = _replay(self._path)
+            self._file = open(self._path, 'r+b')
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(self._path, 'wb')
+            self._file.write(_header.pack(_magic, _version))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        return station_list
+
+    def needs_compaction(self):
+        return self.records >= self._compact_records
+
+    def append_sighting(self, station):
+        known = len(self._strings.strings)
+        record = projectFormat.pack_station(station, self._strings)
+        for value in self._strings.strings[known:]:
+            self._write(JournalRecords.STRING, value)
+        self._write(JournalRecords.SIGHTING, record)
+
+    def append_pch(self, arfcn, assignments_non_hopping, assignments_hopping, pagings):
+        self._write(JournalRecords.PCH, _pch.pack(arfcn, assignments_non_hopping, assignments_hopping, pagings))
+
+    def _write(self, kind, payload):
+        self._file.write(_record_header.pack(kind, len(payload)) + payload +
+                         _checksum.pack(zlib.crc32(kind + payload) & 0xffffffff))
+        self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+        if self._unsynced >= self._sync_records or time.time() - self._synced_at >= self._sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._synced_at = time.time()
+
+    def compact(self, station_list):
+        #folds the journal into a single snapshot of station_list
+        self.compact_snapshot(projectFormat.dump_project(station_list))
+
+    def compact_snapshot(self, snapshot):
+        #snapshot is a project in projectFormat, the new journal replaces the old one atomically
+        temporary = self._path + '.tmp'
+        journal = open(temporary, 'wb')
+        try:
+            journal.write(_header.pack(_magic, _version))
+            journal.write(_record_header.pack(JournalRecords.SNAPSHOT, len(snapshot)) + snapshot +
+                          _checksum.pack(zlib.crc32(JournalRecords.SNAPSHOT + snapshot) & 0xffffffff))
+            journal.flush()
+            os.fsync(journal.fileno())
+        finally:
+            journal.close()
+        if self._file:
+            self._file.close()
+        os.rename(temporary, self._path)
+        self._file = open(self._path, 'ab')
+        self._strings = projectFormat.StringTable()
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self.records = 0
+
+    def close(self, remove=False):
+        if not self._file:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+        if remove:
+            os.remove(self._path)
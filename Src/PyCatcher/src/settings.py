@@ -3,6 +3,11 @@
 PyCatcher_settings = {'debug' : True,
                     }
 
+#graph_layout is either 'incremental' for the in-process layout or 'neato' to run graphviz on every redraw
+GUI_settings = {'max_updates_per_second' : 4,
+                'graph_layout' : 'incremental',
+               }
+
 Device_settings = { 'mobile_device' : '/dev/ttyUSB0',
                     'xor_type' : 'c123xor',
                     'firmware' : 'compal_e88',
@@ -19,6 +24,22 @@ Commands = {'osmocon_command' : [Osmocon_lib + '/host/osmocon/osmocon',
             'pch_command' : [Osmocon_lib + '/host/layer23/src/misc/pch_scan'],
            }
 
+#'live' drives the phone, 'record' also writes every driver line to the capture file,
+#'replay' feeds a capture back instead of the phone (speed 1.0 is real time, 0 as fast as possible)
+Driver_capture = {'mode' : 'live',
+                  'path' : '/home/tom/imsi-catcher-detection/Src/PyCatcher/Scans/session.cap',
+                  'speed' : 1.0,
+                 }
+
+#every sighting and PCH result is appended to the session journal, fsync is batched over sync_records records or
+#sync_interval seconds. a journal left behind by a crash is replayed on the next start, after compact_records records
+#it is folded into a snapshot
+Session_journal = {'path' : '/home/tom/imsi-catcher-detection/Src/PyCatcher/Scans/session.cpj',
+                   'sync_records' : 50,
+                   'sync_interval' : 2.0,
+                   'compact_records' : 20000,
+                  }
+
 #Rules Configuration -------------------------------------------------------------------------------------------
 
 Provider_list = ['T-Mobile', 'O2', 'Vodafone', 'E-Plus']
@@ -59,12 +80,25 @@ Assignment_limit = 0
 
 Neighbours_threshold = -1
 
+#a cell is implausible when it is further from the observer than distance_factor times the distance its rxlev
+#implies, eirp in dBm and reference_loss in dB at 1km for the log-distance path loss model
+Spatial_threshold = {'eirp' : 43,
+                     'reference_loss' : 126,
+                     'path_loss_exponent' : 3.5,
+                     'distance_factor' : 3.0,
+                     'min_distance' : 2000,
+                    }
+
+#observer coordinates (latitude, longitude) of the locations, used by the spatial plausibility rule
+Location_coordinates = {
+}
+
 #Evaluator Configuration ---------------------------------------------------------------------------------------
 
 Rule_Groups = [
     ['Provider Check', 'Country Provider Mapping', 'ARFCN Mapping', 'LAC Mapping', 'Unique CellID'],
     ['LAC Median Deviation', 'Neighbourhood Structure', 'Pure Neighbourhoods', 'Fully Discovered Neighbourhoods'],
-    ['Local Area Database','CellID Database'],
+    ['Local Area Database','CellID Database','Spatial Plausibility'],
     ['LAC Change Rule','rx Change Rule'],
     ['PCH Scan']
 ]
@@ -79,5 +113,41 @@ USR_timeout = 15
 
 Open_Cell_ID_Key = 'd7a5bc3f21b44d4bf93d1ec2b3f83dc4'
 
+#endpoints of the remote cell ID services, timeout in seconds per request
+Cell_ID_services = {'google_host' : 'www.google.com',
+                    'google_port' : 80,
+                    'open_cell_id_url' : 'http://www.opencellid.org/cell/get',
+                    'timeout' : 10,
+                   }
+
+#lookups run on a pool of workers, each service gets at most its limit of parallel requests
+Lookup_concurrency = {'workers' : 8,
+                      'limits' : {'Google' : 2, 'Open Cell ID' : 4},
+                     }
+
 Database_path = '/home/tom/imsi-catcher-detection/Src/PyCatcher/Databases/'
 
+#remote lookups are kept for positive_ttl (found) or negative_ttl (not in db) seconds
+Lookup_cache = {'path' : Database_path + 'lookup_cache.db',
+                'positive_ttl' : 30 * 24 * 3600,
+                'negative_ttl' : 24 * 3600,
+                'max_entries' : 100000,
+               }
+
+#per-sighting history of the location databases. sightings are written in batches of batch_size, compaction keeps
+#the 5th and 95th rxlev percentile over window seconds and drops sightings older than retention seconds. the
+#local area database rule uses the percentiles once a cell has min_samples sightings in the window
+Sighting_history = {'batch_size' : 500,
+                    'window' : 30 * 24 * 3600,
+                    'retention' : 90 * 24 * 3600,
+                    'min_samples' : 10,
+                   }
+
+#cell database imported from an OpenCellID dump with offlineCellDatabase.py, used before any remote service
+Offline_cell_database = Database_path + 'opencellid.db'
+
+#table of known cells written by cellTable.py, checked by the cell ID rule for stations that were not looked up
+Cell_table = Database_path + 'cells.bin'
+
+#seconds a fresh interpreter may take to import pyCatcherCore, checked by the core_import benchmark
+Core_import_budget = 0.1
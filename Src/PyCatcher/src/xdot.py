@@ -467,6 +467,99 @@ class Graph(Shape):
         return None
 
 
+class LayoutGraphBuilder:
+    """Build a Graph from node positions computed in-process, drawn the way
+    neato draws default ellipse nodes and straight edges."""
+
+    colors = {
+        'green': (0.0, 1.0, 0.0, 1.0),
+        'yellow': (1.0, 1.0, 0.0, 1.0),
+        'red': (1.0, 0.0, 0.0, 1.0),
+        'white': (1.0, 1.0, 1.0, 1.0),
+    }
+
+    def __init__(self, node_width=54.0, node_height=36.0, margin=8.0, fontsize=14.0):
+        self.rx = node_width/2
+        self.ry = node_height/2
+        self.margin = margin
+        self.fontsize = fontsize
+
+    def build(self, positions, nodes, edges):
+        """positions maps node names to layout coordinates, nodes maps names
+        to a fill color name or None, edges is a list of (source, target)."""
+        if not positions:
+            return Graph()
+        xs = [x for x, y in positions.itervalues()]
+        ys = [y for x, y in positions.itervalues()]
+        xoffset = self.rx + self.margin - min(xs)
+        yoffset = self.ry + self.margin - min(ys)
+
+        pen = Pen()
+        pen.fontsize = self.fontsize
+        node_by_name = {}
+        graph_nodes = []
+        for name, color in nodes.iteritems():
+            x, y = positions[name]
+            x += xoffset
+            y += yoffset
+            shapes = []
+            if color is not None:
+                fill_pen = pen.copy()
+                fill_pen.fillcolor = self.colors.get(color, self.colors['white'])
+                shapes.append(EllipseShape(fill_pen, x, y, self.rx, self.ry, filled=True))
+            shapes.append(EllipseShape(pen, x, y, self.rx, self.ry))
+            text = str(name)
+            shapes.append(TextShape(pen, x, y + 0.3*self.fontsize, TextShape.CENTER,
+                                    0.6*self.fontsize*len(text), text))
+            node = Node(x, y, 2*self.rx, 2*self.ry, shapes, None)
+            node_by_name[name] = node
+            graph_nodes.append(node)
+
+        fill_pen = pen.copy()
+        fill_pen.fillcolor = pen.color
+        graph_edges = []
+        for source, target in edges:
+            if source == target:
+                continue
+            src = node_by_name[source]
+            dst = node_by_name[target]
+            points = self._clip(src, dst)
+            if points is None:
+                continue
+            (x0, y0), (x1, y1), head = points
+            shapes = [LineShape(pen, [(x0, y0), (x1, y1)]),
+                      PolygonShape(fill_pen, head, filled=True),
+                      PolygonShape(pen, head)]
+            graph_edges.append(Edge(src, dst, [(x0, y0), (x1, y1)], shapes))
+
+        width = max(xs) - min(xs) + 2*(self.rx + self.margin)
+        height = max(ys) - min(ys) + 2*(self.ry + self.margin)
+        return Graph(width, height, (), graph_nodes, graph_edges)
+
+    def _clip(self, src, dst, arrow_length=10.0, arrow_width=3.5):
+        dx = dst.x - src.x
+        dy = dst.y - src.y
+        length = math.hypot(dx, dy)
+        if length < 1e-6:
+            return None
+        ux = dx/length
+        uy = dy/length
+        # distance from an ellipse center to its outline along the edge
+        border = 1.0/math.sqrt((ux/self.rx)**2 + (uy/self.ry)**2)
+        if length <= 2*border + arrow_length:
+            return None
+        x0 = src.x + ux*border
+        y0 = src.y + uy*border
+        tip_x = dst.x - ux*border
+        tip_y = dst.y - uy*border
+        x1 = tip_x - ux*arrow_length
+        y1 = tip_y - uy*arrow_length
+        head = [(tip_x, tip_y),
+                (x1 - uy*arrow_width, y1 + ux*arrow_width),
+                (x1 + uy*arrow_width, y1 - ux*arrow_width)]
+        return (x0, y0), (x1, y1), head
+
+
 class XDotAttrParser:
     """Parser for xdot drawing attributes.
     See also:
@@ -1495,6 +1588,10 @@ class DotWidget(gtk.DrawingArea):
         self.graph = parser.parse()
         self.zoom_image(self.zoom_ratio, center=True)
 
+    def set_graph(self, graph):
+        self.graph = graph
+        self.zoom_image(self.zoom_ratio, center=True)
+
     def reload(self):
         if self.openfilename is not None:
             try: